@@ -0,0 +1,97 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Measures the time taken to import the command line entry point, and fails
+if it exceeds a budget.
+
+On Python 3.7 and later, the cumulative import time of mozbitbar.main is
+taken from -X importtime. Older interpreters lack the option; the startup
+time of an interpreter importing mozbitbar.main, less that of an empty
+interpreter, is measured instead.
+
+    $ python benchmarks/bench_import.py [--budget MS] [-n RUNS]
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# milliseconds allowed for importing the entry point.
+DEFAULT_BUDGET = 50
+
+# modules which must not be loaded before a command runs.
+HEAVY_MODULES = ('yaml', 'testdroid', 'requests')
+
+
+def run(code, *options):
+    command = [sys.executable] + list(options) + ['-c', code]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode:
+        raise RuntimeError(stderr.decode('utf-8'))
+    return stdout.decode('utf-8'), stderr.decode('utf-8')
+
+
+def importtime(module):
+    """Returns the cumulative import time of a module from -X importtime,
+    in milliseconds."""
+    _, stderr = run('import {}'.format(module), '-X', 'importtime')
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000.0
+    raise RuntimeError('{} not found in -X importtime output'.format(module))
+
+
+def startup_time(module):
+    """Returns the startup time of an interpreter importing a module, less
+    that of an empty interpreter, in milliseconds."""
+    def wall(code):
+        start = time.time()
+        run(code)
+        return time.time() - start
+
+    return (wall('import {}'.format(module)) - wall('pass')) * 1000
+
+
+def loaded_heavy_modules(module):
+    stdout, _ = run('; '.join([
+        'import sys',
+        'import {}'.format(module),
+        'print(" ".join(sys.modules))',
+    ]))
+    loaded = set(name.split('.')[0] for name in stdout.split())
+    return sorted(loaded.intersection(HEAVY_MODULES))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                        help='Milliseconds allowed for the import.')
+    parser.add_argument('-n', '--runs', type=int, default=10,
+                        help='Runs, of which the median is reported.')
+    args = parser.parse_args()
+
+    measure = importtime if sys.version_info >= (3, 7) else startup_time
+    samples = sorted(measure('mozbitbar.main') for _ in range(args.runs))
+    median = samples[len(samples) // 2]
+    heavy = loaded_heavy_modules('mozbitbar.main')
+
+    print('import mozbitbar.main: {:.1f}ms (budget {:.0f}ms, {})'.format(
+        median, args.budget, measure.__name__))
+    if heavy:
+        print('heavy modules loaded: {}'.format(', '.join(heavy)))
+    return int(median > args.budget or bool(heavy))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Load-tests concurrent recipe execution, with one process per recipe as
+when many recipes are started at once.
+
+    $ python benchmarks/bench_load.py [-r recipe.yaml] [-c credentials.yaml]
+        [--target URL] [--concurrency 1,10,50,200] [-n ITERATIONS]
+        [-o results.json]
+
+Concurrency is ramped through the given steps. At every step, as many
+workers each run the recipe ITERATIONS times with run_recipe, and the step
+reports throughput, task latency percentiles, and CPU time and peak memory
+per worker.
+
+Without --target, recipes run against a fake Bitbar API served from a
+process of its own, with --latency added to every response; the default
+recipe then starts a test run on an existing project and waits for it.
+"""
+
+from __future__ import absolute_import, print_function
+
+import json
+import logging
+import math
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from argparse import ArgumentParser, Namespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mozbitbar import trace  # noqa: E402
+from mozbitbar.log import setup_logger  # noqa: E402
+from mozbitbar.run import run_recipe  # noqa: E402
+
+DEFAULT_CONCURRENCY = (1, 10, 50, 200)
+
+# recipe run against the fake Bitbar API.
+DEFAULT_RECIPE = """\
+- project: existing
+  arguments:
+    project_name: Project 0
+- action: set_project_parameters
+  arguments:
+    parameters:
+      - key: load_test
+        value: '1'
+- action: set_device_group
+  arguments:
+    group: 2000
+- action: start_test_run
+- action: notify_test_run_complete
+  arguments:
+    interval: 1
+    timeout: 60
+"""
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of values.
+
+    Args:
+        values (list): Values, in any order.
+        fraction (float): Percentile, between 0 and 1.
+
+    Returns:
+        float: The percentile, or None if there are no values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(math.ceil(fraction * len(ordered))), 1)
+    return ordered[rank - 1]
+
+
+def _serve(latency, addresses):
+    from mozbitbar.fake_server import FakeBitbar
+
+    server = FakeBitbar(latency={'*': latency})
+    addresses.put(server.url)
+    server.serve_forever()
+
+
+def _worker(recipe, credentials, iterations, results):
+    # Testdroid prints progress, and recipes log every task.
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    setup_logger(quiet=True).setLevel(logging.ERROR)
+    warnings.simplefilter('ignore')
+
+    tracer = trace.enable()
+    recipes = []
+    tasks = []
+    for _ in range(iterations):
+        del tracer.events[:]
+        start = time.time()
+        try:
+            run_recipe(recipe, Namespace(credentials=credentials))
+            failed = False
+        except (SystemExit, Exception):
+            failed = True
+        recipes.append({
+            'duration': time.time() - start,
+            'failed': failed,
+            'api_calls': len([event for event in tracer.events
+                              if event['cat'] == 'http']),
+        })
+        tasks.extend(event['dur'] / 1e6 for event in tracer.events
+                     if event['cat'] == 'task')
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    max_rss = usage.ru_maxrss
+    results.put({
+        'recipes': recipes,
+        'tasks': tasks,
+        'cpu': usage.ru_utime + usage.ru_stime,
+        # bytes on macOS, kilobytes elsewhere.
+        'max_rss_kb': max_rss // 1024 if sys.platform == 'darwin'
+        else max_rss,
+    })
+
+
+def run_step(concurrency, recipe, credentials, iterations):
+    """Runs the recipe from as many worker processes at once.
+
+    Returns:
+        dict: Statistics of the step.
+    """
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(
+        target=_worker, args=(recipe, credentials, iterations, results))
+        for _ in range(concurrency)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    # drained before joining, as workers block until their results are read.
+    reports = [results.get() for _ in workers]
+    wall_time = time.time() - start
+    for worker in workers:
+        worker.join()
+
+    recipes = [recipe_run for report in reports
+               for recipe_run in report['recipes']]
+    succeeded = [recipe_run for recipe_run in recipes
+                 if not recipe_run['failed']]
+    tasks = [task for report in reports for task in report['tasks']]
+    cpu = [report['cpu'] for report in reports]
+    max_rss = [report['max_rss_kb'] for report in reports]
+    return {
+        'concurrency': concurrency,
+        'recipes': len(recipes),
+        'failed': len(recipes) - len(succeeded),
+        'wall_time': wall_time,
+        'throughput': len(succeeded) / wall_time,
+        'recipe_p50': percentile([r['duration'] for r in succeeded], 0.5),
+        'task_p50': percentile(tasks, 0.5),
+        'task_p95': percentile(tasks, 0.95),
+        'task_p99': percentile(tasks, 0.99),
+        'api_calls': (sum(r['api_calls'] for r in recipes) /
+                      float(len(recipes))),
+        'worker_cpu_mean': sum(cpu) / len(cpu),
+        'worker_cpu_max': max(cpu),
+        'worker_rss_kb_mean': sum(max_rss) // len(max_rss),
+        'worker_rss_kb_max': max(max_rss),
+    }
+
+
+def _format(value, scale=1, digits=3):
+    if value is None:
+        return '-'
+    return '{:.{}f}'.format(value * scale, digits)
+
+
+def report(step):
+    print('{:>5} workers: {} recipes, {} failed in {}s, {} recipes/s, '
+          '{} calls/recipe'.format(
+              step['concurrency'], step['recipes'], step['failed'],
+              _format(step['wall_time'], digits=1),
+              _format(step['throughput'], digits=2),
+              _format(step['api_calls'], digits=1)))
+    print('       task latency p50/p95/p99: {}/{}/{} ms, '
+          'recipe p50: {}s'.format(
+              _format(step['task_p50'], 1000, 0),
+              _format(step['task_p95'], 1000, 0),
+              _format(step['task_p99'], 1000, 0),
+              _format(step['recipe_p50'], digits=2)))
+    print('       per worker: CPU {}s mean, {}s max; peak RSS {} MB mean, '
+          '{} MB max'.format(
+              _format(step['worker_cpu_mean'], digits=2),
+              _format(step['worker_cpu_max'], digits=2),
+              _format(step['worker_rss_kb_mean'], 1 / 1024.0, 1),
+              _format(step['worker_rss_kb_max'], 1 / 1024.0, 1)))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-r', '--recipe',
+                        help='Recipe to run. Defaults to a recipe for the '
+                             'fake Bitbar API.')
+    parser.add_argument('-c', '--credentials',
+                        help='Load Testdroid credentials from a file.')
+    parser.add_argument('--target',
+                        help='URL of the Bitbar API to load. Defaults to a '
+                             'local fake Bitbar API.')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds added to every response of the fake '
+                             'Bitbar API. Default: %(default)s.')
+    parser.add_argument('--concurrency',
+                        default=','.join(map(str, DEFAULT_CONCURRENCY)),
+                        help='Comma-separated numbers of concurrent '
+                             'workers. Default: %(default)s.')
+    parser.add_argument('-n', '--iterations', type=int, default=1,
+                        help='Recipes run by every worker per step. '
+                             'Default: %(default)s.')
+    parser.add_argument('-o', '--output',
+                        help='Path of the JSON file results are written to.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    server = None
+    recipe = args.recipe
+    try:
+        if args.target:
+            os.environ['TESTDROID_URL'] = args.target
+        else:
+            addresses = multiprocessing.Queue()
+            server = multiprocessing.Process(
+                target=_serve, args=(args.latency, addresses))
+            server.daemon = True
+            server.start()
+            os.environ.update({'TESTDROID_URL': addresses.get(),
+                               'TESTDROID_USERNAME': 'load_test',
+                               'TESTDROID_PASSWORD': 'load_test'})
+            os.environ.pop('TESTDROID_APIKEY', None)
+        if not recipe:
+            recipe = os.path.join(workdir, 'recipe.yaml')
+            with open(recipe, 'w') as f:
+                f.write(DEFAULT_RECIPE)
+
+        steps = []
+        for concurrency in [int(workers) for workers in
+                            args.concurrency.split(',')]:
+            step = run_step(concurrency, recipe, args.credentials,
+                            args.iterations)
+            report(step)
+            steps.append(step)
+    finally:
+        if server:
+            server.terminate()
+        shutil.rmtree(workdir)
+
+    sustained = [result['concurrency'] for result in steps
+                 if not result['failed']]
+    if sustained:
+        print('Highest concurrency without failures: {}'.format(
+            max(sustained)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'latency': args.latency, 'target': args.target,
+                       'steps': steps}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Measures the cost of logging per polled test run and per uploaded file,
+with DEBUG disabled, for eagerly built messages and for lazy %-style
+arguments.
+
+    $ python benchmarks/bench_logging.py [-n ITERATIONS]
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+import os
+import sys
+import timeit
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mozbitbar.bitbar_project import BitbarProject  # noqa: E402
+
+logger = logging.getLogger('mozbitbar')
+
+
+def eager_poll(test_run_name, total_wait_time):
+    # polling loop of notify_test_run_complete, as previously written.
+    logger.debug('Checking test run state for {}...'.format(test_run_name))
+    logger.debug('Waited {}s...'.format(total_wait_time))
+
+
+def lazy_poll(test_run_name, total_wait_time):
+    logger.debug('Checking test run state for %s...', test_run_name)
+    logger.debug('Waited %ss...', total_wait_time)
+
+
+def eager_file_on_local_disk(path):
+    # _file_on_local_disk, as previously written.
+    path = str(path)
+    logger.debug(' '.join(['Absolute path:', os.path.abspath(path)]))
+    return os.path.isfile(os.path.abspath(path))
+
+
+def measure(func, args, iterations):
+    """Returns the mean duration of a call, in microseconds."""
+    duration = timeit.timeit(lambda: func(*args), number=iterations)
+    return duration / iterations * 1e6
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    logger.setLevel(logging.INFO)
+    # _file_on_local_disk does not depend on the state of the project.
+    project = BitbarProject.__new__(BitbarProject)
+    path = os.path.relpath(__file__)
+
+    cases = [
+        ('per polled run', (eager_poll, lazy_poll),
+         ('mock_test_run_name', 300)),
+        ('per uploaded file', (eager_file_on_local_disk,
+                               project._file_on_local_disk), (path,)),
+    ]
+    header = ('', 'eager (us)', 'lazy (us)', 'speedup')
+    print('{:<20}{:>12}{:>12}{:>10}'.format(*header))
+    for name, (eager, lazy), call_args in cases:
+        before = measure(eager, call_args, args.iterations)
+        after = measure(lazy, call_args, args.iterations)
+        print('{:<20}{:>12.3f}{:>12.3f}{:>9.1f}x'.format(
+            name, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
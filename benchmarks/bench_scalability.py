@@ -0,0 +1,283 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Measures how the hot paths of BitbarProject scale with the size of the
+account, against a fake Bitbar API serving synthetic accounts.
+
+    $ python benchmarks/bench_scalability.py [--sizes 10,1000,100000]
+        [-n REPEAT] [-o results.json] [--baseline baseline.json]
+
+An account of size N holds N projects, one of which has N test runs and N
+parameters. Every operation is measured in a process of its own, for wall
+time, HTTP requests made and peak memory. Results are written as JSON;
+compared against a baseline, the script exits with a non-zero status when
+an operation became slower, made more requests or used more memory.
+"""
+
+from __future__ import absolute_import, print_function
+
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mozbitbar.fake_server import FakeBitbar  # noqa: E402
+
+DEFAULT_SIZES = (10, 1000, 100000)
+
+# project holding the test runs and parameters of the account.
+TARGET_PROJECT = 'Benchmark project'
+DEVICE_GROUP = 'Group 4'
+# parameters overwritten by set_project_parameters.
+OVERWRITTEN_PARAMETERS = 10
+
+# allowed growth of wall time and memory over the baseline, as a fraction.
+DEFAULT_TOLERANCE = 0.5
+# wall time differences below this many seconds are noise.
+TIME_RESOLUTION = 0.005
+
+
+# Operations #
+#
+# Each prepares the project, and returns the call to be measured.
+
+def use_existing_project(project, workdir):
+    return lambda: project.use_existing_project(project_name=TARGET_PROJECT)
+
+
+def set_device_group(project, workdir):
+    return lambda: project.set_device_group(DEVICE_GROUP)
+
+
+def is_test_name_unique(project, workdir):
+    return lambda: project._is_test_name_unique('Benchmark run')
+
+
+def set_project_parameters(project, workdir):
+    # overwritten parameters move to the end of the list; overwrite those
+    # listed first, as every measurement should.
+    listed = project.client.get_project_parameters(project.project_id)
+    parameters = [{'key': parameter['key'], 'value': 'overwritten'}
+                  for parameter in listed['data'][:OVERWRITTEN_PARAMETERS]]
+    return lambda: project.set_project_parameters(parameters,
+                                                  force_overwrite=True)
+
+
+def upload_file(project, workdir):
+    # a new name every time, so that the file is not already on Bitbar.
+    handle, path = tempfile.mkstemp(suffix='.zip', dir=workdir)
+    os.write(handle, b'\0' * 64 * 1024)
+    os.close(handle)
+    return lambda: project.upload_file(test_file=path)
+
+
+def notify_test_run_complete(project, workdir):
+    project.set_device_group(DEVICE_GROUP)
+    project.start_test_run(name='Benchmark run {}'.format(time.time()))
+    return lambda: project.notify_test_run_complete(interval=0, timeout=60)
+
+
+OPERATIONS = (
+    use_existing_project,
+    set_device_group,
+    is_test_name_unique,
+    set_project_parameters,
+    upload_file,
+    notify_test_run_complete,
+)
+
+
+def _resident_kb(field):
+    """Returns resident memory of the process, in kilobytes: current (VmRSS)
+    or peak (VmHWM). The peak of the process is used where /proc is not
+    available.
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere.
+    return max_rss // 1024 if sys.platform == 'darwin' else max_rss
+
+
+def _reset_peak():
+    # Linux resets VmHWM to the current resident memory.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def run_case(operation, project_id, repeat):
+    """Measures an operation, in the current process.
+
+    Credentials and the URL of the server are read from the environment.
+
+    Returns:
+        dict: Median wall time in seconds, HTTP requests made by one call,
+            and growth of resident memory during the call in kilobytes.
+    """
+    from mozbitbar import client
+    from mozbitbar.bitbar_project import BitbarProject
+
+    logging.getLogger('mozbitbar').addHandler(logging.NullHandler())
+    setup = dict((func.__name__, func) for func in OPERATIONS)[operation]
+
+    requests_made = []
+
+    def count_requests(send, request, **kwargs):
+        requests_made.append(request.url)
+        return send(request, **kwargs)
+
+    workdir = tempfile.mkdtemp()
+    wall_times = []
+    peak_memory = 0
+    try:
+        project = BitbarProject('existing', project_id=project_id)
+        client.add_transport_hook(count_requests)
+        for _ in range(repeat):
+            call = setup(project, workdir)
+            del requests_made[:]
+            _reset_peak()
+            resident = _resident_kb('VmRSS')
+            start = time.time()
+            call()
+            wall_times.append(time.time() - start)
+            peak_memory = max(peak_memory, _resident_kb('VmHWM') - resident)
+    finally:
+        client.remove_transport_hook(count_requests)
+        shutil.rmtree(workdir)
+
+    return {
+        'wall_time': sorted(wall_times)[len(wall_times) // 2],
+        'api_calls': len(requests_made),
+        'peak_memory_kb': peak_memory,
+    }
+
+
+def run_size(size, repeat):
+    """Measures every operation against an account of the given size.
+
+    Returns:
+        list: Results of the operations.
+    """
+    sizes = {'projects': size - 1, 'runs_per_project': 0,
+             'parameters_per_project': 0}
+    results = []
+    with FakeBitbar(sizes=sizes) as server:
+        target = server.add_project(TARGET_PROJECT, runs=size,
+                                    parameters=size)
+        env = dict(os.environ, TESTDROID_URL=server.url,
+                   TESTDROID_USERNAME='benchmark',
+                   TESTDROID_PASSWORD='benchmark',
+                   # polls made without interval would share their responses.
+                   MOZBITBAR_COALESCE_WINDOW='0')
+        env.pop('TESTDROID_APIKEY', None)
+        for operation in OPERATIONS:
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--case', operation.__name__,
+                 '--project-id', str(target['id']), '-n', str(repeat)],
+                env=env)
+            # Testdroid prints progress; the result is the last line.
+            result = json.loads(output.decode('utf-8').splitlines()[-1])
+            result.update({'operation': operation.__name__, 'size': size})
+            results.append(result)
+            print('{operation:<26} {size:>7} {wall_time:>9.4f}s '
+                  '{api_calls:>5} calls {peak_memory_kb:>8} KB'.format(
+                      **result))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compares results against a baseline.
+
+    Returns:
+        list: Descriptions of the regressions.
+    """
+    expected = dict(((result['operation'], result['size']), result)
+                    for result in baseline['results'])
+    regressions = []
+    for result in results:
+        previous = expected.get((result['operation'], result['size']))
+        if previous is None:
+            continue
+        case = '{} at {}'.format(result['operation'], result['size'])
+        if (result['wall_time'] > previous['wall_time'] * (1 + tolerance) and
+                result['wall_time'] - previous['wall_time'] >
+                TIME_RESOLUTION):
+            regressions.append('{}: {:.4f}s, was {:.4f}s'.format(
+                case, result['wall_time'], previous['wall_time']))
+        if result['api_calls'] > previous['api_calls']:
+            regressions.append('{}: {} API calls, was {}'.format(
+                case, result['api_calls'], previous['api_calls']))
+        if (result['peak_memory_kb'] >
+                max(previous['peak_memory_kb'], 1024) * (1 + tolerance)):
+            regressions.append('{}: {} KB peak memory, was {} KB'.format(
+                case, result['peak_memory_kb'], previous['peak_memory_kb']))
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Comma-separated account sizes. '
+                             'Default: %(default)s.')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='Measurements per operation; the median wall '
+                             'time is kept. Default: %(default)s.')
+    parser.add_argument('-o', '--output',
+                        help='Path of the JSON file results are written to.')
+    parser.add_argument('--baseline',
+                        help='Path of results to compare against.')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed growth of wall time and memory over '
+                             'the baseline. Default: %(default)s.')
+    parser.add_argument('--case', help='Operation measured in a child '
+                                       'process.')
+    parser.add_argument('--project-id', type=int)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.project_id, args.repeat)))
+        return 0
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(',')]:
+        results.extend(run_size(size, args.repeat))
+
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': int(time.time()),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('Regression: {}'.format(regression))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
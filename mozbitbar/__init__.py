@@ -89,3 +89,19 @@ class MozbitbarOperationNotImplementedException(MozbitbarBaseException):
         """
         super(MozbitbarOperationNotImplementedException, self).__init__(
             **kwargs)
+
+
+class MozbitbarCircuitOpenException(MozbitbarBaseException):
+    def __init__(self, **kwargs):
+        """MozbitbarCircuitOpenException will be raised if calls to a Bitbar
+        endpoint are stopped after sustained transient failures.
+        """
+        super(MozbitbarCircuitOpenException, self).__init__(**kwargs)
+
+
+class MozbitbarCassetteException(MozbitbarBaseException):
+    def __init__(self, **kwargs):
+        """MozbitbarCassetteException will be raised if a request replayed
+        from a cassette was never recorded.
+        """
+        super(MozbitbarCassetteException, self).__init__(**kwargs)
@@ -4,16 +4,602 @@
 
 from __future__ import print_function, absolute_import
 
+import json
+import logging
+import sqlite3
+import time
+from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
+
+from mozbitbar import pool
 from mozbitbar.configuration import Configuration
 
 
+logger = logging.getLogger('mozbitbar')
+
+# items requested per page when paginating through a collection.
+DEFAULT_PAGE_SIZE = 100
+
+# concurrent requests made while crawling the account.
+DEFAULT_WORKERS = 8
+
+# account-wide collections, as (kind, path, payload).
+_account_collections = (
+    ('project', 'me/projects', {}),
+    ('device_group', 'me/device-groups', {}),
+    ('device', 'devices', {}),
+    ('input_file', 'me/files', {'filter': 's_direction_eq_INPUT'}),
+)
+
+# path of a resource deleted by cleanup, keyed by kind.
+_delete_paths = {
+    'project': 'me/projects/{id}',
+    'test_run': 'me/projects/{parent_id}/runs/{id}',
+    'input_file': 'me/files/{id}',
+}
+
+# kinds considered by cleanup when not specified.
+CLEANUP_KINDS = ('project', 'test_run', 'input_file')
+
+
+def _pooled_project_ids():
+    """Returns the ids of the projects tracked by the project pool, if one
+    is configured.
+    """
+    path = pool.pool_path()
+    if not path:
+        return set()
+    with pool.ProjectPool(path) as project_pool:
+        return project_pool.project_ids()
+
+
+class NDJSONSink(object):
+    """NDJSONSink writes inventory records to a file, one JSON object per
+    line.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w')
+
+    def write(self, kind, records, parent_id=None):
+        for record in records:
+            line = {'kind': kind, 'parent_id': parent_id, 'data': record}
+            self._file.write(json.dumps(line, sort_keys=True) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+class SQLiteSink(object):
+    """SQLiteSink writes inventory records to a SQLite database, in a table
+    keyed by kind and id. Records from a previous snapshot are replaced.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS inventory ('
+            'kind TEXT NOT NULL, id INTEGER NOT NULL, parent_id INTEGER, '
+            'data TEXT NOT NULL, PRIMARY KEY (kind, id))')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS inventory_parent '
+            'ON inventory (kind, parent_id)')
+
+    def write(self, kind, records, parent_id=None):
+        self._connection.executemany(
+            'INSERT OR REPLACE INTO inventory VALUES (?, ?, ?, ?)',
+            [(kind, record.get('id'), parent_id,
+              json.dumps(record, sort_keys=True)) for record in records])
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+
+def open_sink(path, output_format=None):
+    """Opens an inventory sink.
+
+    Args:
+        path (str): Path of the output file.
+        output_format (str, optional): 'ndjson' or 'sqlite'. If not
+            specified, guessed from the file extension, defaulting to
+            'ndjson'.
+
+    Returns:
+        :obj:`NDJSONSink` or :obj:`SQLiteSink`: Sink writing to the path.
+
+    Raises:
+        ValueError: If output_format is not supported.
+    """
+    if output_format is None:
+        is_sqlite = path.endswith(('.db', '.sqlite', '.sqlite3'))
+        output_format = 'sqlite' if is_sqlite else 'ndjson'
+
+    if output_format == 'sqlite':
+        return SQLiteSink(path)
+    elif output_format == 'ndjson':
+        return NDJSONSink(path)
+    raise ValueError('Unsupported inventory format: {}'.format(output_format))
+
+
 class Bitbar(Configuration):
     """Bitbar is a class which represents an instance of Bitbar.
 
     In a distinction from BitbarProject, methods implemented in
     Bitbar can be called without requiring a project id.
     """
-    def __init__(self):
+    def __init__(self, **kwargs):
         """Initializes the Bitbar class.
+
+        Args:
+            **kwargs: Testdroid credentials, named in the same manner as
+                the environment variables. If not specified, credentials
+                are read from the environment.
+        """
+        super(Bitbar, self).__init__(**kwargs)
+
+    # Inventory operations #
+
+    def _get_page(self, task):
+        """Fetches one page of a collection.
+
+        Args:
+            task (tuple): Kind, path, payload, parent id, offset and
+                page size of the page.
+
+        Returns:
+            tuple: The task and the response of Bitbar.
+        """
+        kind, path, payload, parent_id, offset, limit = task
+        page_payload = dict(payload, offset=offset, limit=limit)
+        return task, self.client.get(path=path, payload=page_payload)
+
+    def _crawl(self, pool, collections, sink, page_size):
+        """Fetches every page of the collections and writes their records.
+
+        First pages are fetched concurrently; their totals determine the
+        remaining pages, which are fetched concurrently in turn. Collections
+        listed without a total are paged on until a page is empty or
+        shorter than page_size, one page of each at a time. Records are
+        written from the calling thread, in page order for every collection.
+
+        Args:
+            pool (:obj:`ThreadPool`): Pool making the requests.
+            collections (list): Kind, path, payload and parent id of every
+                collection to fetch.
+            sink (:obj:`NDJSONSink` or :obj:`SQLiteSink`): Record
+                destination, or None to only return the records.
+            page_size (int): Items requested per page.
+
+        Returns:
+            dict: Records fetched, keyed by kind.
+        """
+        records = {kind: [] for (kind, _, _, _) in collections}
+
+        def collect(task, response):
+            kind, _, _, parent_id, _, _ = task
+            data = response.get('data', [])
+            if sink:
+                sink.write(kind, data, parent_id)
+            records[kind].extend(data)
+            return data
+
+        first_pages = [(kind, path, payload, parent_id, 0, page_size)
+                       for (kind, path, payload, parent_id) in collections]
+        remaining_pages = []
+        # last pages fetched of the collections without a total.
+        unbounded = []
+
+        for task, response in pool.imap_unordered(self._get_page,
+                                                  first_pages):
+            kind, path, payload, parent_id, _, _ = task
+            data = collect(task, response)
+            total = response.get('total')
+            if total is None:
+                if len(data) >= page_size:
+                    unbounded.append(task)
+                continue
+            remaining_pages.extend(
+                (kind, path, payload, parent_id, offset, page_size)
+                for offset in range(len(data), total, page_size))
+
+        # in order, so that items of a collection keep the order of Bitbar.
+        for task, response in pool.imap(self._get_page, remaining_pages):
+            collect(task, response)
+
+        while unbounded:
+            # the page following the last one, of the same size.
+            next_pages = [task[:4] + (task[4] + task[5], task[5])
+                          for task in unbounded]
+            unbounded = []
+            for task, response in pool.imap(self._get_page, next_pages):
+                if len(collect(task, response)) >= page_size:
+                    unbounded.append(task)
+
+        return records
+
+    def fetch_all(self, path, payload=None, workers=DEFAULT_WORKERS,
+                  page_size=DEFAULT_PAGE_SIZE):
+        """Fetches every item of a paginated collection.
+
+        Args:
+            path (str): Path of the collection, relative to the API root.
+            payload (dict, optional): Additional query parameters.
+            workers (int, optional): Maximum concurrent requests.
+            page_size (int, optional): Items requested per page.
+
+        Returns:
+            list: Items of the collection.
+        """
+        pool = ThreadPool(workers)
+        try:
+            records = self._crawl(pool, [('item', path, payload or {}, None)],
+                                  None, page_size)
+        finally:
+            pool.close()
+            pool.join()
+        return records['item']
+
+    def snapshot_inventory(self, path, output_format=None,
+                           workers=DEFAULT_WORKERS,
+                           page_size=DEFAULT_PAGE_SIZE):
+        """Writes a snapshot of the account inventory to a file.
+
+        The inventory holds all projects and their test runs, device groups,
+        devices and input files. Collections are fetched in parallel pages by
+        a bounded pool of workers.
+
+        Args:
+            path (str): Path of the output file.
+            output_format (str, optional): 'ndjson' or 'sqlite'. If not
+                specified, guessed from the file extension.
+            workers (int, optional): Maximum concurrent requests.
+            page_size (int, optional): Items requested per page.
+
+        Returns:
+            dict: Count of records written, keyed by kind.
+        """
+        sink = open_sink(path, output_format)
+        pool = ThreadPool(workers)
+        try:
+            collections = [(kind, collection_path, payload, None)
+                           for (kind, collection_path, payload)
+                           in _account_collections]
+            records = self._crawl(pool, collections, sink, page_size)
+
+            run_collections = [
+                ('test_run', 'me/projects/{}/runs'.format(project['id']), {},
+                 project['id'])
+                for project in records.get('project', [])]
+            records.update(self._crawl(pool, run_collections, sink,
+                                       page_size))
+        finally:
+            pool.close()
+            pool.join()
+            sink.close()
+
+        counts = {kind: len(data) for (kind, data) in records.items()}
+        logger.info('Inventory written to %s: %s', path, counts)
+        return counts
+
+    # Cleanup operations #
+
+    def plan_cleanup(self, older_than=None, name=None, unused=False,
+                     kinds=CLEANUP_KINDS, workers=DEFAULT_WORKERS,
+                     page_size=DEFAULT_PAGE_SIZE, now=None):
+        """Computes which projects, test runs and input files to delete.
+
+        A resource is planned for deletion if it matches every filter
+        specified; at least one filter must apply to every kind considered.
+        Test runs which have not finished are never planned, nor are test
+        runs of projects already planned for deletion, nor projects tracked
+        by the project pool, if the MOZBITBAR_PROJECT_POOL environment
+        variable is set.
+
+        Args:
+            older_than (float, optional): Minimum age in days, measured from
+                the creation time.
+            name (str, optional): Shell-style pattern matched against the
+                name of the resource.
+            unused (bool, optional): If True, only projects without any test
+                run newer than older_than, or without any test run at all,
+                are planned. Does not apply to test runs and input files.
+            kinds (tuple, optional): Kinds of resource to consider, out of
+                'project', 'test_run' and 'input_file'.
+            workers (int, optional): Maximum concurrent requests.
+            page_size (int, optional): Items requested per page.
+            now (float, optional): Reference time, in seconds since epoch.
+
+        Returns:
+            list: Resources to delete, as dicts holding the kind, id, name
+                and parent_id of each.
+
+        Raises:
+            ValueError: If no filter applies to one of the kinds, which
+                would plan the deletion of all its resources.
+        """
+        # unused only filters projects.
+        unfiltered = [kind for kind in kinds
+                      if not (older_than or name or
+                              (unused and kind == 'project'))]
+        if unfiltered:
+            raise ValueError('Refusing to delete every {}: filter by age '
+                             'or name.'.format(', '.join(unfiltered)))
+        now = time.time() if now is None else now
+        # Bitbar timestamps are in milliseconds.
+        cutoff = (now - older_than * 86400) * 1000 if older_than else None
+
+        def matches(record, name_key):
+            if cutoff and record.get('createTime', 0) > cutoff:
+                return False
+            if name and not fnmatch(record.get(name_key) or '', name):
+                return False
+            return True
+
+        fetch_runs = 'test_run' in kinds or ('project' in kinds and unused)
+        # test runs are listed per project.
+        fetched = set(kinds) | (set(['project']) if fetch_runs else set())
+        collections = [(kind, path, payload, None)
+                       for (kind, path, payload) in _account_collections
+                       if kind in fetched]
+
+        pool = ThreadPool(workers)
+        try:
+            records = self._crawl(pool, collections, None, page_size)
+            runs = {}
+            if fetch_runs:
+                run_collections = [
+                    ('test_run', 'me/projects/{}/runs'.format(project['id']),
+                     {}, project['id'])
+                    for project in records['project']]
+                # group the runs per project from the fetched pages.
+                sink = _RunsByProject(runs)
+                self._crawl(pool, run_collections, sink, page_size)
+        finally:
+            pool.close()
+            pool.join()
+
+        plan = []
+        deleted_projects = set()
+        if 'project' in kinds:
+            pooled = _pooled_project_ids()
+            for project in records['project']:
+                if project['id'] in pooled:
+                    logger.debug('Keeping project %s of the project pool.',
+                                 project['id'])
+                    continue
+                if not matches(project, 'name'):
+                    continue
+                if unused and any(run.get('createTime', 0) > (cutoff or 0)
+                                  for run in runs.get(project['id'], [])):
+                    continue
+                deleted_projects.add(project['id'])
+                plan.append({'kind': 'project', 'id': project['id'],
+                             'name': project.get('name'), 'parent_id': None})
+
+        if 'test_run' in kinds:
+            for project_id, project_runs in sorted(runs.items()):
+                if project_id in deleted_projects:
+                    continue
+                for run in project_runs:
+                    if run.get('state') not in (None, 'FINISHED'):
+                        continue
+                    if not matches(run, 'displayName'):
+                        continue
+                    plan.append({'kind': 'test_run', 'id': run['id'],
+                                 'name': run.get('displayName'),
+                                 'parent_id': project_id})
+
+        if 'input_file' in kinds:
+            for input_file in records['input_file']:
+                if matches(input_file, 'name'):
+                    plan.append({'kind': 'input_file', 'id': input_file['id'],
+                                 'name': input_file.get('name'),
+                                 'parent_id': None})
+
+        logger.info('Cleanup plan: %d resources to delete.', len(plan))
+        return plan
+
+    def _delete(self, entry):
+        """Deletes one resource of a cleanup plan.
+
+        Args:
+            entry (dict): Entry of the cleanup plan.
+
+        Returns:
+            tuple: The entry, and the error raised by Bitbar or None.
+        """
+        path = _delete_paths[entry['kind']].format(**entry)
+        try:
+            self.client.delete(path=path)
+        except Exception as e:
+            return entry, e
+        return entry, None
+
+    def cleanup(self, older_than=None, name=None, unused=False,
+                kinds=CLEANUP_KINDS, dry_run=True, workers=DEFAULT_WORKERS,
+                progress=None):
+        """Deletes stale projects, test runs and input files.
+
+        The resources to delete are determined by plan_cleanup. Deletions
+        are made concurrently, and are subject to the client rate limit. A
+        failed deletion is reported and does not stop the others.
+
+        Args:
+            older_than (float, optional): Minimum age in days.
+            name (str, optional): Shell-style pattern matched against the
+                name of the resource.
+            unused (bool, optional): If True, only delete projects without
+                recent test runs.
+            kinds (tuple, optional): Kinds of resource to consider.
+            dry_run (bool, optional): If True, only compute and log the
+                plan.
+            workers (int, optional): Maximum concurrent requests.
+            progress (callable, optional): Called with the count of
+                processed and planned deletions after each deletion. By
+                default, progress is logged every 5%.
+
+        Returns:
+            list: The plan. Unless dry_run, each entry holds the outcome of
+                its deletion under the 'deleted' key.
+
+        Raises:
+            ValueError: If no filter applies to one of the kinds.
+        """
+        plan = self.plan_cleanup(older_than=older_than, name=name,
+                                 unused=unused, kinds=kinds, workers=workers)
+        for entry in plan:
+            logger.info('%s %s %s (%s)',
+                        'Would delete' if dry_run else 'Deleting',
+                        entry['kind'], entry['id'], entry['name'])
+        if dry_run or not plan:
+            return plan
+
+        if progress is None:
+            step = max(1, len(plan) // 20)
+
+            def progress(done, total):
+                if done % step == 0 or done == total:
+                    logger.info('Cleanup progress: %d/%d', done, total)
+
+        pool = ThreadPool(workers)
+        try:
+            results = pool.imap_unordered(self._delete, plan)
+            for done, (entry, error) in enumerate(results, 1):
+                entry['deleted'] = error is None
+                if error is not None:
+                    logger.warning('Failed to delete %s %s: %s',
+                                   entry['kind'], entry['id'], error)
+                progress(done, len(plan))
+        finally:
+            pool.close()
+            pool.join()
+
+        return plan
+
+    # History operations #
+
+    def _new_runs(self, project_id, watermark, page_size):
+        """Lists the runs of a project newer than a watermark.
+
+        Pages are requested newest first, and listing stops at the first
+        run at or below the watermark. Should Bitbar not sort the runs, every
+        page is listed.
+
+        Returns:
+            list: Runs newer than the watermark.
+        """
+        path = 'me/projects/{}/runs'.format(project_id)
+        runs = []
+        offset = 0
+        ordered = True
+        while True:
+            response = self.client.get(path=path, payload={
+                'offset': offset, 'limit': page_size, 'sort': 'id_d'})
+            data = response.get('data', [])
+            ordered = ordered and all(run['id'] > following['id'] for
+                                      (run, following) in zip(data, data[1:]))
+            runs.extend(run for run in data
+                        if watermark is None or run['id'] > watermark)
+            offset += len(data)
+            total = response.get('total')
+            if total is None:
+                # without a total, only a short page tells the last one.
+                exhausted = len(data) < page_size
+            else:
+                exhausted = offset >= total
+            if not data or exhausted or (ordered and len(runs) < offset):
+                return runs
+
+    def _sync_project(self, task):
+        """Fetches the runs of a project which changed since the last sync.
+
+        Args:
+            task (tuple): Id of the project, its watermark, the ids of its
+                runs which had not finished, and the page size.
+
+        Returns:
+            tuple: Id of the project, and the changed runs with the device
+                sessions of those which finished.
         """
-        super(Bitbar, self).__init__()
+        project_id, watermark, pending, page_size = task
+        runs = self._new_runs(project_id, watermark, page_size)
+        listed = set(run['id'] for run in runs)
+        runs.extend(self.client.get_test_run(project_id, run_id)
+                    for run_id in pending if run_id not in listed)
+
+        changes = []
+        for run in runs:
+            device_runs = None
+            if run.get('state') == 'FINISHED':
+                device_runs = self.client.get_device_runs(
+                    project_id, run['id'])['data']
+            changes.append((dict(run, projectId=project_id), device_runs))
+        return project_id, changes
+
+    def sync_history(self, history, project_ids=None, full=False,
+                     workers=DEFAULT_WORKERS, page_size=DEFAULT_PAGE_SIZE):
+        """Records the test runs of the account in a history database.
+
+        Syncs are incremental: only runs created since the previous sync of
+        a project are listed, newest first, and runs which had not finished
+        then are refreshed one by one, so that a sync costs requests in
+        proportion to the runs which changed. Device sessions are fetched
+        for the runs which finished. Projects are synced concurrently.
+
+        Args:
+            history (:obj:`RunHistory`): Database the runs are recorded in.
+            project_ids (list, optional): Ids of the projects whose runs are
+                recorded. Defaults to every project of the account.
+            full (bool, optional): If True, every run is listed again, as
+                on a first sync.
+            workers (int, optional): Maximum concurrent requests.
+            page_size (int, optional): Items requested per page.
+
+        Returns:
+            dict: Count of projects synced, and of runs recorded.
+        """
+        pool = ThreadPool(workers)
+        try:
+            names = {}
+            if project_ids is None:
+                projects = self._crawl(
+                    pool, [('project', 'me/projects', {}, None)], None,
+                    page_size)['project']
+                names = {project['id']: project.get('name')
+                         for project in projects}
+                project_ids = sorted(names)
+
+            tasks = [(project_id,
+                      None if full else history.watermark(project_id),
+                      history.pending_runs(project_id), page_size)
+                     for project_id in project_ids]
+            recorded = 0
+            # records are written from this thread, which owns the database.
+            for project_id, changes in pool.imap_unordered(
+                    self._sync_project, tasks):
+                for run, device_runs in changes:
+                    history.record_run(run, device_runs,
+                                       project_name=names.get(project_id))
+                recorded += len(changes)
+                if changes:
+                    watermark = max(run['id'] for (run, _) in changes)
+                    history.set_watermark(
+                        project_id,
+                        max(watermark, history.watermark(project_id) or 0))
+        finally:
+            pool.close()
+            pool.join()
+
+        counts = {'projects': len(project_ids), 'recorded': recorded}
+        logger.info('History synced to %s: %s', history.path, counts)
+        return counts
+
+
+class _RunsByProject(object):
+    """Collects crawled test runs into a dict keyed by project id."""
+    def __init__(self, runs):
+        self.runs = runs
+
+    def write(self, kind, records, parent_id=None):
+        self.runs.setdefault(parent_id, []).extend(records)
@@ -7,29 +7,29 @@ from __future__ import absolute_import, print_function
 import json
 import logging
 import os
+import sqlite3
 import time
 from uuid import uuid4
 
 from testdroid import RequestResponseError
 
-try:
-    from mozbitbar import (MozbitbarDeviceException, MozbitbarFileException,
-                           MozbitbarFrameworkException,
-                           MozbitbarProjectException,
-                           MozbitbarTestRunException)
-except ImportError:
-    from __init__ import (MozbitbarDeviceException, MozbitbarFileException,
-                          MozbitbarFrameworkException,
-                          MozbitbarProjectException,
-                          MozbitbarTestRunException)
-try:
-    from mozbitbar.configuration import Configuration
-except ImportError:
-    from configuration import Configuration
+from mozbitbar import (MozbitbarBaseException, MozbitbarDeviceException,
+                       MozbitbarFileException, MozbitbarFrameworkException,
+                       MozbitbarProjectException, MozbitbarTestRunException)
+from mozbitbar import history, pool, runqueue
+from mozbitbar.configuration import Configuration
+from mozbitbar.logtail import DeviceLogTail
+from mozbitbar.results import summarize_test_run
+from mozbitbar.scheduler import Scheduler
 
 
 logger = logging.getLogger('mozbitbar')
 
+# poll interval and timeout of notify_test_run_complete, in seconds, when
+# neither the recipe nor the history of past runs sets them.
+DEFAULT_POLL_INTERVAL = 30
+DEFAULT_RUN_TIMEOUT = 300
+
 
 class BitbarProject(Configuration):
     """BitbarProject is a class which represents an instance of a project on
@@ -42,9 +42,10 @@ class BitbarProject(Configuration):
     def __init__(self, project_status, **kwargs):
         """Initializes the BitbarProject class instance.
 
-        Two methods of are currently supported:
+        Three methods of are currently supported:
             - new project ('new')
             - use of existing project ('existing')
+            - lease of a pre-configured project from the pool ('pool')
 
         If a new project is specified, project_type and project_name attributes
         must be provided.
@@ -53,13 +54,13 @@ class BitbarProject(Configuration):
         project_id must be specified.
 
         Args:
-            project_status (str): Expected to be 'new' or 'existing'.
-                Raises an exception on any other input.
+            project_status (str): Expected to be 'new', 'existing' or
+                'pool'. Raises an exception on any other input.
             **kwargs: Arbitrary keyword arguments.
 
         Raises:
             MozbitbarProjectException: If project_status has value other
-                than 'new' or 'existing'.
+                than 'new', 'existing' or 'pool'.
         """
         # all keys that are credentials-related are shoved into a new dict
         credentials = {key: value for (key, value) in kwargs.iteritems()
@@ -73,9 +74,17 @@ class BitbarProject(Configuration):
         self.device_name = None
         self.__framework_id = None
         self.__framework_name = None
+        # run queue entries holding the slots of started test runs, keyed by
+        # test run id.
+        self._queue_entries = {}
+
+        # new dict with credentails-related keys removed; values of pooled
+        # project templates are not hashable.
+        new_kwargs = {key: value for (key, value) in kwargs.iteritems()
+                      if key not in credentials}
 
-        # new dict with credentails-related keys removed using intersect
-        new_kwargs = dict(set(kwargs.items()) ^ set(credentials.items()))
+        # template of the leased project, if leased from the project pool.
+        self._lease = None
 
         if 'new' in project_status:
             logger.debug('Create new project')
@@ -83,6 +92,9 @@ class BitbarProject(Configuration):
         elif 'existing' in project_status:
             logger.debug('Use existing project')
             self.use_existing_project(**new_kwargs)
+        elif 'pool' in project_status:
+            logger.debug('Lease project from the pool')
+            self.lease_project(**new_kwargs)
         else:
             msg = 'Invalid project status: {}'.format(project_status)
             raise MozbitbarProjectException(message=msg)
@@ -238,6 +250,11 @@ class BitbarProject(Configuration):
                    querying project.'
             raise MozbitbarProjectException(message=msg)
 
+        if response.get('frameworkId') is not None:
+            # project listings carry the framework, which saves a read when
+            # reconciling the project framework later on.
+            self.framework_id = response['frameworkId']
+
     def get_user_id(self):
         """Retrieves the user id for the currently authenticated user.
 
@@ -264,9 +281,9 @@ class BitbarProject(Configuration):
         Returns:
             bool: True if path is found on local disk. False otherwise.
         """
-        path = str(path)
-        logger.debug(' '.join(['Absolute path:', os.path.abspath(path)]))
-        return os.path.isfile(os.path.abspath(path))
+        path = os.path.abspath(str(path))
+        logger.debug('Absolute path: %s', path)
+        return os.path.isfile(path)
 
     def _open_file(self, path):
         """Given a path, opens the file and reads its contents.
@@ -417,21 +434,16 @@ class BitbarProject(Configuration):
 
         if path and not new_values:
             if not self._file_on_local_disk(path):
-                msg = 'Specified path not found on disk: {}'.format(path)
-                logger.error(msg)
+                logger.error('Specified path not found on disk: %s', path)
                 return
 
             new_values = self._load_project_config(os.path.abspath(path))
 
-        existing_configs = self.get_project_configs()
+        new_values = self._changed_project_configs(
+            new_values, self.get_project_configs())
 
-        for key in list(new_values.keys()):
-            if new_values.get(key) == existing_configs.get(key):
-                new_values.pop(key)
-
-        if len(new_values) is 0:
-            msg = 'No project configuration values need to be updated'
-            logger.info(msg)
+        if len(new_values) == 0:
+            logger.info('No project configuration values need to be updated')
             return
 
         try:
@@ -442,6 +454,20 @@ class BitbarProject(Configuration):
         except ValueError as ve:
             raise MozbitbarProjectException(message=ve.args)
 
+    def _changed_project_configs(self, new_values, existing_configs):
+        """Filters out configuration values that would remain unchanged.
+
+        Args:
+            new_values (:obj:`dict`): Desired project configuration values.
+            existing_configs (:obj:`dict`): Project configuration currently
+                set on Bitbar.
+
+        Returns:
+            dict: Configuration values that differ from the existing ones.
+        """
+        return {key: value for (key, value) in new_values.iteritems()
+                if value != existing_configs.get(key)}
+
     def _load_project_config(self, path='project_config.json'):
         """Loads project config from the disk.
 
@@ -541,10 +567,16 @@ class BitbarProject(Configuration):
                 when setting the project parameter.
         """
         if force_overwrite:
+            # list existing parameters once rather than once per deletion.
+            existing = {
+                parameter['key']: parameter['id'] for parameter in
+                self.client.get_project_parameters(self.project_id)['data']
+            }
             for parameter in parameters:
                 # delete existing project parameters that match the key values
                 # in 'parameters' argument.
-                self.delete_project_parameter(parameter['key'])
+                if parameter['key'] in existing:
+                    self.delete_project_parameter(existing[parameter['key']])
 
         for parameter in parameters:
             try:
@@ -554,7 +586,7 @@ class BitbarProject(Configuration):
                 if rre.status_code == 409:
                     # not an error per se, just means there exists already a
                     # parameter with the given key name.
-                    logger.debug(', '.join([''.join(rre.args), 'skipping..']))
+                    logger.debug('%s, skipping..', rre)
                 else:
                     raise MozbitbarProjectException(
                         message=rre.args,
@@ -597,12 +629,8 @@ class BitbarProject(Configuration):
         else:
             # if user specified a parameter name or id that does not exist,
             # inform and skip the deletion process
-            msg = ', '.join([
-                'Parameter: {} is not set for project'.format(
-                    parameter_to_delete),
-                'skipping deletion'
-            ])
-            logger.info(msg)
+            logger.info('Parameter: %s is not set for project, '
+                        'skipping deletion', parameter_to_delete)
             return
 
     def get_project_parameter_id(self, parameter_name):
@@ -632,23 +660,6 @@ class BitbarProject(Configuration):
 
     # File operations #
 
-    def _file_on_bitbar(self, filename):
-        """Checks if file with same name has been uploaded to Bitbar which
-        is available to the user.
-
-        Args:
-            filename (str): String representation of a filename.
-
-        Returns:
-            bool: True if filename is found on Bitbar. False otherwise.
-        """
-        # sanitize the provided path to just the file name itself.
-        filename = os.path.basename(str(filename))
-
-        output = self.client.get_input_files()
-        return any([file_list['name'] == filename
-                   for file_list in output['data']])
-
     def upload_file(self, **kwargs):
         """Uploads file(s) to Bitbar.
 
@@ -663,6 +674,9 @@ class BitbarProject(Configuration):
                 specified could not be found on disk, or file failed to upload
                 to Bitbar.
         """
+        input_files = None
+        user_id = None
+
         for key, filename in kwargs.iteritems():
             file_type, _ = key.split('_')
 
@@ -674,27 +688,45 @@ class BitbarProject(Configuration):
                 msg = 'Failed to locate on disk: {}'.format(filename)
                 raise MozbitbarFileException(path=filename, message=msg)
 
-            if self._file_on_bitbar(filename):
+            if input_files is None:
+                # list input files once for all files to be uploaded.
+                input_files = set(file_list['name'] for file_list
+                                  in self.client.get_input_files()['data'])
+
+            if os.path.basename(str(filename)) in input_files:
                 # skip and go to the next item in the list of files.
-                msg = ', '.join([
-                    'File: {} already exists on Bitbar'.format(filename),
-                    'skipping upload'
-                ])
-                logger.info(msg)
+                logger.info('File: %s already exists on Bitbar, '
+                            'skipping upload', filename)
                 continue
 
-            api_path_components = [
-                "users/{user_id}/".format(user_id=self.get_user_id()),
-                "projects/{project_id}/".format(project_id=self.project_id),
-                "files/{file_type}".format(file_type=file_type)
-            ]
-            api_path = ''.join(api_path_components)
+            if user_id is None:
+                user_id = self.get_user_id()
+            self._upload(file_type, filename, user_id)
+            input_files.add(os.path.basename(str(filename)))
 
-            try:
-                self.client.upload(path=api_path, filename=filename)
-            except RequestResponseError as rre:
-                raise MozbitbarFileException(message=rre.args,
-                                             status_code=rre.status_code)
+    def _upload(self, file_type, filename, user_id):
+        """Uploads a single file to the project.
+
+        Args:
+            file_type (str): One of application, test or data.
+            filename (str): Path to the file on local disk.
+            user_id (int): Id of the currently authenticated user.
+
+        Raises:
+            MozbitbarFileException: If file failed to upload to Bitbar.
+        """
+        api_path_components = [
+            "users/{user_id}/".format(user_id=user_id),
+            "projects/{project_id}/".format(project_id=self.project_id),
+            "files/{file_type}".format(file_type=file_type)
+        ]
+        api_path = ''.join(api_path_components)
+
+        try:
+            self.client.upload(path=api_path, filename=filename)
+        except RequestResponseError as rre:
+            raise MozbitbarFileException(message=rre.args,
+                                         status_code=rre.status_code)
 
     # Device operations #
 
@@ -825,12 +857,22 @@ class BitbarProject(Configuration):
         project, device and framework attributes set, it will simply pass such
         attributes to the Testdroid method.
 
+        If the MOZBITBAR_RUN_QUEUE environment variable is set, the test run
+        is only started once it holds a slot of the run queue shared by the
+        processes of the host; higher priorities, set with the priority
+        argument, are given slots first. Unless the wait_for_slot argument
+        is False, this method waits for a slot to be free.
+
         Args:
             **kwargs: Arbitrary keyword arguments.
 
+        Returns:
+            bool: True if the test run was started, False if wait_for_slot
+                is False and no run queue slot is free.
+
         Raises:
             MozbitbarTestRunException: If a non-unique test run name is
-                supplied.
+                supplied, or the run queue cannot be read.
             RequestResponseError: If Testdroid responds with an error.
         """
         if not self.project_id:
@@ -864,20 +906,40 @@ class BitbarProject(Configuration):
         if kwargs.get('additional_params', False):
             additional_params = kwargs.pop('additional_params')
 
-        output = self.client.start_test_run(
-            project_id=self.project_id,
-            device_group_id=self.device_group_id,
-            device_model_ids=self.device_id,
-            name=test_name,
-            additional_params=additional_params
-        )
+        wait_for_slot = kwargs.pop('wait_for_slot', True)
+        try:
+            entry_id = runqueue.acquire(kwargs.pop('priority', 0), test_name,
+                                        wait=wait_for_slot)
+        except sqlite3.Error as e:
+            msg = 'Failed to take a run queue slot: {}'.format(e)
+            raise MozbitbarTestRunException(message=msg,
+                                            test_run_name=test_name)
+        if not entry_id and runqueue.queue_path():
+            logger.debug('No run queue slot is free for %s.', test_name)
+            return False
+
+        try:
+            output = self.client.start_test_run(
+                project_id=self.project_id,
+                device_group_id=self.device_group_id,
+                device_model_ids=self.device_id,
+                name=test_name,
+                additional_params=additional_params
+            )
+        except Exception:
+            self._release_slot(entry_id)
+            raise
 
         if not output:
+            self._release_slot(entry_id)
             msg = 'test'
             raise MozbitbarTestRunException(message=msg)
 
+        if entry_id:
+            self._queue_entries[output] = entry_id
         self.test_run_id = output
         self.test_run_name = test_name
+        return True
 
     def get_test_run(self, test_run_id=None, test_run_name=None):
         """Returns the test run details.
@@ -920,6 +982,45 @@ class BitbarProject(Configuration):
 
         return output
 
+    def summarize_test_run(self, test_run_id=None, output=None):
+        """Summarizes the JUnit XML results of a finished test run.
+
+        Result files of every device session are parsed as they are
+        downloaded, and passed, failed and skipped tests and their durations
+        counted per device and per test.
+
+        Args:
+            test_run_id (int, optional): ID of the test run. Defaults to the
+                test run started by start_test_run.
+            output (str, optional): Path of the JSON file the summary is
+                written to.
+
+        Returns:
+            :obj:`dict`: Summary of the results.
+
+        Raises:
+            MozbitbarTestRunException: If no test run is specified, or if
+                Testdroid responds with an error.
+        """
+        test_run_id = test_run_id or getattr(self, 'test_run_id', None)
+        if not test_run_id or type(test_run_id) is not int:
+            msg = 'Test Run ID is not integer.'
+            raise MozbitbarTestRunException(message=msg)
+
+        try:
+            summary = summarize_test_run(self.client, self.project_id,
+                                         test_run_id)
+        except RequestResponseError as rre:
+            raise MozbitbarTestRunException(message=rre.args,
+                                            status_code=rre.status_code)
+
+        totals = summary.totals
+        logger.info('Test Run Results: %d passed, %d failed, %d skipped',
+                    totals['passed'], totals['failed'], totals['skipped'])
+        if output:
+            summary.write(output)
+        return summary.to_dict()
+
     def get_all_test_runs(self):
         """Returns all tests for the project.
 
@@ -929,36 +1030,544 @@ class BitbarProject(Configuration):
         """
         return self.client.get_project_test_runs(self.project_id)['data']
 
-    def notify_test_run_complete(self, interval=30, timeout=300):
+    def notify_test_run_complete(self, interval=None, timeout=None,
+                                 tail_logs=False, log_dir=None):
         """Waits for test run to complete and outputs status to the CLI.
 
+        Unless specified, the timeout and poll interval are estimated from
+        the history of past runs with the same name pattern, device group
+        and framework: the timeout is a margin above the 99th percentile of
+        their durations, and polls are concentrated around the time the run
+        is expected to finish. Without enough history, the run is polled
+        every DEFAULT_POLL_INTERVAL seconds for up to DEFAULT_RUN_TIMEOUT.
+
+        Device logs can be followed while the test run executes, fetching
+        only their new output at every interval. Once complete, the test run
+        is recorded in the history database, if the MOZBITBAR_HISTORY
+        environment variable is set.
+
         Args:
             interval (int, optional): Interval at which this method should
-                query Bitbar for status updates for the test run.
+                query Bitbar for status updates for the test run. Estimated
+                if not specified.
             timeout (int, optional): Maximum time to wait before exiting the
-                method.
+                method. Estimated if not specified.
+            tail_logs (bool, optional): If True, device logs are written to
+                stdout as they grow, prefixed with the device name.
+            log_dir (str, optional): Directory to which device logs are
+                written as they grow, one file per device session. Implies
+                tail_logs.
         """
+        estimate = None
+        if interval is None or timeout is None:
+            estimate = self._estimate_duration()
+        if timeout is None:
+            timeout = (estimate.timeout() if estimate
+                       else DEFAULT_RUN_TIMEOUT)
+
         total_wait_time = 0
+        tail = None
+        if tail_logs or log_dir:
+            tail = DeviceLogTail(self.client, self.project_id,
+                                 self.test_run_id, output_dir=log_dir)
 
-        while (total_wait_time <= timeout):
-            state = str(self.get_test_run(self.test_run_id)['state'])
-            if state != 'FINISHED':
-                time.sleep(interval)
-                total_wait_time += interval
-                logger.debug('Checking test run state for {}...'.format(
-                    self.test_run_name))
-                logger.debug('Waited {}s...'.format(total_wait_time))
-            else:
-                break
+        try:
+            while (total_wait_time <= timeout):
+                test_run = self.get_test_run(self.test_run_id)
+                state = str(test_run['state'])
+                if tail:
+                    self._poll_logs(tail)
+                if state != 'FINISHED':
+                    wait = interval
+                    if wait is None and estimate:
+                        # past runs are timed from their creation.
+                        created = test_run.get('createTime')
+                        elapsed = (time.time() - created / 1000.0
+                                   if created else total_wait_time)
+                        wait = estimate.interval(max(elapsed, 0))
+                    elif wait is None:
+                        wait = DEFAULT_POLL_INTERVAL
+                    time.sleep(wait)
+                    total_wait_time += wait
+                    logger.debug('Checking test run state for %s...',
+                                 self.test_run_name)
+                    logger.debug('Waited %ss...', total_wait_time)
+                else:
+                    break
 
-        test_run_details = self.get_test_run(self.test_run_id)
+            test_run_details = self.get_test_run(self.test_run_id)
+            if tail:
+                # output written between the last poll and the end of the
+                # run.
+                self._poll_logs(tail)
+        finally:
+            if tail:
+                tail.close()
 
         if total_wait_time >= timeout:
-            msg = 'Test run did not complete prior to {}s timeout.'.format(
-                timeout)
-            logger.warning(msg)
-        logger.info('Project Name: {}'.format(self.project_name))
-        logger.info('Project Framework Name: {}'.format(self.framework_name))
-        logger.info('Device Group Name: {}'.format(self.device_group_name))
-        logger.info('Test Run Name: {}'.format(self.test_run_name))
-        logger.info('Test Run State: {}'.format(test_run_details['state']))
+            logger.warning('Test run did not complete prior to %ss timeout.',
+                           timeout)
+        logger.info('Project Name: %s', self.project_name)
+        logger.info('Project Framework Name: %s', self.framework_name)
+        logger.info('Device Group Name: %s', self.device_group_name)
+        logger.info('Test Run Name: %s', self.test_run_name)
+        logger.info('Test Run State: %s', test_run_details['state'])
+        self.complete_test_run(test_run_details)
+
+    def complete_test_run(self, test_run):
+        """Completes the bookkeeping of a test run once it has been waited
+        for: frees its run queue slot if it is finished, and records it in
+        the history database.
+
+        Args:
+            test_run (dict): Details of the test run, as returned by
+                get_test_run.
+        """
+        if test_run['state'] == 'FINISHED':
+            self._release_slot(self._queue_entries.pop(test_run['id'], None))
+        self._record_history(test_run)
+
+    def _poll_logs(self, tail):
+        """Polls the device logs of the test run; failing to do so does not
+        stop the wait for the test run.
+        """
+        try:
+            tail.poll()
+        except Exception as e:
+            logger.warning('Failed to tail device logs: %s', e)
+
+    def _estimate_duration(self):
+        """Estimates the duration of the test run from the history
+        database, if one is configured.
+
+        Returns:
+            :obj:`DurationEstimate`: The estimate, or None.
+        """
+        try:
+            estimate = history.estimate(
+                getattr(self, 'test_run_name', None),
+                device_group=self.device_group_id,
+                framework_id=self.framework_id)
+        except sqlite3.Error as e:
+            logger.warning('Failed to read history: %s', e)
+            return None
+        if estimate:
+            logger.info('Test run expected to finish in %ds, at the latest '
+                        'in %ds, from %d past runs.', estimate.expected,
+                        estimate.latest, estimate.samples)
+        return estimate
+
+    def _release_slot(self, entry_id):
+        """Frees the run queue slot of a test run, if it holds one."""
+        if not entry_id:
+            return
+        try:
+            runqueue.release(entry_id)
+        except sqlite3.Error as e:
+            # the slot is freed anyway once this process exits.
+            logger.warning('Failed to release run queue slot %d: %s',
+                           entry_id, e)
+
+    def release_slots(self):
+        """Frees the run queue slots of the test runs started by this object
+        and not seen finished, eg. once their recipe ends.
+        """
+        for test_run_id in list(self._queue_entries):
+            logger.info('Releasing the run queue slot of test run %s.',
+                        test_run_id)
+            self._release_slot(self._queue_entries.pop(test_run_id))
+
+    def _record_history(self, test_run):
+        """Records a test run and its device sessions in the history
+        database, if one is configured.
+        """
+        if not history.history_path():
+            return
+        try:
+            device_runs = self.client.get_device_runs(
+                self.project_id, test_run['id'])['data']
+            history.record(test_run, device_runs,
+                           project_name=self.project_name,
+                           device_group_id=self.device_group_id,
+                           device_group_name=self.device_group_name,
+                           framework_id=self.framework_id)
+        except (RequestResponseError, sqlite3.Error) as e:
+            # the history only informs later runs.
+            logger.warning('Failed to record test run %s in history: %s',
+                           test_run['id'], e)
+
+    def schedule_test_runs(self, runs, groups=None, max_devices=None,
+                           interval=None):
+        """Starts test runs across several device groups as they free up,
+        and waits for all of them to finish.
+
+        Runs are assigned to the groups longest first, from their durations
+        estimated from the history database, so that the last run finishes
+        as early as possible. A group runs one test run at a time, and a
+        run is started only while the devices of the busy groups fit the
+        account's device concurrency.
+
+        Args:
+            runs (list of dict): Arguments of start_test_run of every run.
+                A duration in seconds overrides the estimate of the run.
+            groups (list, optional): Ids or names of the device groups to
+                use. All device groups are used if not specified.
+            max_devices (int, optional): Devices the account may use at
+                once.
+            interval (int, optional): Interval at which the active runs are
+                polled. Defaults to DEFAULT_POLL_INTERVAL.
+
+        Returns:
+            :obj:`list` of :obj:`dict`: Name, test run id, device group and
+                final state of every run, in the order they were started.
+
+        Raises:
+            MozbitbarDeviceException: If a device group does not exist, or
+                none can be used.
+            MozbitbarTestRunException: If a run fails to start or be
+                polled.
+        """
+        scheduler = Scheduler(self, groups=groups, max_devices=max_devices,
+                              interval=(DEFAULT_POLL_INTERVAL
+                                        if interval is None else interval))
+        return scheduler.run(runs)
+
+    # Desired state operations #
+
+    def reconcile_project(self, framework=None, configs=None, parameters=None,
+                          files=None, group=None, dry_run=False,
+                          prune_parameters=False):
+        """Brings the project to a declared, desired state.
+
+        Rather than issuing every write unconditionally as the imperative
+        actions do, the actual state of the project is read once per resource
+        type and compared against the desired state. Only the differences are
+        then written to Bitbar, which makes steady-state runs read-only.
+
+        Resources that are not specified are left untouched.
+
+        Args:
+            framework (int, str, optional): Desired framework id or name.
+            configs (:obj:`dict` or str, optional): Desired project
+                configuration values, or path to a JSON file holding them.
+            parameters (:obj:`list` of :obj:`dict`, optional): Desired project
+                parameters, each with a key and a value.
+            files (:obj:`dict`, optional): Desired input files, in the same
+                format accepted by upload_file.
+            group (int, str, optional): Desired device group id or name.
+            dry_run (bool, optional): If True, compute and log the changes
+                without applying them.
+            prune_parameters (bool, optional): If True, project parameters
+                which are not desired are deleted.
+
+        Returns:
+            dict: The changes that were (or, in dry run, would be) applied.
+
+        Raises:
+            MozbitbarFrameworkException: If framework does not exist.
+            MozbitbarDeviceException: If device group does not exist.
+            MozbitbarFileException: If a file is of unsupported type, missing
+                on local disk, or failed to upload.
+            MozbitbarProjectException: If Testdroid responds with an error
+                while writing configuration or parameters.
+        """
+        changes = {
+            'framework': None,
+            'configs': {},
+            'delete_parameters': [],
+            'set_parameters': [],
+            'upload_files': {},
+        }
+
+        if group is not None:
+            # device group selection is local state; resolving it is a read.
+            self.set_device_group(group)
+
+        if framework is not None:
+            changes['framework'] = self._framework_change(framework)
+
+        if configs:
+            if not isinstance(configs, dict):
+                configs = self._load_project_config(os.path.abspath(configs))
+            changes['configs'] = self._changed_project_configs(
+                configs, self.get_project_configs())
+
+        if parameters or prune_parameters:
+            existing = {
+                parameter['key']: parameter for parameter in
+                self.client.get_project_parameters(self.project_id)['data']
+            }
+            for parameter in parameters or []:
+                current = existing.pop(parameter['key'], None)
+                if current is None:
+                    changes['set_parameters'].append(parameter)
+                elif str(current['value']) != str(parameter['value']):
+                    changes['delete_parameters'].append(current['id'])
+                    changes['set_parameters'].append(parameter)
+            if prune_parameters:
+                changes['delete_parameters'].extend(
+                    current['id'] for current in existing.values())
+
+        if files:
+            existing = set(file_list['name'] for file_list
+                           in self.client.get_input_files()['data'])
+            for key, filename in files.iteritems():
+                file_type, _ = key.split('_')
+                if file_type not in ['application', 'test', 'data']:
+                    msg = 'Unsupported file type: {}'.format(file_type)
+                    raise MozbitbarFileException(message=msg)
+                if not self._file_on_local_disk(filename):
+                    msg = 'Failed to locate on disk: {}'.format(filename)
+                    raise MozbitbarFileException(path=filename, message=msg)
+                if os.path.basename(str(filename)) not in existing:
+                    changes['upload_files'][key] = filename
+
+        pending = sum([
+            1 if changes['framework'] else 0,
+            1 if changes['configs'] else 0,
+            len(changes['delete_parameters']),
+            len(changes['set_parameters']),
+            len(changes['upload_files']),
+        ])
+        if not pending:
+            logger.info('Project is already in the desired state.')
+            return changes
+
+        logger.info('%d change(s) required to reach desired state.', pending)
+        if dry_run:
+            logger.info('Dry run, changes not applied: %s', changes)
+            return changes
+
+        self._apply_project_changes(changes)
+        return changes
+
+    # Project pool operations #
+
+    def lease_project(self, template, project_type, framework=None,
+                      configs=None, parameters=None, files=None, group=None,
+                      pool_size=pool.DEFAULT_POOL_SIZE):
+        """Leases a project of a template from the project pool.
+
+        If the MOZBITBAR_PROJECT_POOL environment variable is set, a project
+        already in the state of the template is leased, without reading or
+        writing it on Bitbar. Should none be ready, or the pool not be
+        configured, a project is created and brought to that state instead.
+
+        The template is recorded in the pool, so that the replenisher keeps
+        pool_size of its projects ready.
+
+        Args:
+            template (str): Name of the template.
+            project_type (str): Type of the projects of the template.
+            framework (int, str, optional): Framework id or name.
+            configs (:obj:`dict` or str, optional): Project configuration
+                values, or path to a JSON file holding them.
+            parameters (:obj:`list` of :obj:`dict`, optional): Project
+                parameters, each with a key and a value.
+            files (:obj:`dict`, optional): Input files, in the same format
+                accepted by upload_file.
+            group (int, str, optional): Device group id or name.
+            pool_size (int, optional): Projects kept ready.
+
+        Raises:
+            MozbitbarProjectException: If a project could not be created.
+            MozbitbarBaseException, RequestResponseError: If a created
+                project could not be configured; it is deleted.
+        """
+        definition = {'project_type': project_type, 'framework': framework,
+                      'configs': configs, 'parameters': parameters,
+                      'files': files, 'group': group}
+        path = pool.pool_path()
+        project = None
+        if path:
+            try:
+                with pool.ProjectPool(path) as project_pool:
+                    project_pool.register(template, definition, pool_size)
+                    project = project_pool.lease(template)
+            except sqlite3.Error as e:
+                logger.warning('Failed to read project pool: %s', e)
+                path = None
+
+        if project:
+            self._set_project_attributes(project)
+            if project.get('deviceGroupId'):
+                self.device_group_id = project['deviceGroupId']
+                self.device_group_name = project['deviceGroupName']
+            logger.info('Leased project %s from the pool.', self.project_name)
+        else:
+            logger.info('No project of template %s ready, creating one.',
+                        template)
+            self.create_project(pool.project_name(template), project_type,
+                                permit_duplicate=True)
+            # tracked before it is configured, so that it is not left behind
+            # should this process die.
+            path = self._add_to_pool(path, template)
+            try:
+                self.reset_project(definition)
+            except (MozbitbarBaseException, RequestResponseError):
+                self._discard_project(path)
+                raise
+            path = self._add_to_pool(path, template)
+        if path:
+            self._lease = definition
+
+    def _add_to_pool(self, path, template):
+        """Records the project as leased by this process in the pool.
+
+        Returns:
+            str: Path of the pool, or None if the project is not pooled.
+        """
+        if not path:
+            return None
+        try:
+            with pool.ProjectPool(path) as project_pool:
+                project_pool.add(template, pool.describe(self))
+        except sqlite3.Error as e:
+            logger.warning('Failed to add project to the pool: %s', e)
+            return None
+        return path
+
+    def _discard_project(self, path):
+        """Deletes a created project which could not be configured."""
+        if not path:
+            pool.discard(self)
+            return
+        try:
+            with pool.ProjectPool(path) as project_pool:
+                pool.discard(self, project_pool)
+        except sqlite3.Error as e:
+            logger.warning('Failed to remove project %s from the pool: %s',
+                           self.project_name, e)
+
+    def reset_project(self, definition):
+        """Brings a project of the pool back to the state of its template.
+
+        Only differences are written, as with reconcile_project, and
+        parameters which are not part of the template are deleted.
+
+        Args:
+            definition (dict): Desired state of the project, as recorded by
+                lease_project.
+        """
+        self.reconcile_project(framework=definition.get('framework'),
+                               configs=definition.get('configs'),
+                               parameters=definition.get('parameters'),
+                               files=definition.get('files'),
+                               group=definition.get('group'),
+                               prune_parameters=True)
+
+    def return_project(self):
+        """Resets a leased project and returns it to the pool.
+
+        Projects which could not be reset are returned as dirty, and reset
+        by the replenisher. Does nothing if the project was not leased.
+        """
+        if not self._lease:
+            return
+        clean = True
+        try:
+            self.reset_project(self._lease)
+        except (MozbitbarBaseException, RequestResponseError) as e:
+            logger.warning('Failed to reset project %s: %s',
+                           self.project_name,
+                           getattr(e, 'message', None) or e)
+            clean = False
+        try:
+            with pool.ProjectPool(pool.pool_path()) as project_pool:
+                project_pool.give_back(self.project_id, pool.describe(self),
+                                       clean)
+        except sqlite3.Error as e:
+            # reclaimed as dirty once this process exits.
+            logger.warning('Failed to return project %s to the pool: %s',
+                           self.project_name, e)
+        self._lease = None
+        logger.info('Returned project %s to the pool.', self.project_name)
+
+    def _framework_change(self, framework):
+        """Determines whether the project framework needs to be changed.
+
+        Args:
+            framework (int, str): Desired framework id or name.
+
+        Returns:
+            dict or None: Matching framework if a change is required.
+                None otherwise.
+
+        Raises:
+            MozbitbarFrameworkException: If framework does not exist.
+        """
+        try:
+            _framework = int(framework)
+        except ValueError:
+            _framework = str(framework)
+
+        if _framework == self.framework_id:
+            return None
+
+        try:
+            match = [
+                fw for fw in self.get_project_frameworks()
+                if _framework == str(fw['name']) or _framework == fw['id']
+            ].pop()
+        except IndexError:
+            msg = 'Supplied framework name or framework id \
+                   did not match any framework on Bitbar.'
+            raise MozbitbarFrameworkException(message=msg)
+
+        if match['id'] == self.framework_id:
+            self.framework_name = match['name']
+            return None
+        return match
+
+    def _apply_project_changes(self, changes):
+        """Writes the changes computed by reconcile_project to Bitbar.
+
+        Args:
+            changes (:obj:`dict`): Changes as returned by reconcile_project.
+
+        Raises:
+            MozbitbarFrameworkException: If framework could not be set.
+            MozbitbarFileException: If a file failed to upload.
+            MozbitbarProjectException: If Testdroid responds with an error.
+        """
+        if changes['framework']:
+            match = changes['framework']
+            try:
+                self.client.set_project_framework(self.project_id,
+                                                  match['id'])
+            except RequestResponseError as rre:
+                raise MozbitbarFrameworkException(message=rre.args,
+                                                  status_code=rre.status_code)
+            self.framework_id = match['id']
+            self.framework_name = match['name']
+
+        if changes['configs']:
+            try:
+                self.client.set_project_config(self.project_id,
+                                               **changes['configs'])
+            except RequestResponseError as rre:
+                raise MozbitbarProjectException(message=rre.args,
+                                                status_code=rre.status_code)
+
+        for parameter_id in changes['delete_parameters']:
+            self.client.delete_project_parameters(self.project_id,
+                                                  parameter_id)
+
+        for parameter in changes['set_parameters']:
+            try:
+                self.client.set_project_parameters(self.project_id,
+                                                   parameter)
+            except RequestResponseError as rre:
+                if rre.status_code == 409:
+                    logger.debug('%s, skipping..', rre)
+                else:
+                    raise MozbitbarProjectException(
+                        message=rre.args,
+                        status_code=rre.status_code
+                    )
+
+        if changes['upload_files']:
+            user_id = self.get_user_id()
+            for key, filename in changes['upload_files'].iteritems():
+                file_type, _ = key.split('_')
+                self._upload(file_type, filename, user_id)
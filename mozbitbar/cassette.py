@@ -0,0 +1,320 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Records the HTTP requests made to Bitbar into cassettes, and replays them.
+
+Recording and replaying happen below the Testdroid client, through a
+transport hook, so that everything above it, from retries and rate limiting
+to recipes, runs unchanged:
+
+    cassette.record()
+    run_recipe(recipe, args)
+    cassette.stop().save('recipe.cassette')
+
+    cassette.replay('recipe.cassette', scale=0)
+    run_recipe(recipe, args)
+
+A cassette is a gzip-compressed file of JSON lines, one per request, holding
+the method and path of the request, and the status, headers, body and
+duration of its response. Credentials and tokens are scrubbed.
+"""
+
+from __future__ import absolute_import, print_function
+
+import base64
+import datetime
+import gzip
+import json
+import threading
+import time
+
+try:
+    from urllib import urlencode
+    from urlparse import parse_qsl
+except ImportError:
+    from urllib.parse import parse_qsl, urlencode
+
+from mozbitbar import MozbitbarCassetteException, client
+
+CASSETTE_VERSION = 1
+
+SCRUBBED = 'SCRUBBED'
+
+# query string and JSON fields holding credentials or tokens.
+SECRET_FIELDS = frozenset([
+    'access_token',
+    'apikey',
+    'client_secret',
+    'password',
+    'refresh_token',
+    'username',
+])
+
+# response headers kept in cassettes; the others only add to their size.
+KEPT_HEADERS = ('Content-Length', 'Content-Range', 'Content-Type',
+                'Retry-After')
+
+# currently active Cassette, or None.
+_cassette = None
+
+
+def request_key(method, path_url):
+    """Returns the key matching a replayed request to a recorded one.
+
+    Credentials are scrubbed from the query string, and its parameters
+    sorted.
+
+    Args:
+        method (str): HTTP method of the request.
+        path_url (str): Path and query string of the request.
+
+    Returns:
+        str: Key of the request.
+    """
+    path, _, query = path_url.partition('?')
+    parameters = sorted(
+        (name, SCRUBBED if name in SECRET_FIELDS else value)
+        for (name, value) in parse_qsl(query, keep_blank_values=True))
+    if parameters:
+        path = '?'.join([path, urlencode(parameters)])
+    return ' '.join([method, path])
+
+
+def scrub(value):
+    """Returns a copy of a decoded JSON value, with the values of secret
+    fields replaced.
+    """
+    if isinstance(value, dict):
+        return dict((key, SCRUBBED if key in SECRET_FIELDS else scrub(item))
+                    for (key, item) in value.items())
+    if isinstance(value, list):
+        return [scrub(item) for item in value]
+    return value
+
+
+class Cassette(object):
+    """Cassette holds recorded interactions, and serves them back in the
+    order they were recorded.
+    """
+    def __init__(self, interactions=None, scale=1.0):
+        """Initializes the Cassette.
+
+        Args:
+            interactions (list, optional): Recorded interactions.
+            scale (float, optional): Factor applied to recorded response
+                times when replaying. 0 replays without waiting.
+        """
+        self.interactions = interactions or []
+        self.scale = scale
+        # requests replayed, and requests beyond those recorded.
+        self.played = 0
+        self.extra = 0
+        self._lock = threading.Lock()
+        # recorded interactions, and the position of the next one to be
+        # replayed, keyed by request.
+        self._by_key = None
+        self._positions = {}
+
+    @classmethod
+    def load(cls, path, scale=1.0):
+        """Loads a cassette from disk.
+
+        Args:
+            path (str): Path of the cassette.
+            scale (float, optional): Factor applied to recorded response
+                times when replaying.
+
+        Returns:
+            :obj:`Cassette`: The loaded cassette.
+
+        Raises:
+            MozbitbarCassetteException: If the cassette version is not
+                supported.
+        """
+        with gzip.open(path, 'rb') as f:
+            lines = f.read().decode('utf-8').splitlines()
+        header = json.loads(lines[0])
+        if header.get('version') != CASSETTE_VERSION:
+            msg = 'Unsupported cassette version: {}'.format(
+                header.get('version'))
+            raise MozbitbarCassetteException(message=msg)
+        return cls([json.loads(line) for line in lines[1:]], scale=scale)
+
+    def save(self, path):
+        """Writes the cassette to disk.
+
+        Args:
+            path (str): Destination path on local disk.
+        """
+        with self._lock:
+            interactions = list(self.interactions)
+        lines = [json.dumps({'version': CASSETTE_VERSION,
+                             'recorded': int(time.time())})]
+        lines.extend(json.dumps(interaction, sort_keys=True,
+                                separators=(',', ':'))
+                     for interaction in interactions)
+        with gzip.open(path, 'wb') as f:
+            f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+
+    @property
+    def remaining(self):
+        """int: Recorded interactions not replayed yet."""
+        with self._lock:
+            played = sum(self._positions.values())
+        return len(self.interactions) - played
+
+    # Recording #
+
+    def record(self, send, request, **kwargs):
+        """Transport hook sending a request, and recording its response."""
+        start = time.time()
+        response = send(request, **kwargs)
+        elapsed = time.time() - start
+
+        interaction = {
+            'request': request_key(request.method, request.path_url),
+            'status': response.status_code,
+            'headers': dict((name, response.headers[name])
+                            for name in KEPT_HEADERS
+                            if name in response.headers),
+            'elapsed': round(elapsed, 3),
+        }
+        interaction.update(self._encode_body(response))
+        with self._lock:
+            self.interactions.append(interaction)
+        return response
+
+    def _encode_body(self, response):
+        content = response.content or b''
+        if 'json' in response.headers.get('Content-Type', ''):
+            try:
+                return {'json': scrub(json.loads(content.decode('utf-8')))}
+            except ValueError:
+                pass
+        try:
+            return {'body': content.decode('utf-8')}
+        except UnicodeDecodeError:
+            return {'base64': base64.b64encode(content).decode('ascii')}
+
+    # Replaying #
+
+    def play(self, send, request, **kwargs):
+        """Transport hook answering a request from the cassette, without
+        sending it.
+
+        Recorded responses to the same request are served in the order they
+        were recorded. Once exhausted, the last one is served again, and the
+        request counted as extra.
+
+        Raises:
+            MozbitbarCassetteException: If the request was never recorded.
+        """
+        key = request_key(request.method, request.path_url)
+        with self._lock:
+            if self._by_key is None:
+                self._by_key = {}
+                for interaction in self.interactions:
+                    self._by_key.setdefault(interaction['request'],
+                                            []).append(interaction)
+            recorded = self._by_key.get(key)
+            if not recorded:
+                msg = 'Request not found in cassette: {}'.format(key)
+                raise MozbitbarCassetteException(message=msg)
+            position = self._positions.get(key, 0)
+            if position < len(recorded):
+                interaction = recorded[position]
+                self._positions[key] = position + 1
+            else:
+                interaction = recorded[-1]
+                self.extra += 1
+            self.played += 1
+
+        if self.scale:
+            time.sleep(interaction['elapsed'] * self.scale)
+        return self._response(request, interaction)
+
+    def _response(self, request, interaction):
+        from requests.models import Response
+        from requests.structures import CaseInsensitiveDict
+        from requests.utils import get_encoding_from_headers
+
+        if 'json' in interaction:
+            content = json.dumps(interaction['json']).encode('utf-8')
+        elif 'base64' in interaction:
+            content = base64.b64decode(interaction['base64'])
+        else:
+            content = interaction['body'].encode('utf-8')
+
+        response = Response()
+        response.status_code = interaction['status']
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        if 'Content-Length' in response.headers:
+            response.headers['Content-Length'] = str(len(content))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = content
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.reason = ''
+        response.elapsed = datetime.timedelta(seconds=interaction['elapsed'])
+        return response
+
+
+def record():
+    """Starts recording every request made to Bitbar.
+
+    Returns:
+        :obj:`Cassette`: The cassette being recorded.
+    """
+    global _cassette
+
+    stop()
+    _cassette = Cassette()
+    client.add_transport_hook(_cassette.record)
+    return _cassette
+
+
+def replay(path, scale=1.0):
+    """Starts answering every request made to Bitbar from a cassette.
+
+    Args:
+        path (str): Path of the cassette.
+        scale (float, optional): Factor applied to recorded response times.
+            1 replays with the original timings, 0 without waiting, so that
+            only the time spent by mozbitbar is measured.
+
+    Returns:
+        :obj:`Cassette`: The cassette being replayed.
+    """
+    global _cassette
+
+    stop()
+    _cassette = Cassette.load(path, scale=scale)
+    client.add_transport_hook(_cassette.play)
+    return _cassette
+
+
+def stop():
+    """Stops recording or replaying.
+
+    Returns:
+        :obj:`Cassette` or None: The cassette which was active, if any.
+    """
+    global _cassette
+
+    cassette, _cassette = _cassette, None
+    if cassette is not None:
+        client.remove_transport_hook(cassette.record)
+        client.remove_transport_hook(cassette.play)
+    return cassette
+
+
+def active():
+    """Returns the active cassette.
+
+    Returns:
+        :obj:`Cassette` or None: Active cassette, None if neither recording
+            nor replaying.
+    """
+    return _cassette
@@ -10,6 +10,36 @@ from argparse import ArgumentParser
 from mozbitbar import MozbitbarRecipeException
 
 _parser = None
+_command_parser = None
+_commands = {}
+
+
+def _add_logging_arguments(parser):
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Enables debugging output.')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Disables all output except warning and \
+                        higher.')
+    parser.add_argument('--log-json', action='store_true',
+                        help='Writes log records as JSON lines.')
+    parser.add_argument('--log-async', action='store_true',
+                        help='Writes log records from a dedicated thread.')
+    parser.add_argument('--log-queue-policy', choices=('block', 'drop'),
+                        default='block',
+                        help='With --log-async, whether to wait or to drop \
+                        records when the log queue is full.')
+
+
+def _add_query_arguments(parser):
+    parser.add_argument('-f', '--format', choices=('tsv', 'json', 'ndjson'),
+                        default='tsv', help='Output format.')
+    parser.add_argument('--max-age', type=float, metavar='SECONDS',
+                        help='Maximum age of cached results.')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Bypasses the cache.')
+    parser.add_argument('-c', '--credentials', action='store',
+                        help='Load Testdroid credentials from a file.')
+    _add_logging_arguments(parser)
 
 
 def get_parser():
@@ -19,17 +49,167 @@ def get_parser():
         _parser = ArgumentParser(description='Runs Testdroid tasks.')
         _parser.add_argument('-r', '--recipe',
                              help='Specifies a recipe to load from disk.')
-        _parser.add_argument('-v', '--verbose', action='store_true',
-                             help='Enables debugging output.')
-        _parser.add_argument('-q', '--quiet', action='store_true',
-                             help='Disables all output except warning and \
-                             higher.')
+        _add_logging_arguments(_parser)
         _parser.add_argument('-c', '--credentials', action='store',
                              help='Load Testdroid credentials from a file.')
+        _parser.add_argument('--trace', action='store', metavar='PATH',
+                             help='Write a Chrome trace of tasks and API \
+                             calls to a file.')
+        _parser.add_argument('--metrics', action='store', metavar='PATH',
+                             help='Write API metrics in Prometheus text \
+                             format to a file on exit.')
+        cassette = _parser.add_mutually_exclusive_group()
+        cassette.add_argument('--record', action='store', metavar='PATH',
+                              help='Record requests made to Bitbar into a \
+                              cassette.')
+        cassette.add_argument('--replay', action='store', metavar='PATH',
+                              help='Answer requests from a cassette rather \
+                              than Bitbar.')
+        _parser.add_argument('--replay-scale', type=float, default=1.0,
+                             metavar='FACTOR',
+                             help='Factor applied to recorded response \
+                             times when replaying; 0 does not wait.')
     return _parser
 
 
+def get_command_parser():
+    global _command_parser
+
+    if _command_parser is None:
+        _command_parser = ArgumentParser(
+            prog='mozbitbar', description='Runs Testdroid tasks.')
+        subparsers = _command_parser.add_subparsers(dest='command')
+
+        serve = subparsers.add_parser(
+            'serve', help='Runs a long-lived server accepting recipes.')
+        serve.add_argument('-s', '--socket',
+                           help='Path of the Unix socket to listen on.')
+        serve.add_argument('--metrics', action='store', metavar='PATH',
+                           help='Keep API metrics in Prometheus text \
+                           format up to date in a file.')
+        _add_logging_arguments(serve)
+
+        submit = subparsers.add_parser(
+            'submit', help='Submits a recipe to a running server.')
+        submit.add_argument('-r', '--recipe', required=True,
+                            help='Specifies a recipe to load from disk.')
+        submit.add_argument('-c', '--credentials', action='store',
+                            help='Load Testdroid credentials from a file.')
+        submit.add_argument('-s', '--socket',
+                            help='Path of the Unix socket of the server.')
+        _add_logging_arguments(submit)
+
+        inventory = subparsers.add_parser(
+            'inventory', help='Writes a snapshot of the account inventory.')
+        inventory.add_argument('-o', '--output', required=True,
+                               help='Path of the NDJSON or SQLite output.')
+        inventory.add_argument('--format', choices=('ndjson', 'sqlite'),
+                               help='Output format. Guessed from the output \
+                               extension if not specified.')
+        inventory.add_argument('-j', '--workers', type=int, default=8,
+                               help='Maximum concurrent requests.')
+        inventory.add_argument('-c', '--credentials', action='store',
+                               help='Load Testdroid credentials from a file.')
+        _add_logging_arguments(inventory)
+
+        cleanup = subparsers.add_parser(
+            'cleanup', help='Deletes stale projects, test runs and input \
+            files. Only shows what would be deleted unless --execute is \
+            given.')
+        cleanup.add_argument('--older-than', type=float, metavar='DAYS',
+                             help='Only delete resources created at least \
+                             this many days ago.')
+        cleanup.add_argument('--name', metavar='PATTERN',
+                             help='Only delete resources whose name matches \
+                             this shell-style pattern.')
+        cleanup.add_argument('--unused', action='store_true',
+                             help='Only delete projects without test runs \
+                             newer than --older-than.')
+        cleanup.add_argument('--kind', action='append',
+                             choices=('project', 'test_run', 'input_file'),
+                             help='Kind of resource to delete; may be \
+                             repeated. Defaults to all kinds.')
+        cleanup.add_argument('--execute', action='store_true',
+                             help='Delete the planned resources.')
+        cleanup.add_argument('-j', '--workers', type=int, default=8,
+                             help='Maximum concurrent requests.')
+        cleanup.add_argument('-c', '--credentials', action='store',
+                             help='Load Testdroid credentials from a file.')
+        _add_logging_arguments(cleanup)
+
+        sync = subparsers.add_parser(
+            'sync', help='Records the test runs of the account in the \
+            history database.')
+        sync.add_argument('--db', metavar='PATH',
+                          help='Path of the history database. Defaults to \
+                          MOZBITBAR_HISTORY.')
+        sync.add_argument('-p', '--project', type=int, action='append',
+                          help='Project whose runs are recorded; may be \
+                          repeated. Defaults to all projects.')
+        sync.add_argument('--full', action='store_true',
+                          help='List every run again rather than only those \
+                          created since the last sync.')
+        sync.add_argument('-j', '--workers', type=int, default=8,
+                          help='Maximum concurrent requests.')
+        sync.add_argument('-c', '--credentials', action='store',
+                          help='Load Testdroid credentials from a file.')
+        _add_logging_arguments(sync)
+
+        queue = subparsers.add_parser(
+            'queue', help='Shows the run queue and how long runs waited \
+            for a slot, per priority.')
+        queue.add_argument('--db', metavar='PATH',
+                           help='Path of the run queue database. Defaults \
+                           to MOZBITBAR_RUN_QUEUE.')
+        queue.add_argument('--since', type=float, metavar='HOURS',
+                           help='Only count the waits of runs queued in the \
+                           last HOURS hours.')
+        queue.add_argument('-f', '--format',
+                           choices=('tsv', 'json', 'ndjson'), default='tsv',
+                           help='Output format.')
+        _add_logging_arguments(queue)
+
+        pool = subparsers.add_parser(
+            'pool', help='Keeps enough projects of every template ready in \
+            the project pool.')
+        pool.add_argument('--db', metavar='PATH',
+                          help='Path of the project pool database. Defaults \
+                          to MOZBITBAR_PROJECT_POOL.')
+        pool.add_argument('--once', action='store_true',
+                          help='Replenish the pool once, rather than every \
+                          --interval seconds.')
+        pool.add_argument('--interval', type=float, default=60,
+                          metavar='SECONDS',
+                          help='Seconds between replenishments.')
+        pool.add_argument('-c', '--credentials', action='store',
+                          help='Load Testdroid credentials from a file.')
+        _add_logging_arguments(pool)
+
+        list_parser = subparsers.add_parser(
+            'list', help='Lists resources of the account.')
+        list_parser.add_argument('kind', choices=('devices', 'device-groups',
+                                                  'frameworks', 'projects',
+                                                  'runs'))
+        list_parser.add_argument('-p', '--project', type=int,
+                                 help='Project whose runs are listed.')
+        _add_query_arguments(list_parser)
+
+        status = subparsers.add_parser(
+            'status', help='Shows the state of a test run.')
+        status.add_argument('run', type=int, help='Id of the test run.')
+        status.add_argument('-p', '--project', type=int, required=True,
+                            help='Project of the test run.')
+        _add_query_arguments(status)
+
+        _commands.update(subparsers.choices)
+    return _command_parser
+
+
 def cli(cli_args=sys.argv[1:]):
+    command_parser = get_command_parser()
+    if cli_args and cli_args[0] in _commands:
+        return command_parser.parse_args(cli_args)
+
     parser = get_parser()
     args, _ = parser.parse_known_args(cli_args)
 
@@ -37,4 +217,5 @@ def cli(cli_args=sys.argv[1:]):
         msg = 'Recipe must be defined.'
         raise MozbitbarRecipeException(message=msg)
 
+    args.command = 'run'
     return args
@@ -0,0 +1,404 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import copy
+import os
+import threading
+import time
+
+# factories wrapping every client created by Configuration, as a list of
+# (order, factory) tuples. Lower orders wrap closer to the Testdroid client.
+_wrappers = []
+
+# middleware applied to every HTTP request sent through requests.
+_transport_hooks = []
+_original_send = None
+
+# order of the response cache; above retries and metrics, so that a shared
+# response counts as a single request.
+RESPONSE_CACHE_ORDER = 40
+
+# seconds for which identical reads share one response.
+DEFAULT_WINDOW = 2
+
+# reads whose responses change rarely enough to be reused for minutes,
+# which also keeps them warm for the lifetime of a server process.
+default_ttls = {
+    'get_me': 300,
+    'get_frameworks': 300,
+    'get_device_groups': 300,
+    'get_devices': 60,
+}
+
+# resource read by each read method; methods not listed are their own
+# resource.
+_resources = {
+    'get_project': 'projects',
+    'get_projects': 'projects',
+    'get_project_config': 'config',
+    'get_project_parameters': 'parameters',
+    'get_input_files': 'files',
+    'get_project_test_runs': 'runs',
+    'get_test_run': 'runs',
+    'get_device_runs': 'runs',
+}
+
+# resources modified by each write method; writes not listed invalidate
+# every resource.
+_invalidates = {
+    'create_project': ('projects',),
+    'delete_project': ('projects', 'config', 'parameters', 'runs'),
+    'set_project_framework': ('projects', 'config'),
+    'set_project_config': ('config',),
+    'set_project_parameters': ('parameters', 'config'),
+    'delete_project_parameters': ('parameters', 'config'),
+    'upload': ('files',),
+    'upload_file': ('files',),
+    'upload_application_file': ('files',),
+    'upload_test_file': ('files',),
+    'upload_data_file': ('files',),
+    'start_test_run': ('runs',),
+    'retry_test_run': ('runs',),
+    'abort_test_run': ('runs',),
+}
+
+# methods passed through without caching or invalidation. Raw reads may be
+# of changing content, such as logs, and requests made with http_get return
+# response objects.
+_uncached = set(['get', 'get_token', 'download', 'get_device_session_log',
+                 'get_file_content'])
+
+
+def add_wrapper(factory, order):
+    """Registers a factory wrapping every subsequently created client.
+
+    Args:
+        factory (callable): Accepts a client and returns the wrapped client,
+            typically a ClientWrapper subclass.
+        order (int): Position of the wrapper; lower orders are applied
+            first, and therefore sit closer to the Testdroid client.
+    """
+    remove_wrapper(factory)
+    _wrappers.append((order, factory))
+    _wrappers.sort(key=lambda item: item[0])
+
+
+def remove_wrapper(factory):
+    """Unregisters a factory previously added with add_wrapper.
+
+    Args:
+        factory (callable): Factory to be removed.
+    """
+    _wrappers[:] = [item for item in _wrappers if item[1] is not factory]
+
+
+def wrap(client):
+    """Applies all registered wrappers to a client.
+
+    Args:
+        client (:obj:`Testdroid`): Client to be wrapped.
+
+    Returns:
+        Client wrapped by every registered factory, or the client itself if
+            none are registered.
+    """
+    for _, factory in _wrappers:
+        client = factory(client)
+    return client
+
+
+def add_transport_hook(hook):
+    """Registers a middleware for every HTTP request made through requests.
+
+    The hook is called as hook(send, request, **kwargs) and must return the
+    response, usually by calling send(request, **kwargs). This gives access
+    to status codes, headers and bodies, which the Testdroid client does not
+    expose.
+
+    requests is only patched once the first hook is registered.
+
+    Args:
+        hook (callable): Middleware to be registered.
+    """
+    global _original_send
+
+    if hook in _transport_hooks:
+        return
+    _transport_hooks.append(hook)
+    if _original_send is None:
+        from requests.sessions import Session
+        _original_send = Session.send
+        Session.send = _send
+
+
+def remove_transport_hook(hook):
+    """Unregisters a middleware, restoring requests once none are left.
+
+    Args:
+        hook (callable): Middleware to be removed.
+    """
+    global _original_send
+
+    if hook in _transport_hooks:
+        _transport_hooks.remove(hook)
+    if not _transport_hooks and _original_send is not None:
+        from requests.sessions import Session
+        Session.send = _original_send
+        _original_send = None
+
+
+def _send(session, request, **kwargs):
+    hooks = list(_transport_hooks)
+    send = _original_send
+
+    def dispatch(index, request, **kwargs):
+        if index == len(hooks):
+            return send(session, request, **kwargs)
+        return hooks[index](
+            lambda r, **kw: dispatch(index + 1, r, **kw), request, **kwargs)
+    return dispatch(0, request, **kwargs)
+
+
+class ClientWrapper(object):
+    """ClientWrapper wraps a Testdroid client and intercepts calls made to
+    its public methods.
+
+    Attributes that are not public methods are passed through to the
+    wrapped client unchanged. Subclasses override the call method to add
+    behavior around each API call.
+    """
+    def __init__(self, client):
+        """Initializes the ClientWrapper.
+
+        Args:
+            client (:obj:`Testdroid`): Client, or another ClientWrapper, to be
+                wrapped.
+        """
+        self.client = client
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            return self.call(name, attribute, args, kwargs)
+        call.__name__ = name
+        return call
+
+    def call(self, name, func, args, kwargs):
+        """Invokes the wrapped client method.
+
+        Args:
+            name (str): Name of the client method, eg. get_projects.
+            func (callable): Bound method of the wrapped client.
+            args (tuple): Positional arguments for the client method.
+            kwargs (:obj:`dict`): Keyword arguments for the client method.
+
+        Returns:
+            Return value of the client method.
+        """
+        return func(*args, **kwargs)
+
+
+def call_through(client, name, func, *args, **kwargs):
+    """Invokes a function as though it were a method of a client, through
+    every wrapper of the client.
+
+    Requests the Testdroid client does not expose are thereby rate limited,
+    retried, counted and traced as its own methods are.
+
+    Args:
+        client: Client, usually wrapped.
+        name (str): Name of the call, eg. get_device_session_log. Calls
+            named get_* are reads, and may be retried.
+        func (callable): Function making the request.
+        *args: Positional arguments for func.
+        **kwargs: Keyword arguments for func.
+
+    Returns:
+        Return value of func.
+    """
+    if not isinstance(client, ClientWrapper):
+        return func(*args, **kwargs)
+    inner = client.client
+    return client.call(
+        name, lambda *a, **kw: call_through(inner, name, func, *a, **kw),
+        args, kwargs)
+
+
+def http_get(client, name, path, headers=None, stream=False,
+             statuses=(200,)):
+    """Sends a GET request to the Bitbar API through every wrapper of a
+    client, for responses the Testdroid client does not expose, such as
+    byte ranges or streamed downloads.
+
+    Args:
+        client: Authenticated client, usually wrapped.
+        name (str): Name of the call, starting with get_. It must be listed
+            in _uncached.
+        path (str): Path of the resource below the API root, eg.
+            me/files/1/file.
+        headers (:obj:`dict`, optional): Headers sent in addition to the
+            authorization of the client.
+        stream (bool, optional): If True, the body is downloaded as it is
+            read.
+        statuses (tuple, optional): Status codes for which the response is
+            returned.
+
+    Returns:
+        :obj:`requests.Response`: The response.
+
+    Raises:
+        RequestResponseError: If Bitbar responds with another status code.
+        requests.exceptions.RequestException: If the request fails.
+    """
+    import requests
+    from testdroid import RequestResponseError
+
+    def get():
+        url = '{}/api/v2/{}'.format(client.cloud_url, path)
+        response = requests.get(
+            url, headers=dict(client._build_headers(), **(headers or {})),
+            stream=stream, timeout=60)
+        if response.status_code not in statuses:
+            text = response.text
+            response.close()
+            raise RequestResponseError(text, response.status_code)
+        return response
+    return call_through(client, name, get)
+
+
+class _PendingResponse(object):
+    """Response of a read which may still be in flight."""
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = threading.Event()
+        self.expires = None
+        self.response = None
+        self.error = None
+
+
+class ResponseCache(ClientWrapper):
+    """ResponseCache coalesces identical reads made through the client.
+
+    Concurrent identical reads share the single request in flight, and the
+    response is then reused by identical reads for a short window, or for
+    a longer per-method time to live. Writes invalidate the cached reads of
+    the resources they modify.
+
+    Callers receive copies of the shared response, so mutating a response
+    does not affect other callers.
+    """
+    def __init__(self, client, window=DEFAULT_WINDOW, ttls=None):
+        """Initializes the ResponseCache.
+
+        Args:
+            client (:obj:`Testdroid`): Client to be wrapped.
+            window (float, optional): Number of seconds for which responses
+                of read methods are reused.
+            ttls (:obj:`dict`, optional): Mapping of client method name to
+                the number of seconds its responses are reused, overriding
+                window.
+        """
+        super(ResponseCache, self).__init__(client)
+        self.window = window
+        self.ttls = dict(default_ttls if ttls is None else ttls)
+        self._entries = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def call(self, name, func, args, kwargs):
+        if name in _uncached:
+            return func(*args, **kwargs)
+        if not name.startswith('get_'):
+            self.invalidate(*_invalidates.get(name, ()))
+            try:
+                return func(*args, **kwargs)
+            finally:
+                # reads that started while the write was in flight must not
+                # be kept either.
+                self.invalidate(*_invalidates.get(name, ()))
+
+        ttl = self.ttls.get(name, self.window)
+        resource = _resources.get(name, name)
+        key = (name, args, tuple(sorted(kwargs.items())))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.done.is_set() and (
+                    entry.error is not None or entry.expires < time.time()):
+                entry = None
+            if entry is None:
+                owner = True
+                entry = _PendingResponse(self._generations.get(resource, 0))
+                self._entries[key] = entry
+            else:
+                owner = False
+
+        if not owner:
+            entry.done.wait()
+            if entry.error is not None:
+                raise entry.error
+            return copy.deepcopy(entry.response)
+
+        try:
+            entry.response = func(*args, **kwargs)
+        except Exception as e:
+            entry.error = e
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            raise
+        finally:
+            entry.expires = time.time() + ttl
+            entry.done.set()
+
+        with self._lock:
+            stale = entry.generation != self._generations.get(resource, 0)
+            if (stale or not ttl) and self._entries.get(key) is entry:
+                del self._entries[key]
+        return copy.deepcopy(entry.response)
+
+    def invalidate(self, *resources):
+        """Drops cached reads of the given resources.
+
+        Args:
+            *resources (str): Resources to invalidate, eg. parameters. If
+                none are given, every cached read is dropped.
+        """
+        with self._lock:
+            if not resources:
+                resources = set(self._generations) | set(
+                    _resources.get(key[0], key[0]) for key in self._entries)
+            for resource in resources:
+                self._generations[resource] = self._generations.get(
+                    resource, 0) + 1
+            for key in list(self._entries):
+                if _resources.get(key[0], key[0]) in resources:
+                    del self._entries[key]
+
+
+def coalescing_window():
+    """Returns the coalescing window configured for this process.
+
+    The window is read from the MOZBITBAR_COALESCE_WINDOW environment
+    variable, in seconds. A value of 0 disables coalescing.
+
+    Returns:
+        float: Window in seconds.
+    """
+    return float(os.getenv('MOZBITBAR_COALESCE_WINDOW', DEFAULT_WINDOW))
+
+
+def _response_cache(client):
+    window = coalescing_window()
+    if window <= 0:
+        return client
+    return ResponseCache(client, window=window)
+
+
+add_wrapper(_response_cache, RESPONSE_CACHE_ORDER)
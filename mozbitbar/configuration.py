@@ -9,14 +9,32 @@ import os
 
 from testdroid import RequestResponseError, Testdroid
 
-try:
-    from mozbitbar import MozbitbarCredentialException
-except ImportError:
-    from __init__ import MozbitbarCredentialException
+from mozbitbar import MozbitbarCredentialException
+# ratelimit and retry register their client wrappers upon import.
+from mozbitbar import client, ratelimit, retry  # noqa: F401
 
 
 logger = logging.getLogger('mozbitbar')
 
+# verified clients keyed by credentials, kept for reuse by long-lived
+# processes. None when clients are not kept warm.
+_warm_clients = None
+
+
+def keep_clients_warm(enabled=True):
+    """Enables or disables reuse of authenticated clients across instances.
+
+    When enabled, every Configuration instance created with the same
+    credentials shares one verified Testdroid client, whose OAuth token and
+    cached catalog responses are reused between recipes.
+
+    Args:
+        enabled (bool, optional): True to keep clients warm. False to drop
+            all kept clients and create a new client per instance.
+    """
+    global _warm_clients
+    _warm_clients = {} if enabled else None
+
 
 class Configuration(object):
     def __init__(self, **kwargs):
@@ -61,11 +79,18 @@ class Configuration(object):
             msg = 'Missing Testdroid cloud URL. Check url value.'
             raise MozbitbarCredentialException(message=msg)
 
+        key = (self.user_name, self.user_password, self.api_key, self.url)
+        if _warm_clients is not None and key in _warm_clients:
+            # already verified by a previous instance.
+            self.client = _warm_clients[key]
+            return
+
         # instantiate client.
-        self.client = Testdroid(username=self.user_name or None,
-                                password=self.user_password or None,
-                                apikey=self.api_key or None,
-                                url=self.url)
+        self.client = client.wrap(
+            Testdroid(username=self.user_name or None,
+                      password=self.user_password or None,
+                      apikey=self.api_key or None,
+                      url=self.url))
 
         # make a simple call to verify parameters are valid.
         try:
@@ -73,3 +98,6 @@ class Configuration(object):
         except RequestResponseError as rre:
             raise MozbitbarCredentialException(message=rre.message,
                                                status_code=rre.status_code)
+
+        if _warm_clients is not None:
+            _warm_clients[key] = self.client
@@ -0,0 +1,246 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+from argparse import Namespace
+
+try:
+    from SocketServer import (StreamRequestHandler, ThreadingMixIn,
+                              UnixStreamServer)
+except ImportError:
+    from socketserver import (StreamRequestHandler, ThreadingMixIn,
+                              UnixStreamServer)
+
+from mozbitbar import MozbitbarBaseException
+from mozbitbar.log import _default_fmt
+from mozbitbar.metrics import REGISTRY
+
+
+logger = logging.getLogger('mozbitbar')
+
+
+def default_socket_path():
+    """Returns the per-user default location of the daemon socket.
+
+    Returns:
+        str: Path to the Unix socket.
+    """
+    return os.path.join(tempfile.gettempdir(),
+                        'mozbitbar-{}.sock'.format(os.getuid()))
+
+
+class _StreamingHandler(logging.Handler):
+    """Forwards log records emitted by a single thread to a callback."""
+    def __init__(self, send):
+        logging.Handler.__init__(self)
+        self.send = send
+        self.thread = threading.current_thread().ident
+        self.setFormatter(logging.Formatter(fmt=_default_fmt))
+
+    def emit(self, record):
+        if record.thread != self.thread:
+            return
+        try:
+            self.send({'event': 'log', 'level': record.levelname,
+                       'message': self.format(record)})
+        except (IOError, socket.error):
+            # client went away; the recipe still runs to completion.
+            pass
+
+
+class RecipeRequestHandler(StreamRequestHandler):
+    """Handles a single recipe submission.
+
+    The request is one line of JSON holding the recipe path and optionally a
+    credentials path. Progress is streamed back as JSON lines, the last of
+    which is a 'done' event carrying the exit status of the recipe.
+    """
+    def send(self, event):
+        self.wfile.write((json.dumps(event) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # connection probe, eg. from _is_listening.
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+            request['recipe']
+        except (ValueError, KeyError, TypeError):
+            self.send({'event': 'done', 'status': 2,
+                       'message': 'Malformed request.'})
+            return
+
+        handler = _StreamingHandler(self.send)
+        logger.addHandler(handler)
+        try:
+            status = execute(request)
+        finally:
+            logger.removeHandler(handler)
+            if self.server.metrics_path:
+                REGISTRY.write(self.server.metrics_path)
+        self.send({'event': 'done', 'status': status})
+
+
+class RecipeServer(ThreadingMixIn, UnixStreamServer):
+    """RecipeServer is a long-running process which accepts recipe
+    submissions over a Unix socket.
+
+    Authenticated clients and catalog responses are kept warm for the
+    lifetime of the server, so recipes only pay for their own API calls.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path=None, metrics_path=None):
+        """Initializes the RecipeServer and binds its socket.
+
+        Args:
+            socket_path (str, optional): Path of the Unix socket to listen
+                on. Defaults to default_socket_path().
+            metrics_path (str, optional): Path of a file to which metrics
+                are written in Prometheus text format after every recipe.
+
+        Raises:
+            MozbitbarBaseException: If another server is already listening
+                on the socket.
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.metrics_path = metrics_path
+        if os.path.exists(self.socket_path):
+            if _is_listening(self.socket_path):
+                msg = 'Server already running on: {}'.format(
+                    self.socket_path)
+                raise MozbitbarBaseException(message=msg)
+            # left behind by a server that did not shut down cleanly.
+            os.unlink(self.socket_path)
+        UnixStreamServer.__init__(self, self.socket_path,
+                                  RecipeRequestHandler)
+        from mozbitbar.configuration import keep_clients_warm
+        keep_clients_warm()
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def _is_listening(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+def execute(request):
+    """Runs a submitted recipe to completion.
+
+    Args:
+        request (:obj:`dict`): Submission holding recipe and, optionally,
+            credentials paths.
+
+    Returns:
+        int: Exit status of the recipe; 0 on success.
+    """
+    # loaded on first use; submitting needs none of it.
+    from mozbitbar.run import run_recipe
+
+    args = Namespace(credentials=request.get('credentials'))
+    try:
+        run_recipe(request['recipe'], args)
+    except SystemExit as se:
+        return se.code if isinstance(se.code, int) else 1
+    except Exception:
+        logger.exception('Unhandled error while running recipe.')
+        return 1
+    return 0
+
+
+def serve(socket_path=None, metrics_path=None):
+    """Serves recipe submissions until interrupted.
+
+    If the MOZBITBAR_PROJECT_POOL environment variable is set, the project
+    pool is replenished from a background thread meanwhile.
+
+    Args:
+        socket_path (str, optional): Path of the Unix socket to listen on.
+        metrics_path (str, optional): Path of a file to keep metrics in.
+    """
+    from mozbitbar import pool
+
+    server = RecipeServer(socket_path, metrics_path)
+    logger.info('Serving recipes on %s', server.socket_path)
+    replenisher = None
+    if pool.pool_path():
+        # recipes lease projects the server keeps ready.
+        replenisher = pool.Replenisher()
+        replenisher.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Shutting down.')
+    finally:
+        server.server_close()
+        if replenisher:
+            replenisher.stop()
+
+
+def submit(recipe, credentials=None, socket_path=None, stream=None):
+    """Submits a recipe to a running server and waits for it to complete.
+
+    Log output of the recipe is written to stream as it is produced.
+
+    Args:
+        recipe (str): Path to the recipe.
+        credentials (str, optional): Path to a credentials file.
+        socket_path (str, optional): Path of the server's Unix socket.
+        stream (file, optional): Destination of the streamed log output.
+            Defaults to stderr.
+
+    Returns:
+        int: Exit status of the recipe.
+
+    Raises:
+        MozbitbarBaseException: If the server could not be reached.
+    """
+    stream = stream or sys.stderr
+    socket_path = socket_path or default_socket_path()
+    request = {'recipe': os.path.abspath(recipe)}
+    if credentials:
+        request['credentials'] = os.path.abspath(credentials)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error as se:
+        sock.close()
+        msg = 'Unable to reach server at {}: {}'.format(socket_path, se)
+        raise MozbitbarBaseException(message=msg)
+
+    try:
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        for line in sock.makefile('rb'):
+            event = json.loads(line.decode('utf-8'))
+            if event['event'] == 'done':
+                if event.get('message'):
+                    stream.write(event['message'] + '\n')
+                return event['status']
+            stream.write(event['message'] + '\n')
+    finally:
+        sock.close()
+
+    msg = 'Server closed the connection before the recipe completed.'
+    raise MozbitbarBaseException(message=msg)
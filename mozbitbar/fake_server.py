@@ -0,0 +1,672 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""A local stand-in for the Bitbar REST API.
+
+FakeBitbar serves the endpoints used by mozbitbar from generated in-memory
+data, with configurable data-set sizes, per-endpoint latency, error
+injection, pagination, device logs served by byte range, and JUnit results
+of finished test runs, so that mozbitbar can be benchmarked and tested end
+to end over real HTTP without network access:
+
+    with FakeBitbar(sizes={'projects': 1000}) as server:
+        bitbar = Bitbar(TESTDROID_APIKEY='key', TESTDROID_URL=server.url)
+
+It can also be run standalone:
+
+    $ python -m mozbitbar.fake_server --port 8080 --projects 1000
+"""
+
+from __future__ import absolute_import, print_function
+
+import json
+import random
+import re
+import threading
+import time
+from argparse import ArgumentParser
+from itertools import count
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+
+# sizes of the generated data set.
+DEFAULT_SIZES = {
+    'projects': 20,
+    'runs_per_project': 5,
+    'frameworks': 10,
+    'device_groups': 5,
+    'devices': 50,
+    'files': 20,
+    'parameters_per_project': 2,
+    'sessions_per_run': 2,
+}
+
+# items per page when a list request specifies no limit, as on Bitbar.
+DEFAULT_PAGE_SIZE = 20
+
+# polls of a started test run after which it is reported as FINISHED.
+DEFAULT_RUN_POLLS = 2
+
+USER_ID = 1
+
+# (method, pattern, endpoint) of every route. Endpoint names are used to
+# configure latency and errors, and to count requests.
+_routes = [
+    ('POST', r'/oauth/token', 'token'),
+    ('GET', r'/api/v2/me', 'me'),
+    ('GET', r'/api/v2/me/projects', 'projects'),
+    ('POST', r'/api/v2/me/projects', 'create_project'),
+    ('GET', r'/api/v2/me/projects/(?P<project>\d+)', 'project'),
+    ('DELETE', r'/api/v2/me/projects/(?P<project>\d+)', 'delete_project'),
+    ('GET', r'/api/v2/me/projects/(?P<project>\d+)/config', 'config'),
+    ('POST', r'/api/v2/users/\d+/projects/(?P<project>\d+)/config',
+     'set_config'),
+    ('GET', r'/api/v2/me/projects/(?P<project>\d+)/config/parameters',
+     'parameters'),
+    ('POST', r'/api/v2/users/\d+/projects/(?P<project>\d+)/config/parameters',
+     'set_parameter'),
+    ('DELETE', r'/api/v2/users/\d+/projects/(?P<project>\d+)/config/'
+     r'parameters/(?P<parameter>\d+)', 'delete_parameter'),
+    ('POST', r'/api/v2/projects/(?P<project>\d+)/frameworks',
+     'set_framework'),
+    ('GET', r'/api/v2/me/available-frameworks', 'frameworks'),
+    ('GET', r'/api/v2/me/files', 'files'),
+    ('DELETE', r'/api/v2/me/files/(?P<file>\d+)', 'delete_file'),
+    ('POST', r'/api/v2/users/\d+/(projects/(?P<project>\d+)/)?files'
+     r'(/(?P<file_type>\w+))?', 'upload'),
+    ('GET', r'/api/v2/me/device-groups', 'device_groups'),
+    ('GET', r'/api/v2/devices', 'devices'),
+    ('GET', r'/api/v2/me/projects/(?P<project>\d+)/runs', 'runs'),
+    ('POST', r'/api/v2/users/\d+/projects/(?P<project>\d+)/runs',
+     'start_run'),
+    ('GET', r'/api/v2/me/projects/(?P<project>\d+)/runs/(?P<run>\d+)',
+     'run'),
+    ('DELETE', r'/api/v2/me/projects/(?P<project>\d+)/runs/(?P<run>\d+)',
+     'delete_run'),
+    ('GET', r'/api/v2/me/projects/(?P<project>\d+)/runs/(?P<run>\d+)/'
+     r'device-runs', 'device_runs'),
+    ('GET', r'/api/v2/me/projects/(?P<project>\d+)/runs/(?P<run>\d+)/'
+     r'device-sessions/(?P<session>\d+)/logs', 'device_log'),
+    ('GET', r'/api/v2/me/projects/(?P<project>\d+)/runs/(?P<run>\d+)/'
+     r'device-sessions/(?P<session>\d+)/output-file-set/files',
+     'output_files'),
+    ('GET', r'/api/v2/me/files/(?P<file>\d+)/file', 'download'),
+]
+_routes = [(method, re.compile(pattern + '$'), endpoint)
+           for (method, pattern, endpoint) in _routes]
+
+
+class RawResponse(object):
+    """Body of a response which is not JSON, with its own headers."""
+    def __init__(self, body, content_type='text/plain; charset=utf-8',
+                 headers=None):
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class FakeBitbar(ThreadingMixIn, HTTPServer):
+    """FakeBitbar is a threaded HTTP server imitating the Bitbar API."""
+    daemon_threads = True
+    # load tests open hundreds of connections at once.
+    request_queue_size = 1024
+
+    def __init__(self, port=0, sizes=None, latency=None, error_rates=None,
+                 page_size=DEFAULT_PAGE_SIZE, run_polls=DEFAULT_RUN_POLLS,
+                 seed=0):
+        """Initializes the server and generates its data set.
+
+        Args:
+            port (int, optional): Port to listen on, on the loopback
+                interface. By default, a free port is picked.
+            sizes (dict, optional): Sizes of the data set, overriding
+                DEFAULT_SIZES.
+            latency (dict, optional): Seconds added to the response time,
+                keyed by endpoint name; '*' applies to all other endpoints.
+            error_rates (dict, optional): Fraction of requests failing, and
+                the status code they fail with, as (rate, status) keyed by
+                endpoint name; '*' applies to all other endpoints.
+            page_size (int, optional): Items per page when a list request
+                specifies no limit.
+            run_polls (int, optional): Polls of a started test run after
+                which it finishes.
+            seed (int, optional): Seed of the data set and error rates.
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', port), _RequestHandler)
+        self.sizes = dict(DEFAULT_SIZES, **(sizes or {}))
+        self.latency = latency or {}
+        self.error_rates = error_rates or {}
+        self.page_size = page_size
+        self.run_polls = run_polls
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # requests received and bytes uploaded, keyed by endpoint name.
+        self.requests = {}
+        self.uploaded_bytes = 0
+        self._injected = {}
+        self._ids = count(10 ** 6)
+        self._tokens = set()
+        # polls of the test runs started by clients, keyed by id.
+        self._polls = {}
+        # device sessions of the test runs started by clients, keyed by run
+        # id, and their logs keyed by session id. Logs of hung sessions stop
+        # growing.
+        self._sessions = {}
+        self.logs = {}
+        self.hung_sessions = set()
+        # output files of device sessions keyed by session id, and their
+        # contents keyed by file id.
+        self.output_files = {}
+        self.contents = {}
+        self._thread = None
+        self._generate()
+
+    @property
+    def url(self):
+        """str: Base URL of the server, to be used as TESTDROID_URL."""
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def start(self):
+        """Serves requests from a background thread."""
+        # a short poll interval keeps stopping the server quick.
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def inject_error(self, endpoint, status, count=1):
+        """Makes the next requests to an endpoint fail.
+
+        Args:
+            endpoint (str): Endpoint name.
+            status (int): HTTP status code of the failures.
+            count (int, optional): Number of requests failing.
+        """
+        with self.lock:
+            self._injected.setdefault(endpoint, []).extend([status] * count)
+
+    # Data set #
+
+    def _next_id(self):
+        return next(self._ids)
+
+    def _generate(self):
+        sizes = self.sizes
+        now = int(time.time() * 1000)
+        day = 86400 * 1000
+
+        self.frameworks = [
+            {'id': 100 + i, 'name': 'Framework {}'.format(i),
+             'osType': ('ANDROID', 'IOS')[i % 2]}
+            for i in range(sizes['frameworks'])]
+        self.devices = [
+            {'id': 1000 + i, 'displayName': 'Device {}'.format(i),
+             'osType': ('ANDROID', 'IOS')[i % 2], 'online': True}
+            for i in range(sizes['devices'])]
+        self.device_groups = [
+            {'id': 2000 + i, 'displayName': 'Group {}'.format(i),
+             'osType': ('ANDROID', 'IOS')[i % 2], 'userId': USER_ID,
+             # devices are dealt to the groups in turn.
+             'deviceCount': len(self.devices[i::sizes['device_groups']])}
+            for i in range(sizes['device_groups'])]
+        self.files = [
+            {'id': 3000 + i, 'name': 'file_{}.apk'.format(i),
+             'size': 1024 * (i + 1), 'direction': 'INPUT',
+             'createTime': now - i * day}
+            for i in range(sizes['files'])]
+
+        self.projects = {}
+        for i in range(sizes['projects']):
+            self.add_project('Project {}'.format(i),
+                             runs=sizes['runs_per_project'],
+                             parameters=sizes['parameters_per_project'],
+                             create_time=now - i * day)
+
+    def add_project(self, name, runs=0, parameters=0, create_time=None):
+        """Adds a project to the data set, with finished test runs and
+        parameters.
+
+        Args:
+            name (str): Name of the project.
+            runs (int, optional): Number of test runs of the project.
+            parameters (int, optional): Number of parameters of the project,
+                with keys key_0, key_1 and so on.
+            create_time (int, optional): Creation time of the project, in
+                milliseconds since the epoch.
+
+        Returns:
+            dict: The project.
+        """
+        now = int(time.time() * 1000)
+        framework = (self.random.choice(self.frameworks)
+                     if self.frameworks else {'id': None})
+        project = self._new_project(name, 'DEFAULT', create_time or now)
+        project['frameworkId'] = framework['id']
+        state = self.projects[project['id']]
+        state['config']['frameworkId'] = framework['id']
+        for j in range(parameters):
+            state['parameters'].append(
+                {'id': self._next_id(), 'key': 'key_{}'.format(j),
+                 'value': 'value_{}'.format(j)})
+        for j in range(runs):
+            run = self._new_run(project['id'], 'Run {}'.format(j),
+                                now - j * 3600 * 1000)
+            # queued for a minute, and running between 10 and 20 minutes.
+            run.update(state='FINISHED',
+                       startTime=run['createTime'] + 60 * 1000,
+                       endTime=run['createTime'] + (660 + j % 600) * 1000)
+        return project
+
+    def _new_project(self, name, project_type, create_time=None):
+        project = {'id': self._next_id(), 'name': name, 'type': project_type,
+                   'osType': 'ANDROID', 'frameworkId': None,
+                   'createTime': create_time or int(time.time() * 1000)}
+        self.projects[project['id']] = {
+            'project': project,
+            'config': {'projectId': project['id'], 'frameworkId': None,
+                       'usedDeviceGroupId': None},
+            'parameters': [],
+            'runs': [],
+        }
+        return project
+
+    def add_output_file(self, session_id, name, contents):
+        """Adds an output file to a device session.
+
+        Args:
+            session_id (int): Id of the device session.
+            name (str): File name.
+            contents (bytes): File contents.
+        """
+        output_file = {'id': self._next_id(), 'name': name, 'state': 'READY',
+                       'size': len(contents)}
+        self.output_files.setdefault(session_id, []).append(output_file)
+        self.contents[output_file['id']] = contents
+        return output_file
+
+    def _junit(self, tests):
+        """Returns JUnit XML results of passing tests, as written by the
+        logs of sessions.
+        """
+        cases = ''.join(
+            '<testcase classname="FakeSuite" name="test_{}" time="0.5"/>'
+            .format(test) for test in range(1, tests + 1))
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<testsuite name="FakeSuite" tests="{}">{}</testsuite>'
+                .format(tests, cases)).encode('utf-8')
+
+    def _new_run(self, project_id, name, create_time=None):
+        runs = self._project_state(project_id)['runs']
+        run = {'id': self._next_id(), 'projectId': project_id,
+               'number': len(runs) + 1, 'displayName': name,
+               'state': 'WAITING',
+               'createTime': create_time or int(time.time() * 1000)}
+        runs.append(run)
+        return run
+
+    def _project_state(self, project_id):
+        state = self.projects.get(int(project_id))
+        if state is None:
+            raise HTTPError(404, 'Project not found')
+        return state
+
+    def _find_run(self, project_id, run_id):
+        for run in self._project_state(project_id)['runs']:
+            if run['id'] == int(run_id):
+                return run
+        raise HTTPError(404, 'Test run not found')
+
+    # Request handling #
+
+    def _fault(self, endpoint):
+        """Returns the status code of an error to respond with, if any."""
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            injected = self._injected.get(endpoint)
+            if injected:
+                return injected.pop(0)
+            rate, status = self.error_rates.get(
+                endpoint, self.error_rates.get('*', (0, None)))
+            if rate and self.random.random() < rate:
+                return status
+        return None
+
+    def respond(self, method, endpoint, match, query, form, body, headers):
+        """Handles a request, returning the status code and body of the
+        response.
+        """
+        delay = self.latency.get(endpoint, self.latency.get('*', 0))
+        if delay:
+            time.sleep(delay)
+        status = self._fault(endpoint)
+        if status:
+            raise HTTPError(status, 'Injected error')
+
+        if endpoint == 'token':
+            return 200, self._token(form)
+        self._authenticate(headers)
+
+        with self.lock:
+            handler = getattr(self, '_' + endpoint)
+            if endpoint == 'device_log':
+                # served by byte range, as Bitbar serves growing logs.
+                return handler(match.groupdict(), headers.get('Range'))
+            return handler(match.groupdict(), query, form, body)
+
+    def _token(self, form):
+        if not form.get('username') and not form.get('refresh_token'):
+            raise HTTPError(401, 'Bad credentials')
+        token = 'token-{}'.format(self._next_id())
+        with self.lock:
+            self._tokens.add(token)
+        return {'access_token': token, 'refresh_token': 'refresh-' + token,
+                'expires_in': 3600}
+
+    def _authenticate(self, headers):
+        authorization = headers.get('Authorization') or ''
+        if authorization.startswith('Basic '):
+            return
+        if authorization[len('Bearer '):] in self._tokens:
+            return
+        raise HTTPError(401, 'Unauthorized')
+
+    def _page(self, items, query):
+        """Returns a page of items, as listed by Bitbar.
+
+        A limit of 0 requests all items. Items are sorted by a field in
+        ascending or descending order with sort=field_a or sort=field_d.
+        """
+        if query.get('sort'):
+            field, _, direction = query['sort'].rpartition('_')
+            items = sorted(items, key=lambda item: item.get(field),
+                           reverse=direction == 'd')
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', self.page_size))
+        page = items[offset:offset + limit] if limit else items[offset:]
+        return 200, {'data': page, 'offset': offset, 'limit': limit,
+                     'total': len(items), 'empty': not page}
+
+    def _me(self, params, query, form, body):
+        return 200, {'id': USER_ID, 'accountId': USER_ID,
+                     'name': 'Fake User', 'email': 'fake@example.com'}
+
+    def _projects(self, params, query, form, body):
+        return self._page([state['project'] for (_, state)
+                           in sorted(self.projects.items())], query)
+
+    def _create_project(self, params, query, form, body):
+        return 201, self._new_project(form.get('name'), form.get('type'))
+
+    def _project(self, params, query, form, body):
+        return 200, self._project_state(params['project'])['project']
+
+    def _delete_project(self, params, query, form, body):
+        self._project_state(params['project'])
+        del self.projects[int(params['project'])]
+        return 204, None
+
+    def _config(self, params, query, form, body):
+        return 200, self._project_state(params['project'])['config']
+
+    def _set_config(self, params, query, form, body):
+        config = self._project_state(params['project'])['config']
+        config.update(form)
+        return 200, config
+
+    def _parameters(self, params, query, form, body):
+        parameters = self._project_state(params['project'])['parameters']
+        return self._page(parameters, query)
+
+    def _set_parameter(self, params, query, form, body):
+        parameters = self._project_state(params['project'])['parameters']
+        if any(p['key'] == form.get('key') for p in parameters):
+            raise HTTPError(409, 'Parameter already exists')
+        parameter = {'id': self._next_id(), 'key': form.get('key'),
+                     'value': form.get('value')}
+        parameters.append(parameter)
+        return 201, parameter
+
+    def _delete_parameter(self, params, query, form, body):
+        state = self._project_state(params['project'])
+        remaining = [p for p in state['parameters']
+                     if p['id'] != int(params['parameter'])]
+        if len(remaining) == len(state['parameters']):
+            raise HTTPError(404, 'Parameter not found')
+        state['parameters'] = remaining
+        return 204, None
+
+    def _set_framework(self, params, query, form, body):
+        state = self._project_state(params['project'])
+        framework_id = int(form.get('frameworkId'))
+        if framework_id not in [f['id'] for f in self.frameworks]:
+            raise HTTPError(404, 'Framework not found')
+        state['project']['frameworkId'] = framework_id
+        state['config']['frameworkId'] = framework_id
+        return 200, state['project']
+
+    def _frameworks(self, params, query, form, body):
+        return self._page(self.frameworks, query)
+
+    def _files(self, params, query, form, body):
+        return self._page(self.files, query)
+
+    def _delete_file(self, params, query, form, body):
+        remaining = [f for f in self.files if f['id'] != int(params['file'])]
+        if len(remaining) == len(self.files):
+            raise HTTPError(404, 'File not found')
+        self.files = remaining
+        return 204, None
+
+    def _upload(self, params, query, form, body):
+        if params.get('project'):
+            self._project_state(params['project'])
+        match = re.search(br'filename="([^"]*)"', body or b'')
+        if not match:
+            raise HTTPError(400, 'No file')
+        self.uploaded_bytes += len(body)
+        uploaded = {'id': self._next_id(),
+                    'name': match.group(1).decode('utf-8'),
+                    'size': len(body), 'direction': 'INPUT',
+                    'createTime': int(time.time() * 1000)}
+        self.files.append(uploaded)
+        return 201, uploaded
+
+    def _device_groups(self, params, query, form, body):
+        return self._page(self.device_groups, query)
+
+    def _devices(self, params, query, form, body):
+        return self._page(self.devices, query)
+
+    def _runs(self, params, query, form, body):
+        runs = self._project_state(params['project'])['runs']
+        return self._page(runs, query)
+
+    def _start_run(self, params, query, form, body):
+        run = self._new_run(int(params['project']),
+                            form.get('name') or 'Test run')
+        if form.get('usedDeviceGroupId'):
+            run['usedDeviceGroupId'] = int(form['usedDeviceGroupId'])
+        self._polls[run['id']] = 0
+        sessions = []
+        for device in self.devices[:self.sizes['sessions_per_run']]:
+            session = {'id': self._next_id(), 'state': 'WAITING',
+                       'device': {'id': device['id'],
+                                  'displayName': device['displayName']}}
+            sessions.append(session)
+            self.logs[session['id']] = b'Installing application\n'
+        self._sessions[run['id']] = sessions
+        return 201, run
+
+    def _run(self, params, query, form, body):
+        run = self._find_run(params['project'], params['run'])
+        if run['id'] in self._polls and run['state'] != 'FINISHED':
+            # started by a client; progresses with every poll.
+            self._polls[run['id']] += 1
+            polls = self._polls[run['id']]
+            now = int(time.time() * 1000)
+            run['state'] = 'FINISHED' if polls > self.run_polls else 'RUNNING'
+            run.setdefault('startTime', now)
+            if run['state'] == 'FINISHED':
+                run['endTime'] = now
+            for session in self._sessions[run['id']]:
+                if session['id'] in self.hung_sessions:
+                    continue
+                session.setdefault('startTime', now)
+                if run['state'] == 'FINISHED':
+                    session['state'] = 'SUCCEEDED'
+                    session['endTime'] = now
+                    line = 'Tests finished\n'
+                    self.add_output_file(session['id'], 'TEST-results.xml',
+                                         self._junit(polls - 1))
+                else:
+                    session['state'] = 'RUNNING'
+                    line = 'Test {} passed\n'.format(polls)
+                self.logs[session['id']] += line.encode('utf-8')
+        return 200, run
+
+    def _device_runs(self, params, query, form, body):
+        run = self._find_run(params['project'], params['run'])
+        return self._page(self._sessions.get(run['id'], []), query)
+
+    def _device_log(self, params, byte_range):
+        log = self.logs.get(int(params['session']))
+        if log is None:
+            raise HTTPError(404, 'Device session not found')
+        match = re.match(r'bytes=(\d+)-(\d*)$', byte_range or '')
+        if not match:
+            return 200, RawResponse(log)
+        start = int(match.group(1))
+        end = min(int(match.group(2) or len(log) - 1), len(log) - 1)
+        if start >= len(log):
+            return 416, RawResponse(b'', headers={
+                'Content-Range': 'bytes */{}'.format(len(log))})
+        return 206, RawResponse(log[start:end + 1], headers={
+            'Content-Range': 'bytes {}-{}/{}'.format(start, end, len(log))})
+
+    def _output_files(self, params, query, form, body):
+        self._find_run(params['project'], params['run'])
+        return self._page(self.output_files.get(int(params['session']), []),
+                          query)
+
+    def _download(self, params, query, form, body):
+        contents = self.contents.get(int(params['file']))
+        if contents is None:
+            raise HTTPError(404, 'File not found')
+        return 200, RawResponse(contents, 'application/octet-stream')
+
+    def _delete_run(self, params, query, form, body):
+        state = self._project_state(params['project'])
+        run = self._find_run(params['project'], params['run'])
+        state['runs'].remove(run)
+        return 204, None
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # keep benchmarks and tests quiet.
+        pass
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        query = dict((key, values[-1]) for (key, values)
+                     in parse_qs(url.query).items())
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        form = {}
+        content_type = self.headers.get('Content-Type') or ''
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            form = dict((key, values[-1]) for (key, values)
+                        in parse_qs(body.decode('utf-8')).items())
+
+        try:
+            for route_method, pattern, endpoint in _routes:
+                match = pattern.match(url.path)
+                if route_method == method and match:
+                    break
+            else:
+                msg = 'No route for {} {}'.format(method, url.path)
+                raise HTTPError(404, msg)
+            status, payload = self.server.respond(
+                method, endpoint, match, query, form, body, self.headers)
+        except HTTPError as e:
+            status, payload = e.status, {'message': e.message}
+
+        headers = {'Content-Type': 'application/json'}
+        if isinstance(payload, RawResponse):
+            response = payload.body
+            headers['Content-Type'] = payload.content_type
+            headers.update(payload.headers)
+        else:
+            response = b'' if payload is None else \
+                json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        for name, value in sorted(headers.items()):
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+
+def main():
+    parser = ArgumentParser(description='Serves a fake Bitbar API.')
+    parser.add_argument('--port', type=int, default=8080)
+    for name, size in sorted(DEFAULT_SIZES.items()):
+        parser.add_argument('--' + name.replace('_', '-'), type=int,
+                            default=size, help='Default: %(default)s.')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds added to every response.')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Fraction of requests failing with HTTP 503.')
+    args = parser.parse_args()
+
+    sizes = dict((name, getattr(args, name)) for name in DEFAULT_SIZES)
+    server = FakeBitbar(args.port, sizes=sizes, latency={'*': args.latency},
+                        error_rates={'*': (args.error_rate, 503)})
+    print('Serving fake Bitbar API on {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
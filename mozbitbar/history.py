@@ -0,0 +1,504 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Keeps the history of test runs in a local SQLite database.
+
+Runs and their device sessions are recorded by notify_test_run_complete when
+the MOZBITBAR_HISTORY environment variable holds the path of the database,
+and by `mozbitbar sync`. Durations and failure rates can then be queried
+without listing runs from Bitbar:
+
+    with RunHistory(path) as history:
+        history.duration_percentiles(name='mochitest-*', device_group=2000)
+        history.failure_rates(device_group='Group 0')
+"""
+
+from __future__ import absolute_import, print_function
+
+import math
+import os
+import re
+import sqlite3
+import time
+
+from mozbitbar.logtail import TERMINAL_STATES
+
+# states of device sessions counted as failures; excluded sessions did not
+# run at all, and are not counted.
+FAILED_STATES = ('ABORTED', 'FAILED', 'TIMEOUT')
+COUNTED_STATES = tuple(state for state in TERMINAL_STATES
+                       if state != 'EXCLUDED')
+
+DEFAULT_PERCENTILES = (0.5, 0.9, 0.95)
+
+# past runs needed for an estimate to be trusted.
+MIN_SAMPLES = 5
+
+# factor applied to the 99th percentile of past durations to get a timeout,
+# and the shortest timeout set from estimates, in seconds.
+DEFAULT_MARGIN = 1.5
+MIN_TIMEOUT = 60
+
+# bounds of estimated poll intervals, in seconds.
+MIN_INTERVAL = 5
+MAX_INTERVAL = 120
+
+# parts of run names differing between runs of a suite: uuids, as generated
+# by start_test_run, and numbers such as dates or build ids.
+_variable_parts = re.compile(
+    r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\d+',
+    re.IGNORECASE)
+
+_schema = (
+    'CREATE TABLE IF NOT EXISTS runs ('
+    'id INTEGER PRIMARY KEY, name TEXT, project_id INTEGER, '
+    'project_name TEXT, device_group_id INTEGER, device_group_name TEXT, '
+    'state TEXT, create_time INTEGER, start_time INTEGER, '
+    'end_time INTEGER, duration REAL, framework_id INTEGER)',
+    'CREATE TABLE IF NOT EXISTS device_runs ('
+    'id INTEGER PRIMARY KEY, run_id INTEGER NOT NULL, device_id INTEGER, '
+    'device_name TEXT, state TEXT, start_time INTEGER, end_time INTEGER, '
+    'duration REAL)',
+    # highest run id seen by the last sync of every project.
+    'CREATE TABLE IF NOT EXISTS watermarks ('
+    'project_id INTEGER PRIMARY KEY, run_id INTEGER NOT NULL, '
+    'synced REAL NOT NULL)',
+    # filters of the queries, and listings of a project.
+    'CREATE INDEX IF NOT EXISTS runs_state ON runs (project_id, state)',
+    'CREATE INDEX IF NOT EXISTS runs_name ON runs (name, device_group_id)',
+    'CREATE INDEX IF NOT EXISTS runs_group_name '
+    'ON runs (device_group_name, create_time)',
+    'CREATE INDEX IF NOT EXISTS runs_group ON runs (device_group_id, '
+    'create_time)',
+    'CREATE INDEX IF NOT EXISTS runs_project ON runs (project_id, id)',
+    'CREATE INDEX IF NOT EXISTS device_runs_run ON device_runs (run_id)',
+    'CREATE INDEX IF NOT EXISTS device_runs_device '
+    'ON device_runs (device_name, run_id)',
+)
+
+
+def history_path():
+    """Returns the path of the history database, set with the
+    MOZBITBAR_HISTORY environment variable.
+
+    Returns:
+        str: Path of the database, or None if runs are not recorded.
+    """
+    return os.getenv('MOZBITBAR_HISTORY') or None
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of values.
+
+    Args:
+        values (list): Values, in ascending order.
+        fraction (float): Percentile, between 0 and 1.
+
+    Returns:
+        float: The percentile, or None if there are no values.
+    """
+    if not values:
+        return None
+    rank = max(int(math.ceil(fraction * len(values))), 1)
+    return values[rank - 1]
+
+
+def name_pattern(name):
+    """Returns a shell-style pattern matching the names of the runs of a
+    suite, with numbers and uuids replaced by wildcards.
+
+    Args:
+        name (str): Name of a test run.
+
+    Returns:
+        str: Pattern, as accepted by the name filter of queries.
+    """
+    literals = _variable_parts.split(name)
+    # wildcards in names only match themselves.
+    return '*'.join(re.sub(r'([*?[])', r'[\1]', literal)
+                    for literal in literals)
+
+
+class DurationEstimate(object):
+    """DurationEstimate predicts when a test run finishes from the
+    durations of past runs of the same suite, measured from their creation.
+    """
+    def __init__(self, durations):
+        """Initializes the DurationEstimate.
+
+        Args:
+            durations (list): Past durations in seconds, in ascending order.
+        """
+        self.samples = len(durations)
+        self.earliest = percentile(durations, 0.1)
+        self.expected = percentile(durations, 0.5)
+        self.latest = percentile(durations, 0.99)
+
+    def timeout(self, margin=DEFAULT_MARGIN):
+        """Returns the time after which the run is late, in seconds."""
+        return max(self.latest * margin, MIN_TIMEOUT)
+
+    def interval(self, elapsed):
+        """Returns the time to wait before polling the run again.
+
+        Polls are sparse until the earliest expected finish, concentrated
+        between it and the latest, and back off once the run is late.
+
+        Args:
+            elapsed (float): Seconds since the run was created.
+
+        Returns:
+            float: Seconds to wait, between MIN_INTERVAL and MAX_INTERVAL.
+        """
+        if elapsed < self.earliest:
+            # half of the time left until the run may finish.
+            wait = (self.earliest - elapsed) / 2.0
+        elif elapsed <= self.latest:
+            wait = (self.latest - self.earliest) / 20.0
+        else:
+            wait = (elapsed - self.latest) / 2.0
+        return min(max(wait, MIN_INTERVAL), MAX_INTERVAL)
+
+
+def _duration(record):
+    """Returns the time a run or device session spent running, in seconds.
+    """
+    # Bitbar timestamps are in milliseconds.
+    if (record.get('startTime') is not None and
+            record.get('endTime') is not None):
+        return (record['endTime'] - record['startTime']) / 1000.0
+    return None
+
+
+class RunHistory(object):
+    """RunHistory stores test runs and their device sessions, and answers
+    queries on their durations and outcomes.
+    """
+    def __init__(self, path):
+        """Opens the database, creating it if needed.
+
+        Args:
+            path (str): Path of the SQLite database.
+        """
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # recipes running concurrently may record at the same time.
+        self._connection = sqlite3.connect(path, timeout=30)
+        with self._connection:
+            for statement in _schema:
+                self._connection.execute(statement)
+            columns = [row[1] for row in
+                       self._connection.execute('PRAGMA table_info(runs)')]
+            # databases created before frameworks were recorded.
+            if 'framework_id' not in columns:
+                self._connection.execute(
+                    'ALTER TABLE runs ADD COLUMN framework_id INTEGER')
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Recording #
+
+    def record_run(self, run, device_runs=None, project_name=None,
+                   device_group_id=None, device_group_name=None,
+                   framework_id=None):
+        """Records a test run, and optionally its device sessions.
+
+        A run recorded again is updated; details known from an earlier
+        recording, such as its device group, are kept if not given again.
+
+        Args:
+            run (dict): Test run, as returned by Bitbar.
+            device_runs (list, optional): Device sessions of the run, as
+                returned by Bitbar.
+            project_name (str, optional): Name of the project of the run.
+            device_group_id (int, optional): Id of the device group of the
+                run. Defaults to the group the run was started on.
+            device_group_name (str, optional): Name of the device group.
+            framework_id (int, optional): Id of the framework of the run.
+        """
+        with self._connection:
+            self._connection.execute(
+                'INSERT OR IGNORE INTO runs (id) VALUES (?)', (run['id'],))
+            self._connection.execute(
+                'UPDATE runs SET name = ?, state = ?, create_time = ?, '
+                'start_time = ?, end_time = ?, duration = ?, '
+                'project_id = COALESCE(?, project_id), '
+                'project_name = COALESCE(?, project_name), '
+                'device_group_id = COALESCE(?, device_group_id), '
+                'device_group_name = COALESCE(?, device_group_name), '
+                'framework_id = COALESCE(?, framework_id) '
+                'WHERE id = ?',
+                (run.get('displayName'), run.get('state'),
+                 run.get('createTime'), run.get('startTime'),
+                 run.get('endTime'), _duration(run), run.get('projectId'),
+                 project_name,
+                 device_group_id or run.get('usedDeviceGroupId'),
+                 device_group_name, framework_id or run.get('frameworkId'),
+                 run['id']))
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO device_runs VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?)',
+                [(device_run['id'], run['id'],
+                  device_run.get('device', {}).get('id'),
+                  device_run.get('device', {}).get('displayName'),
+                  device_run.get('state'), device_run.get('startTime'),
+                  device_run.get('endTime'), _duration(device_run))
+                 for device_run in device_runs or []])
+
+    def pending_runs(self, project_id):
+        """Returns the ids of the recorded runs of a project which had not
+        finished when last recorded.
+
+        Args:
+            project_id (int): Id of the project.
+
+        Returns:
+            list: Ids of the runs, in ascending order.
+        """
+        rows = self._connection.execute(
+            'SELECT id FROM runs WHERE project_id = ? AND '
+            "(state IS NULL OR state != 'FINISHED') ORDER BY id",
+            (project_id,))
+        return [row[0] for row in rows]
+
+    def watermark(self, project_id):
+        """Returns the highest run id seen by the last sync of a project.
+
+        Args:
+            project_id (int): Id of the project.
+
+        Returns:
+            int: Id of the run, or None if the project was never synced.
+        """
+        row = self._connection.execute(
+            'SELECT run_id FROM watermarks WHERE project_id = ?',
+            (project_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, project_id, run_id):
+        """Records the highest run id seen by a sync of a project.
+
+        Args:
+            project_id (int): Id of the project.
+            run_id (int): Id of the run.
+        """
+        with self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)',
+                (project_id, run_id, time.time()))
+
+    # Queries #
+
+    def _where(self, name=None, device_group=None, project_id=None,
+               framework_id=None, since=None):
+        """Returns the conditions on runs matching the filters, and their
+        parameters.
+        """
+        conditions = []
+        parameters = []
+        if name:
+            # shell-style patterns, as with cleanup.
+            conditions.append('runs.name GLOB ?')
+            parameters.append(name)
+        if isinstance(device_group, int):
+            conditions.append('runs.device_group_id = ?')
+            parameters.append(device_group)
+        elif device_group:
+            conditions.append('runs.device_group_name = ?')
+            parameters.append(device_group)
+        if project_id:
+            conditions.append('runs.project_id = ?')
+            parameters.append(project_id)
+        if framework_id:
+            conditions.append('runs.framework_id = ?')
+            parameters.append(framework_id)
+        if since:
+            conditions.append('runs.create_time >= ?')
+            parameters.append(int(since * 1000))
+        return conditions, parameters
+
+    def durations(self, name=None, device_group=None, project_id=None,
+                  framework_id=None, since=None, device=None,
+                  turnaround=False):
+        """Returns the durations of finished runs matching the filters.
+
+        Args:
+            name (str, optional): Shell-style pattern matched against the
+                name of the run.
+            device_group (int or str, optional): Id or name of the device
+                group of the run.
+            project_id (int, optional): Id of the project of the run.
+            framework_id (int, optional): Id of the framework of the run.
+            since (float, optional): Earliest creation time of the run, in
+                seconds since epoch.
+            device (str, optional): If specified, the durations of the
+                sessions of this device in matching runs are returned
+                instead.
+            turnaround (bool, optional): If True, durations of runs are
+                measured from their creation rather than their start, time
+                spent queued included.
+
+        Returns:
+            list: Durations in seconds, in ascending order.
+        """
+        conditions, parameters = self._where(name, device_group, project_id,
+                                             framework_id, since)
+        if device:
+            query = ('SELECT device_runs.duration FROM device_runs '
+                     'JOIN runs ON runs.id = device_runs.run_id')
+            conditions[:0] = ['device_runs.device_name = ?',
+                              'device_runs.duration IS NOT NULL']
+            parameters[:0] = [device]
+            column = 'device_runs.duration'
+        elif turnaround:
+            column = '(runs.end_time - runs.create_time) / 1000.0'
+            query = 'SELECT {} FROM runs'.format(column)
+            conditions[:0] = ["runs.state = 'FINISHED'",
+                              'runs.end_time IS NOT NULL',
+                              'runs.create_time IS NOT NULL']
+        else:
+            query = 'SELECT runs.duration FROM runs'
+            conditions[:0] = ["runs.state = 'FINISHED'",
+                              'runs.duration IS NOT NULL']
+            column = 'runs.duration'
+        query += ' WHERE {} ORDER BY {}'.format(' AND '.join(conditions),
+                                                column)
+        return [row[0] for row in self._connection.execute(query,
+                                                           parameters)]
+
+    def duration_percentiles(self, percentiles=DEFAULT_PERCENTILES,
+                             **filters):
+        """Returns percentiles of the durations of finished runs.
+
+        Args:
+            percentiles (tuple, optional): Percentiles, between 0 and 1.
+            **filters: Filters of durations.
+
+        Returns:
+            dict: Durations in seconds keyed by percentile, empty if no
+                run matches.
+        """
+        durations = self.durations(**filters)
+        if not durations:
+            return {}
+        return dict((fraction, percentile(durations, fraction))
+                    for fraction in percentiles)
+
+    def estimate(self, name, device_group=None, framework_id=None):
+        """Estimates the duration of a test run from past runs of the same
+        suite.
+
+        Past runs are matched on the pattern of the name, device group and
+        framework of the run. Should too few runs match, the framework, then
+        the device group are not matched.
+
+        Args:
+            name (str): Name of the test run.
+            device_group (int or str, optional): Id or name of the device
+                group of the run.
+            framework_id (int, optional): Id of the framework of the run.
+
+        Returns:
+            :obj:`DurationEstimate`: The estimate, or None if fewer than
+                MIN_SAMPLES runs match.
+        """
+        pattern = name_pattern(name)
+        if not pattern.strip('*'):
+            # generated names tell nothing of the suite.
+            return None
+        for filters in ({'device_group': device_group,
+                         'framework_id': framework_id},
+                        {'device_group': device_group},
+                        {}):
+            durations = self.durations(name=pattern, turnaround=True,
+                                       **filters)
+            if len(durations) >= MIN_SAMPLES:
+                return DurationEstimate(durations)
+        return None
+
+    def failure_rates(self, name=None, device_group=None, project_id=None,
+                      framework_id=None, since=None):
+        """Returns the share of failed sessions of every device.
+
+        Args:
+            name (str, optional): Shell-style pattern matched against the
+                name of the run.
+            device_group (int or str, optional): Id or name of the device
+                group of the run.
+            project_id (int, optional): Id of the project of the run.
+            framework_id (int, optional): Id of the framework of the run.
+            since (float, optional): Earliest creation time of the run, in
+                seconds since epoch.
+
+        Returns:
+            dict: Count of finished sessions, of failed sessions and
+                failure rate, keyed by device name.
+        """
+        conditions, parameters = self._where(name, device_group, project_id,
+                                             framework_id, since)
+        conditions[:0] = ['device_runs.state IN ({})'.format(
+            ', '.join('?' * len(COUNTED_STATES)))]
+        query = ('SELECT device_runs.device_name, COUNT(*), '
+                 'SUM(device_runs.state IN ({})) FROM device_runs '
+                 'JOIN runs ON runs.id = device_runs.run_id WHERE {} '
+                 'GROUP BY device_runs.device_name').format(
+                     ', '.join('?' * len(FAILED_STATES)),
+                     ' AND '.join(conditions))
+        rows = self._connection.execute(
+            query, list(FAILED_STATES) + list(COUNTED_STATES) + parameters)
+        return dict((device, {'sessions': sessions, 'failed': failed,
+                              'rate': failed / float(sessions)})
+                    for (device, sessions, failed) in rows)
+
+
+def estimate(name, path=None, **filters):
+    """Estimates the duration of a test run from the history database, if
+    one is configured.
+
+    Args:
+        name (str): Name of the test run.
+        path (str, optional): Path of the database. Defaults to
+            history_path().
+        **filters: Device group and framework of the run, as accepted by
+            RunHistory.estimate.
+
+    Returns:
+        :obj:`DurationEstimate`: The estimate, or None.
+    """
+    path = path or history_path()
+    if not path or not name:
+        return None
+    with RunHistory(path) as history:
+        return history.estimate(name, **filters)
+
+
+def record(run, device_runs=None, path=None, **details):
+    """Records a test run in the history database, if one is configured.
+
+    Args:
+        run (dict): Test run, as returned by Bitbar.
+        device_runs (list, optional): Device sessions of the run.
+        path (str, optional): Path of the database. Defaults to
+            history_path().
+        **details: Project and device group details, as accepted by
+            RunHistory.record_run.
+
+    Returns:
+        bool: True if the run was recorded.
+    """
+    path = path or history_path()
+    if not path:
+        return False
+    with RunHistory(path) as history:
+        history.record_run(run, device_runs, **details)
+    return True
@@ -4,7 +4,15 @@
 
 from __future__ import print_function, absolute_import
 
+import atexit
+import json
 import logging
+import threading
+
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
 
 _default_fmt = ' - '.join([
     '%(asctime)s',
@@ -13,19 +21,192 @@ _default_fmt = ' - '.join([
     '%(message)s'
 ])
 
+# records held by the queue of the asynchronous backend.
+DEFAULT_QUEUE_SIZE = 10000
+
+# listeners of the asynchronous backend, keyed by logger name.
+_listeners = {}
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    # Python 2 has neither; these mirror the Python 3 implementations.
+    class QueueHandler(logging.Handler):
+        """Sends log records to a queue, to be handled by a QueueListener."""
+        def __init__(self, queue):
+            logging.Handler.__init__(self)
+            self.queue = queue
+
+        def enqueue(self, record):
+            self.queue.put_nowait(record)
+
+        def prepare(self, record):
+            return record
+
+        def emit(self, record):
+            try:
+                self.enqueue(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+    class QueueListener(object):
+        """Handles log records from a queue on a dedicated thread."""
+        _sentinel = None
+
+        def __init__(self, queue, *handlers, **kwargs):
+            self.queue = queue
+            self.handlers = handlers
+            self.respect_handler_level = kwargs.get('respect_handler_level',
+                                                    False)
+            self._thread = None
+
+        def dequeue(self, block):
+            return self.queue.get(block)
+
+        def start(self):
+            self._thread = threading.Thread(target=self._monitor)
+            self._thread.daemon = True
+            self._thread.start()
+
+        def prepare(self, record):
+            return record
+
+        def handle(self, record):
+            record = self.prepare(record)
+            for handler in self.handlers:
+                if (not self.respect_handler_level or
+                        record.levelno >= handler.level):
+                    handler.handle(record)
+
+        def _monitor(self):
+            while True:
+                record = self.dequeue(True)
+                if record is self._sentinel:
+                    break
+                self.handle(record)
+
+        def enqueue_sentinel(self):
+            self.queue.put_nowait(self._sentinel)
+
+        def stop(self):
+            self.enqueue_sentinel()
+            self._thread.join()
+            self._thread = None
+
+
+class BoundedQueueHandler(QueueHandler):
+    """BoundedQueueHandler hands log records over to a bounded queue.
+
+    Only the message of the record is merged on the calling thread, so that
+    arguments mutated afterwards are logged as they were; formatting and I/O
+    are left to the listener thread.
+
+    When the queue is full, the record is either dropped and counted, or the
+    calling thread blocks until the listener catches up.
+    """
+    def __init__(self, queue, policy='block'):
+        if policy not in ('block', 'drop'):
+            raise ValueError('Invalid queue policy: {}'.format(policy))
+        QueueHandler.__init__(self, queue)
+        self.policy = policy
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.policy == 'block':
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class _Listener(QueueListener):
+    # handler feeding the queue, whose dropped records are reported, and
+    # name of its logger.
+    queue_handler = None
+    logger_name = 'mozbitbar'
+
+    def enqueue_sentinel(self):
+        # the queue may be full; wait for room rather than fail to stop.
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        QueueListener.stop(self)
+        dropped = self.queue_handler.dropped if self.queue_handler else 0
+        if dropped:
+            # written once the queue is drained, as the last record.
+            self.handle(logging.LogRecord(
+                self.logger_name, logging.WARNING, __file__, 0,
+                '%d log records were dropped: the log queue was full.',
+                (dropped,), None, 'stop_listeners'))
+
+
+class JSONFormatter(logging.Formatter):
+    """JSONFormatter renders a log record as a single line of JSON, for
+    machine ingestion.
+    """
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'function': record.funcName,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, sort_keys=True)
+
+
+def stop_listeners(name=None):
+    """Stops listeners of the asynchronous backend, once every queued record
+    has been handled. Records dropped because the queue was full are
+    counted in a final warning.
+
+    Args:
+        name (str, optional): Name of the logger whose listener is stopped.
+            If not specified, all listeners are stopped.
+    """
+    names = [name] if name else list(_listeners)
+    for listener_name in names:
+        listener = _listeners.pop(listener_name, None)
+        if listener is not None:
+            listener.stop()
+
+
+atexit.register(stop_listeners)
+
 
 def setup_logger(**config):
     """Sets up the logging facilities.
 
+    Records are written to stderr, either synchronously on the logging
+    thread, or with log_async from a dedicated listener thread fed through a
+    bounded queue.
+
     Args:
         config (:obj:`dict`, optional): Optional dictionary specifying custom
             values to be used for the initialization of logging facility.
+            Recognized keys are name, fmt, verbose, quiet, log_json,
+            log_async, log_queue_size and log_queue_policy ('block' or
+            'drop').
 
     Returns:
         :obj:`logging`: Instance of logging object.
     """
-    fmt = (config.get('fmt') or _default_fmt)
-    formatter = logging.Formatter(fmt=fmt)
+    if config.get('log_json'):
+        formatter = JSONFormatter()
+    else:
+        fmt = (config.get('fmt') or _default_fmt)
+        formatter = logging.Formatter(fmt=fmt)
 
     handler = logging.StreamHandler()
     handler.setFormatter(formatter)
@@ -43,6 +224,17 @@ def setup_logger(**config):
     if logger.handlers:
         for old_handler in logger.handlers:
             logger.removeHandler(old_handler)
+    stop_listeners(logger.name)
+
+    if config.get('log_async'):
+        queue = Queue(config.get('log_queue_size') or DEFAULT_QUEUE_SIZE)
+        listener = _Listener(queue, handler)
+        listener.start()
+        _listeners[logger.name] = listener
+        handler = BoundedQueueHandler(
+            queue, config.get('log_queue_policy') or 'block')
+        listener.queue_handler = handler
+        listener.logger_name = logger.name
 
     if not logger.handlers:
         logger.addHandler(handler)
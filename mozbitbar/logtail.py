@@ -0,0 +1,178 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import logging
+import os
+import re
+import sys
+import time
+
+import requests
+from testdroid import RequestResponseError
+
+from mozbitbar import MozbitbarBaseException
+from mozbitbar.client import http_get
+
+logger = logging.getLogger('mozbitbar')
+
+# states of a device session whose log no longer grows.
+TERMINAL_STATES = ('ABORTED', 'EXCLUDED', 'FAILED', 'SUCCEEDED', 'TIMEOUT',
+                   'WARNING')
+
+# seconds without log output after which a running device is reported.
+DEFAULT_STALL_TIMEOUT = 300
+
+
+class _Session(object):
+    def __init__(self, session_id, name):
+        self.id = session_id
+        self.name = name
+        # bytes of the log fetched so far.
+        self.offset = 0
+        # end of the log not terminated by a newline yet.
+        self.pending = b''
+        self.last_output = time.time()
+        self.stalled = False
+        self.done = False
+        self.file = None
+
+
+class DeviceLogTail(object):
+    """DeviceLogTail follows the logs of the device sessions of a test run
+    while it executes.
+
+    Every poll requests only the bytes appended to each log since the
+    previous poll, with a byte range starting at the offset already fetched.
+    New output is either appended to one file per device session, or written
+    to a stream line by line, prefixed with the name of the device.
+    """
+    def __init__(self, client, project_id, test_run_id, output_dir=None,
+                 stream=None, stall_timeout=DEFAULT_STALL_TIMEOUT):
+        """Initializes the DeviceLogTail.
+
+        Args:
+            client (:obj:`Testdroid`): Authenticated client.
+            project_id (int): Id of the project of the test run.
+            test_run_id (int): Id of the test run.
+            output_dir (str, optional): Directory of the log files. If not
+                specified, logs are written to stream.
+            stream (file, optional): Destination of the logs when no
+                output_dir is specified. Defaults to stdout.
+            stall_timeout (float, optional): Seconds without output after
+                which a device still running is reported as possibly hung.
+        """
+        self.client = client
+        self.project_id = project_id
+        self.test_run_id = test_run_id
+        self.output_dir = output_dir
+        self.stream = stream or sys.stdout
+        self.stall_timeout = stall_timeout
+        self._sessions = {}
+        if output_dir and not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+    def poll(self):
+        """Fetches and writes new log output of every device session.
+
+        Returns:
+            int: Number of new bytes fetched.
+        """
+        device_runs = self.client.get_device_runs(self.project_id,
+                                                  self.test_run_id)['data']
+        fetched = 0
+        for device_run in device_runs:
+            session = self._sessions.get(device_run['id'])
+            if session is None:
+                session = _Session(device_run['id'],
+                                   device_run['device']['displayName'])
+                self._sessions[session.id] = session
+            if session.done:
+                continue
+
+            chunk = self._fetch(session)
+            fetched += len(chunk)
+            if chunk:
+                self._write(session, chunk)
+                session.last_output = time.time()
+                session.stalled = False
+            elif device_run['state'] in TERMINAL_STATES:
+                # the log was fetched up to its end after the session ended.
+                self._finish(session)
+            elif (not session.stalled and
+                  time.time() - session.last_output > self.stall_timeout):
+                session.stalled = True
+                logger.warning('No log output from %s for %ds, the device '
+                               'may be hung', session.name,
+                               self.stall_timeout)
+        return fetched
+
+    def close(self):
+        """Writes output left without a trailing newline, and closes the log
+        files.
+        """
+        for session in self._sessions.values():
+            self._finish(session)
+
+    def _fetch(self, session):
+        """Returns the bytes of a log following those already fetched."""
+        path = 'me/projects/{}/runs/{}/device-sessions/{}/logs'.format(
+            self.project_id, self.test_run_id, session.id)
+        headers = {'Accept': 'text/plain',
+                   'Range': 'bytes={}-'.format(session.offset)}
+        try:
+            # 416 when there is no new output, 404 before the log exists.
+            response = http_get(self.client, 'get_device_session_log', path,
+                                headers=headers,
+                                statuses=(200, 206, 404, 416))
+        except (requests.exceptions.RequestException, RequestResponseError,
+                MozbitbarBaseException) as e:
+            # fetched again on the next poll.
+            logger.debug('Failed to fetch the log of %s: %s', session.name, e)
+            return b''
+
+        if response.status_code == 206:
+            chunk = response.content
+        elif response.status_code == 200:
+            # byte ranges are not supported; the whole log was sent.
+            chunk = response.content[session.offset:]
+        else:
+            return b''
+        session.offset += len(chunk)
+        return chunk
+
+    def _write(self, session, chunk):
+        if self.output_dir:
+            if session.file is None:
+                name = re.sub(r'[^\w.-]+', '_', session.name)
+                path = os.path.join(self.output_dir,
+                                    '{}-{}.log'.format(session.id, name))
+                session.file = open(path, 'ab')
+            session.file.write(chunk)
+            session.file.flush()
+            return
+
+        lines = (session.pending + chunk).split(b'\n')
+        session.pending = lines.pop()
+        for line in lines:
+            self._write_line(session, line)
+
+    def _write_line(self, session, line):
+        text = u'[{}] {}\n'.format(session.name,
+                                   line.decode('utf-8', 'replace'))
+        if not isinstance(text, str):
+            # Python 2 streams expect bytes.
+            text = text.encode('utf-8')
+        self.stream.write(text)
+        self.stream.flush()
+
+    def _finish(self, session):
+        if session.pending:
+            self._write_line(session, session.pending)
+            session.pending = b''
+        if session.file is not None:
+            session.file.close()
+            session.file = None
+        session.done = True
@@ -4,14 +4,11 @@
 
 from __future__ import absolute_import, print_function
 
-try:
-    from mozbitbar.run import run_recipe
-    from mozbitbar.log import setup_logger
-    from mozbitbar.cli import cli
-except ImportError:
-    from run import run_recipe
-    from log import setup_logger
-    from cli import cli
+import sys
+
+# only argument parsing is imported upfront; modules pulling in yaml,
+# testdroid and requests are imported by the command which needs them.
+from mozbitbar.cli import cli
 
 
 def main():
@@ -19,8 +16,195 @@ def main():
     # in a taskcluster/treeherder environment, the script will
     # call these methods instead of instead of main().
     args = cli()
+
+    from mozbitbar.log import setup_logger
     setup_logger(**vars(args))
-    run_recipe(args.recipe, args)
+    if args.command == 'serve':
+        serve(args)
+    elif args.command == 'submit':
+        from mozbitbar import daemon
+        sys.exit(daemon.submit(args.recipe, args.credentials, args.socket))
+    elif args.command == 'inventory':
+        inventory(args)
+    elif args.command == 'cleanup':
+        sys.exit(cleanup(args))
+    elif args.command == 'sync':
+        sys.exit(sync(args))
+    elif args.command == 'queue':
+        sys.exit(queue(args))
+    elif args.command == 'pool':
+        sys.exit(replenish_pool(args))
+    elif args.command == 'list':
+        list_resources(args)
+    elif args.command == 'status':
+        status(args)
+    else:
+        run(args)
+
+
+def run(args):
+    from mozbitbar import cassette, metrics, trace
+    from mozbitbar.run import run_recipe
+
+    tracer = trace.enable() if args.trace else None
+    if args.metrics:
+        metrics.enable()
+    if args.record:
+        cassette.record()
+    elif args.replay:
+        cassette.replay(args.replay, args.replay_scale)
+
+    try:
+        run_recipe(args.recipe, args)
+    finally:
+        # recipe failures exit through SystemExit; keep the output regardless.
+        if tracer:
+            tracer.write(args.trace)
+        if args.metrics:
+            metrics.REGISTRY.write(args.metrics)
+        if args.record:
+            cassette.stop().save(args.record)
+        elif args.replay:
+            _report_replay(cassette.stop())
+
+
+def _report_replay(replayed):
+    # differing counts mean mozbitbar made more or fewer requests than when
+    # the cassette was recorded.
+    print('Replayed {} requests, {} beyond the cassette, {} not '
+          'replayed'.format(replayed.played, replayed.extra,
+                            replayed.remaining))
+
+
+def serve(args):
+    from mozbitbar import daemon, metrics
+
+    if args.metrics:
+        metrics.enable()
+    daemon.serve(args.socket, args.metrics)
+
+
+def _credentials(args):
+    if not args.credentials:
+        return {}
+    from mozbitbar.run import load_credentials
+    return load_credentials(args.credentials)
+
+
+def _bitbar(args):
+    from mozbitbar.bitbar import Bitbar
+    return Bitbar(**_credentials(args))
+
+
+def inventory(args):
+    bitbar = _bitbar(args)
+    counts = bitbar.snapshot_inventory(args.output, args.format,
+                                       workers=args.workers)
+    for kind, count in sorted(counts.items()):
+        print('{}: {}'.format(kind, count))
+
+
+def cleanup(args):
+    from mozbitbar.bitbar import CLEANUP_KINDS
+
+    bitbar = _bitbar(args)
+    kinds = tuple(args.kind) if args.kind else CLEANUP_KINDS
+    try:
+        plan = bitbar.cleanup(older_than=args.older_than, name=args.name,
+                              unused=args.unused, kinds=kinds,
+                              dry_run=not args.execute, workers=args.workers)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    for entry in plan:
+        print('\t'.join(['{}'.format(entry[key]) for key in
+                         ('kind', 'id', 'name', 'deleted') if key in entry]))
+    # non-zero if any deletion failed.
+    return int(any(entry.get('deleted') is False for entry in plan))
+
+
+def sync(args):
+    from mozbitbar.history import RunHistory, history_path
+
+    path = args.db or history_path()
+    if not path:
+        print('No history database: pass --db or set MOZBITBAR_HISTORY.',
+              file=sys.stderr)
+        return 2
+    with RunHistory(path) as history:
+        counts = _bitbar(args).sync_history(history, args.project,
+                                            full=args.full,
+                                            workers=args.workers)
+    for key, count in sorted(counts.items()):
+        print('{}: {}'.format(key, count))
+    return 0
+
+
+def queue(args):
+    import time
+
+    from mozbitbar import query
+    from mozbitbar.runqueue import RunQueue, queue_path
+
+    path = args.db or queue_path()
+    if not path:
+        print('No run queue: pass --db or set MOZBITBAR_RUN_QUEUE.',
+              file=sys.stderr)
+        return 2
+    since = time.time() - args.since * 3600 if args.since else None
+    with RunQueue(path) as run_queue:
+        stats = run_queue.stats(since)
+    results = [dict(entry, priority=priority)
+               for (priority, entry) in sorted(stats.items(), reverse=True)]
+    query.write_results(results, args.format,
+                        ('priority', 'waiting', 'running', 'dispatched',
+                         'wait_p50', 'wait_p95', 'wait_max'))
+    return 0
+
+
+def replenish_pool(args):
+    from mozbitbar import pool
+
+    path = args.db or pool.pool_path()
+    if not path:
+        print('No project pool: pass --db or set MOZBITBAR_PROJECT_POOL.',
+              file=sys.stderr)
+        return 2
+    if not args.once:
+        replenisher = pool.Replenisher(path, _credentials(args),
+                                       args.interval)
+        replenisher.start()
+        try:
+            # joining without a timeout would not let KeyboardInterrupt in.
+            while replenisher.is_alive():
+                replenisher.join(1)
+        except KeyboardInterrupt:
+            replenisher.stop()
+        return 0
+    with pool.ProjectPool(path) as project_pool:
+        counts = pool.replenish(project_pool, _credentials(args))
+    for template, states in sorted(counts.items()):
+        print('{}: {}'.format(template, ', '.join(
+            '{} {}'.format(count, state)
+            for (state, count) in sorted(states.items()))))
+    return 0
+
+
+def list_resources(args):
+    from mozbitbar import query
+
+    results = query.list_resources(args.kind, args.project,
+                                   _credentials(args), args.max_age,
+                                   args.refresh)
+    query.write_results(results, args.format, query.KINDS[args.kind][1])
+
+
+def status(args):
+    from mozbitbar import query
+
+    result = query.run_status(args.run, args.project, _credentials(args),
+                              args.max_age, args.refresh)
+    query.write_results([result], args.format, query.STATUS_FIELDS)
 
 
 if __name__ == '__main__':
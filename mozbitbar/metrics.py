@@ -0,0 +1,266 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import os
+import threading
+import time
+
+from mozbitbar import client
+from mozbitbar.client import ClientWrapper
+
+# order of the metrics wrapper; below retries and coalescing, so that every
+# request actually sent to Bitbar is counted and timed.
+WRAPPER_ORDER = 20
+
+# latency buckets in seconds, spanning quick catalog reads to slow uploads.
+DEFAULT_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+                   60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, _escape(value))
+                          for key, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """Counter is a monotonically increasing value per set of labels."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        """Increments the counter.
+
+        Args:
+            amount (int, optional): Value to add to the counter.
+            **labels: Label values identifying the series.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Returns the current value of a series.
+
+        Args:
+            **labels: Label values identifying the series.
+
+        Returns:
+            int: Current value, 0 if the series was never incremented.
+        """
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, key, value
+
+
+class Histogram(object):
+    """Histogram counts observations into cumulative buckets per set of
+    labels, from which latency percentiles can be estimated.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.labelnames)
+
+    def observe(self, value, **labels):
+        """Records an observation.
+
+        Args:
+            value (float): Observed value, eg. a duration in seconds.
+            **labels: Label values identifying the series.
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        """Returns the number of observations of a series.
+
+        Args:
+            **labels: Label values identifying the series.
+
+        Returns:
+            int: Number of observations.
+        """
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return counts[-1]
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total))
+                           for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                yield (self.name + '_bucket',
+                       key + (('le', _format_value(bound)),), count)
+            yield self.name + '_sum', key, total
+            yield self.name + '_count', key, counts[-1]
+
+
+class Registry(object):
+    """Registry holds metrics and renders them in the Prometheus text
+    exposition format.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError('Metric {} already registered as {}'.format(
+                    name, metric.kind))
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """Returns the counter of the given name, creating it if needed.
+
+        Args:
+            name (str): Metric name.
+            documentation (str): Help text of the metric.
+            labelnames (:obj:`tuple` of str, optional): Label names.
+
+        Returns:
+            :obj:`Counter`: The registered counter.
+        """
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        """Returns the histogram of the given name, creating it if needed.
+
+        Args:
+            name (str): Metric name.
+            documentation (str): Help text of the metric.
+            labelnames (:obj:`tuple` of str, optional): Label names.
+            buckets (:obj:`tuple` of float, optional): Upper bounds of the
+                buckets.
+
+        Returns:
+            :obj:`Histogram`: The registered histogram.
+        """
+        return self._get_or_create(Histogram, name, documentation,
+                                   labelnames, buckets)
+
+    def render(self):
+        """Renders all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: Metrics, one sample per line.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(),
+                             key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name,
+                                               metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, _format_labels(labels),
+                                              _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Writes the metrics to a file, replacing it atomically so that
+        collectors never read a partial file.
+
+        Args:
+            path (str): Destination path, eg. for the node_exporter textfile
+                collector.
+        """
+        temporary = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                          threading.current_thread().ident)
+        with open(temporary, 'w') as f:
+            f.write(self.render())
+        os.rename(temporary, path)
+
+
+REGISTRY = Registry()
+
+api_requests = REGISTRY.counter(
+    'mozbitbar_api_requests_total',
+    'Testdroid client calls sent to Bitbar.', ('endpoint',))
+api_errors = REGISTRY.counter(
+    'mozbitbar_api_errors_total',
+    'Testdroid client calls that failed, by HTTP status code.',
+    ('endpoint', 'status'))
+api_retries = REGISTRY.counter(
+    'mozbitbar_api_retries_total',
+    'Testdroid client calls that were retried.', ('endpoint',))
+api_duration = REGISTRY.histogram(
+    'mozbitbar_api_request_duration_seconds',
+    'Latency of Testdroid client calls.', ('endpoint',))
+
+
+class MetricsClient(ClientWrapper):
+    """MetricsClient counts and times every call made to the client."""
+    def call(self, name, func, args, kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            api_errors.inc(endpoint=name,
+                           status=getattr(e, 'status_code', None) or 'none')
+            raise
+        finally:
+            api_requests.inc(endpoint=name)
+            api_duration.observe(time.time() - start, endpoint=name)
+
+
+def enable():
+    """Enables metrics collection for clients created from now on."""
+    client.add_wrapper(MetricsClient, WRAPPER_ORDER)
+
+
+def disable():
+    """Disables metrics collection for clients created from now on."""
+    client.remove_wrapper(MetricsClient)
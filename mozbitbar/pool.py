@@ -0,0 +1,506 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Keeps a pool of pre-created, pre-configured projects.
+
+Creating and configuring a project for every job costs a listing of all
+projects and several writes. Recipes declaring `project: pool` instead lease
+a project already brought to the state of their template, when the
+MOZBITBAR_PROJECT_POOL environment variable holds the path of the pool
+database:
+
+    - project: pool
+      arguments:
+        template: android-mochitest
+        project_type: DEFAULT
+        framework: Android Instrumentation
+        parameters:
+          - key: suite
+            value: mochitest
+
+Leasing is a local transaction on the database. Projects are reset to their
+template when returned, at the end of the recipe, and a replenisher keeps
+enough of them ready for every template:
+
+    $ mozbitbar pool
+"""
+
+from __future__ import absolute_import, print_function
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+from testdroid import RequestResponseError
+
+from mozbitbar import MozbitbarBaseException, MozbitbarProjectException
+from mozbitbar.runqueue import is_alive
+
+logger = logging.getLogger('mozbitbar')
+
+# projects kept ready for every template, unless the recipe says otherwise.
+DEFAULT_POOL_SIZE = 2
+
+# seconds between passes of the replenisher.
+DEFAULT_REPLENISH_INTERVAL = 60
+
+# seconds a template is skipped after failing to be applied, doubled for
+# every further failure up to MAX_BACKOFF.
+BACKOFF = 60
+MAX_BACKOFF = 3600
+
+READY = 'ready'
+LEASED = 'leased'
+# returned without being reset, or leased by a process which exited.
+DIRTY = 'dirty'
+
+_schema = (
+    'CREATE TABLE IF NOT EXISTS templates ('
+    'name TEXT PRIMARY KEY, definition TEXT NOT NULL, '
+    'size INTEGER NOT NULL, failures INTEGER NOT NULL DEFAULT 0, '
+    'retry_at REAL)',
+    'CREATE TABLE IF NOT EXISTS projects ('
+    'id INTEGER PRIMARY KEY, template TEXT NOT NULL, project TEXT NOT NULL, '
+    'state TEXT NOT NULL, pid INTEGER, changed REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS projects_template '
+    'ON projects (template, state, changed)',
+)
+
+
+def pool_path():
+    """Returns the path of the project pool database, set with the
+    MOZBITBAR_PROJECT_POOL environment variable.
+
+    Returns:
+        str: Path of the database, or None if projects are not pooled.
+    """
+    return os.getenv('MOZBITBAR_PROJECT_POOL') or None
+
+
+def project_name(template):
+    """Returns a unique name for a project of the pool."""
+    return '{}-{}'.format(template, uuid4().hex[:8])
+
+
+def describe(bitbar_project):
+    """Returns the details of a project kept in the pool, from which a
+    leased project is used without reading it from Bitbar.
+
+    Args:
+        bitbar_project (:obj:`BitbarProject`): A configured project.
+
+    Returns:
+        dict: Id, name, type and framework of the project, and its device
+            group.
+    """
+    return {'id': bitbar_project.project_id,
+            'name': bitbar_project.project_name,
+            'type': bitbar_project.project_type,
+            'frameworkId': bitbar_project.framework_id,
+            'deviceGroupId': bitbar_project.device_group_id,
+            'deviceGroupName': bitbar_project.device_group_name}
+
+
+class ProjectPool(object):
+    """ProjectPool tracks the projects of every template, and hands them out
+    to a single process at a time.
+    """
+    def __init__(self, path):
+        """Opens the database, creating it if needed.
+
+        Args:
+            path (str): Path of the SQLite database.
+        """
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # transactions are begun explicitly, taking the write lock upfront.
+        self._connection = sqlite3.connect(path, timeout=60,
+                                           isolation_level=None)
+        with self._transaction():
+            for statement in _schema:
+                self._connection.execute(statement)
+            columns = [row[1] for row in self._connection.execute(
+                'PRAGMA table_info(templates)')]
+            # databases created before failing templates were backed off.
+            if 'failures' not in columns:
+                self._connection.execute(
+                    'ALTER TABLE templates ADD COLUMN failures INTEGER '
+                    'NOT NULL DEFAULT 0')
+                self._connection.execute(
+                    'ALTER TABLE templates ADD COLUMN retry_at REAL')
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def _transaction(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self._connection
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    def _reap(self, connection):
+        """Marks the projects leased by processes which exited as dirty."""
+        rows = connection.execute(
+            'SELECT id, pid FROM projects WHERE state = ?', (LEASED,))
+        for project_id, pid in rows.fetchall():
+            if not is_alive(pid):
+                logger.warning('Project %d was not returned by exited '
+                               'process %d.', project_id, pid)
+                connection.execute(
+                    'UPDATE projects SET state = ?, pid = NULL, changed = ? '
+                    'WHERE id = ?', (DIRTY, time.time(), project_id))
+
+    def register(self, template, definition, size=DEFAULT_POOL_SIZE):
+        """Records or updates a template.
+
+        Args:
+            template (str): Name of the template.
+            definition (dict): Project type, and desired state of the
+                projects, as accepted by BitbarProject.reset_project.
+            size (int, optional): Projects kept ready.
+        """
+        definition = json.dumps(definition, sort_keys=True)
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT definition FROM templates WHERE name = ?',
+                (template,)).fetchone()
+            if row and row[0] == definition:
+                connection.execute(
+                    'UPDATE templates SET size = ? WHERE name = ?',
+                    (size, template))
+                return
+            # a new definition may apply where the previous one failed.
+            connection.execute(
+                'INSERT OR REPLACE INTO templates (name, definition, size) '
+                'VALUES (?, ?, ?)', (template, definition, size))
+
+    def templates(self):
+        """Returns the registered templates.
+
+        Returns:
+            list: Name, definition and size of every template.
+        """
+        rows = self._connection.execute(
+            'SELECT name, definition, size FROM templates ORDER BY name')
+        return [(name, json.loads(definition), size)
+                for (name, definition, size) in rows]
+
+    def due(self, template):
+        """Returns whether a template is not being backed off from."""
+        row = self._connection.execute(
+            'SELECT retry_at FROM templates WHERE name = ?',
+            (template,)).fetchone()
+        return not row or row[0] is None or row[0] <= time.time()
+
+    def record_failure(self, template):
+        """Backs off from a template which failed to be applied.
+
+        Returns:
+            float: Seconds until the template is tried again.
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE templates SET failures = failures + 1 WHERE name = ?',
+                (template,))
+            failures = connection.execute(
+                'SELECT failures FROM templates WHERE name = ?',
+                (template,)).fetchone()[0]
+            delay = min(BACKOFF * 2 ** (failures - 1), MAX_BACKOFF)
+            connection.execute(
+                'UPDATE templates SET retry_at = ? WHERE name = ?',
+                (time.time() + delay, template))
+        return delay
+
+    def record_success(self, template):
+        """Stops backing off from a template."""
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE templates SET failures = 0, retry_at = NULL '
+                'WHERE name = ?', (template,))
+
+    def _take(self, template, state, limit=None):
+        with self._transaction() as connection:
+            self._reap(connection)
+            rows = connection.execute(
+                'SELECT id, project FROM projects WHERE template = ? AND '
+                'state = ? ORDER BY changed LIMIT ?',
+                (template, state, -1 if limit is None else limit)).fetchall()
+            for project_id, _ in rows:
+                connection.execute(
+                    'UPDATE projects SET state = ?, pid = ?, changed = ? '
+                    'WHERE id = ?',
+                    (LEASED, os.getpid(), time.time(), project_id))
+        return [json.loads(project) for (_, project) in rows]
+
+    def lease(self, template):
+        """Leases a ready project of a template.
+
+        Args:
+            template (str): Name of the template.
+
+        Returns:
+            dict: The project, as described by describe, or None if none is
+                ready.
+        """
+        projects = self._take(template, READY, 1)
+        return projects[0] if projects else None
+
+    def take_dirty(self, template):
+        """Leases the dirty projects of a template, to reset them.
+
+        Args:
+            template (str): Name of the template.
+
+        Returns:
+            list: The projects, as described by describe.
+        """
+        return self._take(template, DIRTY)
+
+    def add(self, template, project, state=LEASED):
+        """Adds a project to the pool.
+
+        Args:
+            template (str): Name of the template of the project.
+            project (dict): The project, as described by describe.
+            state (str, optional): READY, DIRTY, or LEASED by this
+                process.
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO projects (id, template, project, '
+                'state, pid, changed) VALUES (?, ?, ?, ?, ?, ?)',
+                (project['id'], template, json.dumps(project, sort_keys=True),
+                 state, os.getpid() if state == LEASED else None,
+                 time.time()))
+
+    def give_back(self, project_id, project=None, clean=True):
+        """Returns a leased project to the pool.
+
+        Args:
+            project_id (int): Id of the project.
+            project (dict, optional): Updated details of the project.
+            clean (bool, optional): Whether the project was reset to its
+                template, and can be leased again; it is reset by the
+                replenisher otherwise.
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE projects SET state = ?, pid = NULL, changed = ? '
+                'WHERE id = ?',
+                (READY if clean else DIRTY, time.time(), project_id))
+            if project:
+                connection.execute(
+                    'UPDATE projects SET project = ? WHERE id = ?',
+                    (json.dumps(project, sort_keys=True), project_id))
+
+    def remove(self, project_id):
+        """Forgets a project, eg. one which could not be reset."""
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM projects WHERE id = ?',
+                               (project_id,))
+
+    def project_ids(self):
+        """Returns the ids of the projects of every template, whatever
+        their state.
+        """
+        return set(row[0] for row in self._connection.execute(
+            'SELECT id FROM projects'))
+
+    def counts(self, template):
+        """Returns the number of projects of a template, keyed by state."""
+        with self._transaction() as connection:
+            self._reap(connection)
+        counts = dict((state, 0) for state in (READY, LEASED, DIRTY))
+        counts.update(self._connection.execute(
+            'SELECT state, COUNT(*) FROM projects WHERE template = ? '
+            'GROUP BY state', (template,)).fetchall())
+        return counts
+
+
+def _reason(error):
+    return getattr(error, 'message', None) or error
+
+
+def discard(bitbar_project, project_pool=None):
+    """Deletes a project which could not be brought to the state of its
+    template, and forgets it in the pool.
+
+    Projects which could not be deleted either are kept in the pool as
+    dirty, so that they are not left behind.
+
+    Args:
+        bitbar_project (:obj:`BitbarProject`): The project.
+        project_pool (:obj:`ProjectPool`, optional): Pool tracking the
+            project.
+    """
+    try:
+        bitbar_project.client.delete_project(bitbar_project.project_id)
+    except (MozbitbarBaseException, RequestResponseError) as e:
+        logger.warning('Failed to delete project %s: %s',
+                       bitbar_project.project_name, _reason(e))
+        if project_pool:
+            project_pool.give_back(bitbar_project.project_id, clean=False)
+        return
+    if project_pool:
+        project_pool.remove(bitbar_project.project_id)
+
+
+def _reset_dirty(project_pool, template, definition, credentials):
+    """Resets the dirty projects of a template.
+
+    Returns:
+        bool: False if a project could not be reset.
+    """
+    from mozbitbar.bitbar_project import BitbarProject
+
+    succeeded = True
+    for project in project_pool.take_dirty(template):
+        try:
+            bitbar_project = BitbarProject(
+                'existing', project_id=project['id'], **credentials)
+        except MozbitbarProjectException as e:
+            logger.warning('Removing project %s from the pool: %s',
+                           project['name'], _reason(e))
+            project_pool.remove(project['id'])
+            continue
+        except RequestResponseError as e:
+            logger.warning('Failed to read project %s: %s',
+                           project['name'], _reason(e))
+            project_pool.give_back(project['id'], clean=False)
+            succeeded = False
+            continue
+        try:
+            bitbar_project.reset_project(definition)
+        except (MozbitbarBaseException, RequestResponseError) as e:
+            logger.warning('Failed to reset project %s: %s',
+                           project['name'], _reason(e))
+            project_pool.give_back(project['id'], describe(bitbar_project),
+                                   clean=False)
+            succeeded = False
+            continue
+        project_pool.give_back(project['id'], describe(bitbar_project))
+    return succeeded
+
+
+def _create(project_pool, template, definition, credentials, count):
+    """Creates projects of a template, until count of them are added.
+
+    Returns:
+        bool: False if a project could not be created or configured.
+    """
+    from mozbitbar.bitbar_project import BitbarProject
+
+    for _ in range(count):
+        try:
+            bitbar_project = BitbarProject(
+                'new', project_name=project_name(template),
+                project_type=definition['project_type'],
+                permit_duplicate=True, **credentials)
+        except (MozbitbarBaseException, RequestResponseError) as e:
+            logger.warning('Failed to create a project of template %s: '
+                           '%s', template, _reason(e))
+            return False
+        # tracked before it is configured, so that it is not left behind
+        # should this process die.
+        project_pool.add(template, describe(bitbar_project), DIRTY)
+        try:
+            bitbar_project.reset_project(definition)
+        except (MozbitbarBaseException, RequestResponseError) as e:
+            logger.warning('Failed to configure a project of template %s: '
+                           '%s', template, _reason(e))
+            discard(bitbar_project, project_pool)
+            return False
+        project_pool.add(template, describe(bitbar_project), READY)
+        logger.info('Added project %s to the pool.',
+                    bitbar_project.project_name)
+    return True
+
+
+def replenish(project_pool, credentials=None):
+    """Resets the dirty projects of every template, and creates projects
+    until enough of them are ready.
+
+    Templates which fail to be applied are skipped for a while, for longer
+    after every failure, rather than creating projects on every pass.
+
+    Args:
+        project_pool (:obj:`ProjectPool`): The pool.
+        credentials (dict, optional): Testdroid credentials, named as the
+            environment variables. Read from the environment if not
+            specified.
+
+    Returns:
+        dict: Number of projects of every template, keyed by state.
+    """
+    credentials = credentials or {}
+    result = {}
+    for template, definition, size in project_pool.templates():
+        if project_pool.due(template):
+            succeeded = (
+                _reset_dirty(project_pool, template, definition,
+                             credentials) and
+                _create(project_pool, template, definition, credentials,
+                        size - project_pool.counts(template)[READY]))
+            if succeeded:
+                project_pool.record_success(template)
+            else:
+                delay = project_pool.record_failure(template)
+                logger.warning('Retrying template %s in %ds.', template,
+                               delay)
+        result[template] = project_pool.counts(template)
+    return result
+
+
+class Replenisher(threading.Thread):
+    """Replenisher keeps the pool replenished from a background thread."""
+    def __init__(self, path=None, credentials=None,
+                 interval=DEFAULT_REPLENISH_INTERVAL):
+        """Initializes the Replenisher.
+
+        Args:
+            path (str, optional): Path of the pool database. Defaults to
+                pool_path().
+            credentials (dict, optional): Testdroid credentials. Read from
+                the environment if not specified.
+            interval (float, optional): Seconds between passes.
+        """
+        threading.Thread.__init__(self, name='mozbitbar-replenisher')
+        self.daemon = True
+        self.path = path or pool_path()
+        self.credentials = credentials
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                with ProjectPool(self.path) as project_pool:
+                    replenish(project_pool, self.credentials)
+            except Exception:
+                # the next pass may succeed; recipes create projects
+                # meanwhile.
+                logger.exception('Failed to replenish the project pool.')
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        """Stops the thread after its current pass."""
+        self._stopped.set()
+        self.join()
@@ -0,0 +1,245 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from mozbitbar import MozbitbarBaseException
+
+
+logger = logging.getLogger('mozbitbar')
+
+# listable collections, keyed by name: the path of the collection, and the
+# fields written as TSV columns.
+KINDS = {
+    'devices': ('devices', ('id', 'displayName', 'osType')),
+    'device-groups': ('me/device-groups',
+                      ('id', 'displayName', 'osType', 'deviceCount')),
+    'frameworks': ('me/available-frameworks', ('id', 'name', 'osType')),
+    'projects': ('me/projects', ('id', 'name', 'type')),
+    'runs': ('me/projects/{project}/runs',
+             ('id', 'displayName', 'state', 'createTime')),
+}
+
+STATUS_FIELDS = ('id', 'displayName', 'state', 'successRatio',
+                 'executionRatio')
+
+# seconds for which cached results are fresh, by kind. Catalogs change
+# rarely, projects and runs more often.
+DEFAULT_MAX_AGE = {
+    'devices': 300,
+    'device-groups': 3600,
+    'frameworks': 3600,
+    'projects': 60,
+    'runs': 30,
+    'status': 10,
+}
+
+
+def cache_dir():
+    """Returns the directory of the query cache, set with the
+    MOZBITBAR_CACHE_DIR environment variable.
+
+    Returns:
+        str: Path of the cache directory.
+    """
+    return (os.getenv('MOZBITBAR_CACHE_DIR') or
+            os.path.join(os.path.expanduser('~'), '.cache', 'mozbitbar'))
+
+
+def _account(credentials):
+    """Returns a digest identifying the account, so that cached results of
+    different accounts or instances are kept apart without storing
+    credentials.
+
+    Args:
+        credentials (dict): Testdroid credentials. If empty, read from the
+            environment.
+
+    Returns:
+        str: Hex digest of the URL and user.
+    """
+    def value(key):
+        return credentials.get(key) or os.getenv(key) or ''
+
+    identity = '\n'.join([value('TESTDROID_URL'),
+                          value('TESTDROID_USERNAME') or
+                          value('TESTDROID_APIKEY')])
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()[:16]
+
+
+class QueryCache(object):
+    """QueryCache keeps query results on disk, one JSON file per query."""
+    def __init__(self, directory, account):
+        self.directory = os.path.join(directory, account)
+
+    def _path(self, name):
+        return os.path.join(self.directory, '{}.json'.format(name))
+
+    def load(self, name, max_age):
+        """Returns cached results, if fresh.
+
+        Args:
+            name (str): Name of the query.
+            max_age (float): Maximum age of the results, in seconds.
+
+        Returns:
+            The results, or None if they are missing or stale.
+        """
+        try:
+            with open(self._path(name), 'r') as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if (entry.get('final') or
+                time.time() - entry['fetched'] <= max_age):
+            return entry['results']
+        return None
+
+    def store(self, name, results, final=False):
+        """Caches results, replacing the file atomically.
+
+        Args:
+            name (str): Name of the query.
+            results: Results of the query.
+            final (bool, optional): If True, the results never go stale.
+        """
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # created concurrently.
+                pass
+        path = self._path(name)
+        temporary = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                          threading.current_thread().ident)
+        with open(temporary, 'w') as f:
+            json.dump({'fetched': time.time(), 'final': final,
+                       'results': results}, f)
+        os.rename(temporary, path)
+
+
+def _bitbar(credentials):
+    # only needed on a cache miss; avoids loading testdroid otherwise.
+    from mozbitbar.bitbar import Bitbar
+    return Bitbar(**credentials)
+
+
+def list_resources(kind, project_id=None, credentials=None, max_age=None,
+                   refresh=False):
+    """Lists a collection of the account, from the cache when fresh.
+
+    Args:
+        kind (str): One of KINDS.
+        project_id (int, optional): Project whose runs are listed; required
+            for 'runs'.
+        credentials (dict, optional): Testdroid credentials. If not
+            specified, read from the environment.
+        max_age (float, optional): Maximum age of cached results, in
+            seconds. Defaults to DEFAULT_MAX_AGE for the kind.
+        refresh (bool, optional): If True, the cache is bypassed.
+
+    Returns:
+        list: Items of the collection.
+
+    Raises:
+        MozbitbarBaseException: If runs are listed without a project id.
+    """
+    credentials = credentials or {}
+    path, _ = KINDS[kind]
+    if '{project}' in path:
+        if project_id is None:
+            msg = 'A project id is required to list {}.'.format(kind)
+            raise MozbitbarBaseException(message=msg)
+        path = path.format(project=project_id)
+
+    cache = QueryCache(cache_dir(), _account(credentials))
+    name = path.replace('/', '-')
+    if max_age is None:
+        max_age = DEFAULT_MAX_AGE[kind]
+    if not refresh:
+        results = cache.load(name, max_age)
+        if results is not None:
+            logger.debug('Serving %s from cache', kind)
+            return results
+
+    results = _bitbar(credentials).fetch_all(path)
+    cache.store(name, results)
+    return results
+
+
+def run_status(run_id, project_id, credentials=None, max_age=None,
+               refresh=False):
+    """Returns the details of a test run, from the cache when fresh.
+
+    Details of a finished run are final, and cached indefinitely.
+
+    Args:
+        run_id (int): Id of the test run.
+        project_id (int): Id of the project of the test run.
+        credentials (dict, optional): Testdroid credentials. If not
+            specified, read from the environment.
+        max_age (float, optional): Maximum age of cached details, in
+            seconds.
+        refresh (bool, optional): If True, the cache is bypassed.
+
+    Returns:
+        dict: Details of the test run.
+    """
+    credentials = credentials or {}
+    cache = QueryCache(cache_dir(), _account(credentials))
+    name = 'status-{}-{}'.format(project_id, run_id)
+    if max_age is None:
+        max_age = DEFAULT_MAX_AGE['status']
+    if not refresh:
+        result = cache.load(name, max_age)
+        if result is not None:
+            return result
+
+    result = _bitbar(credentials).client.get_test_run(project_id, run_id)
+    cache.store(name, result, final=result.get('state') == 'FINISHED')
+    return result
+
+
+def write_results(results, output_format='tsv', fields=None, stream=None):
+    """Writes query results for scripting.
+
+    Args:
+        results (list): Items to write.
+        output_format (str, optional): 'tsv', with a header line and one
+            line per item, 'json', as a single array, or 'ndjson', with one
+            object per line.
+        fields (tuple, optional): Fields written as TSV columns.
+        stream (file, optional): Destination of the output. Defaults to
+            stdout.
+    """
+    stream = stream or sys.stdout
+    if output_format == 'json':
+        stream.write(json.dumps(results, sort_keys=True) + '\n')
+    elif output_format == 'ndjson':
+        for item in results:
+            stream.write(json.dumps(item, sort_keys=True) + '\n')
+    else:
+        stream.write('\t'.join(fields) + '\n')
+        for item in results:
+            line = u'\t'.join(
+                [_tsv_value(item.get(field)) for field in fields]) + u'\n'
+            if not isinstance(line, str):
+                # Python 2 streams expect bytes.
+                line = line.encode('utf-8')
+            stream.write(line)
+
+
+def _tsv_value(value):
+    if value is None:
+        return ''
+    # tabs and newlines would break the columns.
+    return u'{}'.format(value).replace('\t', ' ').replace('\n', ' ')
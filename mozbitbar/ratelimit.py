@@ -0,0 +1,246 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+from mozbitbar import client
+from mozbitbar.client import ClientWrapper
+from mozbitbar.metrics import REGISTRY
+
+
+logger = logging.getLogger('mozbitbar')
+
+# order of the rate limiting wrapper; innermost, so that every request sent
+# to Bitbar, including retries, takes a token.
+WRAPPER_ORDER = 10
+
+# number of times a request rejected with HTTP 429 is queued again.
+MAX_RATE_LIMITED_RETRIES = 10
+
+# wait before retrying a rejected request if Bitbar sent no Retry-After.
+DEFAULT_RETRY_AFTER = 5.0
+
+rate_limited = REGISTRY.counter(
+    'mozbitbar_api_rate_limited_total',
+    'Testdroid client calls rejected by Bitbar with HTTP 429.',
+    ('endpoint',))
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_retry_after = threading.local()
+
+
+class TokenBucket(object):
+    """TokenBucket admits requests at a sustained rate, allowing bursts of
+    up to a number of requests.
+
+    If a state path is provided, the bucket is shared by every process
+    using the same path: its state is kept in that file, and updated under
+    an exclusive lock on the file.
+    """
+    def __init__(self, rate, burst=None, state_path=None):
+        """Initializes the TokenBucket.
+
+        Args:
+            rate (float): Sustained number of requests per second.
+            burst (int, optional): Maximum number of requests admitted at
+                once. Defaults to one second worth of requests.
+            state_path (str, optional): Path of the file holding state
+                shared between processes.
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, self.rate))
+        self.state_path = state_path
+        self._state = {'tokens': self.burst, 'updated': time.time(),
+                       'paused_until': 0}
+        self._lock = threading.Lock()
+
+    def _update(self, func):
+        # applies func to the bucket state under both the thread and the
+        # file lock, and returns its result.
+        with self._lock:
+            if not self.state_path:
+                return func(self._state)
+
+            with open(self.state_path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read())
+                    except ValueError:
+                        state = dict(self._state)
+                    result = func(state)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                    return result
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _take(self, state):
+        now = time.time()
+        if state['paused_until'] > now:
+            return state['paused_until'] - now
+        state['tokens'] = min(
+            self.burst,
+            state['tokens'] + (now - state['updated']) * self.rate)
+        state['updated'] = now
+        if state['tokens'] >= 1:
+            state['tokens'] -= 1
+            return 0
+        return (1 - state['tokens']) / self.rate
+
+    def acquire(self):
+        """Blocks until a request is admitted.
+
+        Returns:
+            float: Number of seconds spent waiting.
+        """
+        waited = 0
+        while True:
+            wait = self._update(self._take)
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """Holds back every request for a number of seconds, eg. after
+        Bitbar asked to retry later.
+
+        Args:
+            seconds (float): Number of seconds to hold requests back.
+        """
+        until = time.time() + seconds
+
+        def _pause(state):
+            state['paused_until'] = max(state['paused_until'], until)
+        self._update(_pause)
+
+
+def parse_retry_after(value):
+    """Parses a Retry-After header value.
+
+    Args:
+        value (str): Either a number of seconds or an HTTP date.
+
+    Returns:
+        float or None: Number of seconds to wait, None if value is invalid.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0.0, mktime_tz(parsed) - time.time())
+
+
+def _record_retry_after(send, request, **kwargs):
+    response = send(request, **kwargs)
+    if response.status_code == 429:
+        _retry_after.seconds = parse_retry_after(
+            response.headers.get('Retry-After'))
+    return response
+
+
+def bucket_for(url):
+    """Returns the token bucket shared by all clients of a host.
+
+    The bucket is configured from environment variables:
+        - MOZBITBAR_RATE_LIMIT: sustained requests per second. If unset,
+            the request rate is not limited.
+        - MOZBITBAR_RATE_BURST: maximum requests admitted at once.
+        - MOZBITBAR_RATE_LIMIT_DIR: directory holding bucket state files
+            shared between processes. If unset, each process keeps its own
+            bucket.
+
+    Args:
+        url (str): Bitbar cloud URL.
+
+    Returns:
+        :obj:`TokenBucket` or None: Bucket of the host, None if the request
+            rate is not limited.
+    """
+    rate = os.getenv('MOZBITBAR_RATE_LIMIT')
+    if not rate:
+        return None
+
+    host = urlparse(url or '').netloc or 'default'
+    with _buckets_lock:
+        if host not in _buckets:
+            directory = os.getenv('MOZBITBAR_RATE_LIMIT_DIR')
+            state_path = None
+            if directory:
+                state_path = os.path.join(
+                    directory, 'mozbitbar-ratelimit-{}.json'.format(
+                        host.replace(':', '_')))
+            _buckets[host] = TokenBucket(
+                float(rate), os.getenv('MOZBITBAR_RATE_BURST'), state_path)
+        return _buckets[host]
+
+
+class RateLimitedClient(ClientWrapper):
+    """RateLimitedClient admits calls through the token bucket of its host,
+    and queues calls rejected with HTTP 429 until Bitbar accepts them.
+    """
+    def __init__(self, client, bucket=None):
+        """Initializes the RateLimitedClient.
+
+        Args:
+            client (:obj:`Testdroid`): Client to be wrapped.
+            bucket (:obj:`TokenBucket`, optional): Bucket admitting calls.
+                If None, only HTTP 429 responses are handled.
+        """
+        super(RateLimitedClient, self).__init__(client)
+        self.bucket = bucket
+
+    def call(self, name, func, args, kwargs):
+        for attempt in range(MAX_RATE_LIMITED_RETRIES + 1):
+            if self.bucket:
+                self.bucket.acquire()
+            _retry_after.seconds = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if (getattr(e, 'status_code', None) != 429 or
+                        attempt == MAX_RATE_LIMITED_RETRIES):
+                    raise
+                rate_limited.inc(endpoint=name)
+                wait = _retry_after.seconds
+                if wait is None:
+                    wait = DEFAULT_RETRY_AFTER
+                logger.info('Rate limited by Bitbar on %s, retrying in %.1fs',
+                            name, wait)
+                if self.bucket:
+                    # hold back every caller sharing the bucket.
+                    self.bucket.pause(wait)
+                else:
+                    time.sleep(wait)
+
+
+def _rate_limited_client(wrapped):
+    client.add_transport_hook(_record_retry_after)
+    return RateLimitedClient(
+        wrapped, bucket_for(getattr(wrapped, 'cloud_url', None)))
+
+
+client.add_wrapper(_rate_limited_client, WRAPPER_ORDER)
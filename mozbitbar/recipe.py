@@ -11,10 +11,7 @@ import yaml
 from yaml.reader import ReaderError
 from yaml.scanner import ScannerError
 
-try:
-    from mozbitbar import MozbitbarRecipeException
-except ImportError:
-    from __init__ import MozbitbarRecipeException
+from mozbitbar import MozbitbarRecipeException
 
 
 logger = logging.getLogger('mozbitbar')
@@ -117,7 +114,7 @@ class Recipe(object):
             MozbitbarRecipeException: If path is neither a file in current
                 working directory nor a fully qualified path on local disk.
         """
-        logger.debug('Recipe path: {}'.format(path))
+        logger.debug('Recipe path: %s', path)
         if os.path.isfile(path):
             self.recipe_name = os.path.basename(path)
             self.recipe_path = path
@@ -0,0 +1,298 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Summarizes the JUnit XML results of test runs.
+
+Result files are parsed incrementally as they are downloaded: test cases are
+read one at a time, and discarded once counted, so that the memory used does
+not grow with the size of the suites:
+
+    summary = summarize_test_run(client, project_id, test_run_id)
+    summary.write('summary.json')
+
+The summary holds the number of passed, failed and skipped tests and their
+duration, per device and per test.
+"""
+
+from __future__ import absolute_import, print_function
+
+import json
+import logging
+
+import requests
+from testdroid import RequestResponseError
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+from mozbitbar import MozbitbarBaseException
+from mozbitbar.client import http_get
+from mozbitbar.logtail import TERMINAL_STATES
+
+logger = logging.getLogger('mozbitbar')
+
+STATUSES = ('passed', 'failed', 'skipped')
+
+# longest failure message kept in summaries.
+MAX_MESSAGE_LENGTH = 500
+
+# bytes read at once from downloaded result files.
+CHUNK_SIZE = 64 * 1024
+
+
+def _test_case(element, suite):
+    status = 'passed'
+    message = None
+    for child in element:
+        if child.tag in ('failure', 'error'):
+            status = 'failed'
+            message = child.get('message') or (child.text or '').strip()
+            break
+        if child.tag == 'skipped':
+            status = 'skipped'
+    try:
+        duration = float(element.get('time') or 0)
+    except ValueError:
+        duration = 0.0
+    case = {
+        'name': element.get('name', ''),
+        'classname': element.get('classname') or suite,
+        'status': status,
+        'duration': duration,
+    }
+    if message:
+        case['message'] = message.splitlines()[0][:MAX_MESSAGE_LENGTH]
+    return case
+
+
+def parse_junit(source):
+    """Yields the test cases of a JUnit XML file, one at a time.
+
+    Elements are removed from the tree once read, so that only the test case
+    being parsed is held in memory.
+
+    Args:
+        source (str or file): Path or file object of the XML file.
+
+    Yields:
+        dict: Name, classname, status, duration in seconds, and failure
+            message if any, of every test case.
+
+    Raises:
+        ElementTree.ParseError: If the file is not well-formed XML.
+    """
+    # elements from the root to the one being parsed, and names of the
+    # enclosing test suites.
+    parents = []
+    suites = []
+    for event, element in ElementTree.iterparse(source,
+                                                events=('start', 'end')):
+        if event == 'start':
+            if element.tag == 'testsuite':
+                suites.append(element.get('name', ''))
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if element.tag == 'testsuite':
+            suites.pop()
+        elif element.tag == 'testcase':
+            yield _test_case(element, suites[-1] if suites else '')
+        # children of test cases are read with them.
+        if parents and parents[-1].tag != 'testcase':
+            parents[-1].remove(element)
+
+
+class _ChunkReader(object):
+    """File object reading from an iterator of byte strings."""
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _counts():
+    return dict([(status, 0) for status in STATUSES], tests=0, duration=0.0)
+
+
+def _add_counts(counts, other):
+    for key in STATUSES + ('tests', 'duration'):
+        counts[key] += other[key]
+    if other.get('failures'):
+        counts.setdefault('failures', []).extend(other['failures'])
+
+
+class RunSummary(object):
+    """RunSummary aggregates the test cases of the device sessions of a test
+    run.
+    """
+    def __init__(self, test_run=None):
+        """Initializes the RunSummary.
+
+        Args:
+            test_run (dict, optional): Test run details, as returned by
+                Bitbar.
+        """
+        self.test_run = test_run
+        self.totals = _counts()
+        # counts keyed by device session id, and by test.
+        self.devices = {}
+        self.tests = {}
+
+    def add_device(self, session_id, name, state=None):
+        """Registers a device session, whether or not it has results."""
+        if session_id not in self.devices:
+            self.devices[session_id] = dict(_counts(), id=session_id,
+                                            name=name, state=state)
+        return self.devices[session_id]
+
+    def add(self, session_id, case):
+        """Counts a test case of a device session.
+
+        Args:
+            session_id (int): Id of a device session added with add_device.
+            case (dict): Test case, as yielded by parse_junit.
+        """
+        device = self.devices[session_id]
+        key = '.'.join(part for part in (case['classname'], case['name'])
+                       if part)
+        test = self.tests.get(key)
+        if test is None:
+            test = self.tests[key] = _counts()
+        for counts in (self.totals, device, test):
+            counts['tests'] += 1
+            counts[case['status']] += 1
+            counts['duration'] += case['duration']
+        if case['status'] == 'failed':
+            test.setdefault('failures', []).append(
+                {'device': device['name'], 'message': case.get('message')})
+
+    def add_file(self, session_id, source):
+        """Counts the test cases of a JUnit XML file.
+
+        The file is summarized on its own first, so that nothing is counted
+        if it fails to parse.
+
+        Args:
+            session_id (int): Id of a device session added with add_device.
+            source (str or file): Path or file object of the XML file.
+
+        Returns:
+            int: Number of test cases counted.
+
+        Raises:
+            ElementTree.ParseError: If the file is not well-formed XML.
+        """
+        device = self.devices[session_id]
+        partial = RunSummary()
+        partial.add_device(session_id, device['name'], device['state'])
+        for case in parse_junit(source):
+            partial.add(session_id, case)
+        self.merge(partial)
+        return partial.totals['tests']
+
+    def merge(self, other):
+        """Adds the counts of another summary to this one.
+
+        Args:
+            other (:obj:`RunSummary`): Summary of devices added to this
+                one too.
+        """
+        _add_counts(self.totals, other.totals)
+        for session_id, device in other.devices.items():
+            _add_counts(self.devices[session_id], device)
+        for key, test in other.tests.items():
+            _add_counts(self.tests.setdefault(key, _counts()), test)
+
+    def to_dict(self):
+        """Returns the summary, as written to JSON."""
+        def rounded(counts):
+            return dict(counts, duration=round(counts['duration'], 3))
+
+        summary = {
+            'totals': rounded(self.totals),
+            'devices': [rounded(device) for (_, device)
+                        in sorted(self.devices.items())],
+            'tests': dict((key, rounded(test))
+                          for (key, test) in self.tests.items()),
+        }
+        if self.test_run:
+            summary['test_run'] = dict(
+                (key, self.test_run.get(key))
+                for key in ('id', 'displayName', 'state'))
+        return summary
+
+    def write(self, path):
+        """Writes the summary as JSON.
+
+        Args:
+            path (str): Destination path on local disk.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+
+def _is_result_file(output_file):
+    return (output_file.get('state') == 'READY' and
+            output_file.get('name', '').lower().endswith('.xml'))
+
+
+def _ingest(client, summary, session_id, output_file):
+    path = 'me/files/{}/file'.format(output_file['id'])
+    try:
+        response = http_get(client, 'get_file_content', path, stream=True)
+        try:
+            count = summary.add_file(
+                session_id, _ChunkReader(response.iter_content(CHUNK_SIZE)))
+        finally:
+            response.close()
+    except (requests.exceptions.RequestException, RequestResponseError,
+            MozbitbarBaseException, ElementTree.ParseError) as e:
+        logger.warning('Failed to read results from %s: %s',
+                       output_file['name'], e)
+        return
+    logger.debug('Read %d test cases from %s', count, output_file['name'])
+
+
+def summarize_test_run(client, project_id, test_run_id):
+    """Downloads and summarizes the JUnit XML results of a test run.
+
+    Result files of every finished device session are parsed while they are
+    downloaded, without being written to disk.
+
+    Args:
+        client (:obj:`Testdroid`): Authenticated client.
+        project_id (int): Id of the project of the test run.
+        test_run_id (int): Id of the test run.
+
+    Returns:
+        :obj:`RunSummary`: Summary of the results.
+    """
+    summary = RunSummary(client.get_test_run(project_id, test_run_id))
+    device_runs = client.get_device_runs(project_id, test_run_id)['data']
+    for device_run in device_runs:
+        summary.add_device(device_run['id'],
+                           device_run['device']['displayName'],
+                           device_run['state'])
+        if device_run['state'] not in TERMINAL_STATES:
+            continue
+        path = ('me/projects/{}/runs/{}/device-sessions/{}/'
+                'output-file-set/files'.format(project_id, test_run_id,
+                                               device_run['id']))
+        output_files = client.get(path, payload={'limit': 0})['data']
+        for output_file in filter(_is_result_file, output_files):
+            _ingest(client, summary, device_run['id'], output_file)
+    return summary
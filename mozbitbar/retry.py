@@ -0,0 +1,280 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from mozbitbar import MozbitbarCircuitOpenException, client
+from mozbitbar.client import ClientWrapper
+from mozbitbar.metrics import REGISTRY, api_retries
+
+
+logger = logging.getLogger('mozbitbar')
+
+# order of the retry wrapper; above metrics, so that every attempt is
+# counted, and below coalescing, so that callers sharing a response share
+# its retries too.
+WRAPPER_ORDER = 30
+
+# HTTP status codes indicating a failure which may succeed when retried.
+# 429 is handled by the rate limiter.
+TRANSIENT_STATUS_CODES = (408, 500, 502, 503, 504)
+
+# raw client methods which are safe to repeat; reads named get_* are too.
+IDEMPOTENT_METHODS = ('get', 'download')
+
+circuit_opened = REGISTRY.counter(
+    'mozbitbar_api_circuit_opened_total',
+    'Times the circuit breaker of an endpoint opened.', ('endpoint',))
+
+
+def is_transient(error):
+    """Classifies an error raised by a client call.
+
+    Args:
+        error (Exception): Error raised by the client.
+
+    Returns:
+        bool: True if the error is transient, ie. the call may succeed if
+            retried. False if the error is permanent.
+    """
+    status_code = getattr(error, 'status_code', None)
+    if status_code is not None:
+        return status_code in TRANSIENT_STATUS_CODES
+
+    from requests.exceptions import ConnectionError, Timeout
+    from testdroid import ConnectionError as TestdroidConnectionError
+    from testdroid import RequestTimeout
+    return isinstance(error, (ConnectionError, Timeout,
+                              TestdroidConnectionError, RequestTimeout))
+
+
+class RetryPolicy(object):
+    """RetryPolicy describes how calls to an endpoint are retried."""
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=30.0,
+                 retry_writes=False, failure_threshold=10,
+                 reset_timeout=60.0):
+        """Initializes the RetryPolicy.
+
+        Args:
+            max_attempts (int, optional): Maximum attempts per call,
+                including the first one.
+            base_delay (float, optional): Delay before the first retry, in
+                seconds; doubled for every further retry.
+            max_delay (float, optional): Upper bound of the delay between
+                attempts, in seconds.
+            retry_writes (bool, optional): If True, calls which are not
+                idempotent are retried too.
+            failure_threshold (int, optional): Consecutive transient
+                failures after which the circuit breaker opens.
+            reset_timeout (float, optional): Seconds after which an open
+                circuit breaker lets a trial call through.
+        """
+        self.max_attempts = int(max_attempts)
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.retry_writes = retry_writes
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout = float(reset_timeout)
+
+    def delay(self, attempt):
+        """Returns the delay before retrying, using exponential backoff with
+        full jitter.
+
+        Args:
+            attempt (int): Number of attempts made so far.
+
+        Returns:
+            float: Seconds to wait before the next attempt.
+        """
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+
+class CircuitBreaker(object):
+    """CircuitBreaker stops calls to an endpoint after sustained failures.
+
+    Once open, calls fail immediately until the reset timeout has passed.
+    A single trial call is then let through; its success, or a permanent
+    error, closes the breaker, its transient failure opens it again.
+    """
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns whether a call may be attempted.
+
+        Returns:
+            bool: True if the breaker is closed, or a trial call is due.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if (not self._trial and
+                    time.time() - self.opened_at >= self.reset_timeout):
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        """Records a transient failure.
+
+        Returns:
+            bool: True if this failure opened the breaker.
+        """
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None and
+                               self.failures >= self.failure_threshold):
+                self.opened_at = time.time()
+                self._trial = False
+                return True
+            return False
+
+
+_default_policy = RetryPolicy()
+
+# per-endpoint policies, overriding the default policy.
+_policies = {
+    # losing a poll of a long device run is costly; be more patient.
+    'get_test_run': RetryPolicy(max_attempts=6, max_delay=60.0),
+}
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def configure(default=None, **endpoints):
+    """Sets the default and per-endpoint retry policies.
+
+    Args:
+        default (:obj:`RetryPolicy`, optional): Policy of endpoints without
+            their own policy.
+        **endpoints (:obj:`RetryPolicy`): Policies keyed by client method
+            name, eg. get_test_run.
+    """
+    global _default_policy
+
+    if default is not None:
+        _default_policy = default
+    _policies.update(endpoints)
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def load_policies(path):
+    """Loads retry policies from a JSON file.
+
+    The file maps client method names, or 'default', to RetryPolicy
+    arguments, eg. {"default": {"max_attempts": 3},
+    "get_test_run": {"max_attempts": 10}}.
+
+    Args:
+        path (str): Path to the JSON file.
+    """
+    with open(path, 'r') as f:
+        loaded = json.load(f)
+    policies = {name: RetryPolicy(**arguments)
+                for name, arguments in loaded.items()}
+    configure(**policies)
+
+
+def policy_for(name):
+    """Returns the retry policy of an endpoint.
+
+    Args:
+        name (str): Client method name.
+
+    Returns:
+        :obj:`RetryPolicy`: Policy of the endpoint.
+    """
+    return _policies.get(name, _default_policy)
+
+
+def breaker_for(name):
+    """Returns the circuit breaker of an endpoint, shared process-wide.
+
+    Args:
+        name (str): Client method name.
+
+    Returns:
+        :obj:`CircuitBreaker`: Breaker of the endpoint.
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            policy = policy_for(name)
+            _breakers[name] = CircuitBreaker(policy.failure_threshold,
+                                             policy.reset_timeout)
+        return _breakers[name]
+
+
+class RetryingClient(ClientWrapper):
+    """RetryingClient retries idempotent calls failing with transient errors,
+    and stops calling endpoints whose circuit breaker is open.
+    """
+    sleep = staticmethod(time.sleep)
+
+    def call(self, name, func, args, kwargs):
+        policy = policy_for(name)
+        breaker = breaker_for(name)
+        idempotent = name.startswith('get_') or name in IDEMPOTENT_METHODS
+        attempt = 0
+
+        while True:
+            if not breaker.allow():
+                msg = 'Circuit breaker open for {}, not calling Bitbar.'
+                msg = msg.format(name)
+                raise MozbitbarCircuitOpenException(message=msg)
+
+            attempt += 1
+            try:
+                response = func(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    # Bitbar answered; a failed trial call would otherwise
+                    # keep the breaker open for good.
+                    breaker.record_success()
+                    raise
+                if breaker.record_failure():
+                    circuit_opened.inc(endpoint=name)
+                    logger.warning('Circuit breaker opened for %s.', name)
+                if (attempt >= policy.max_attempts or
+                        not (idempotent or policy.retry_writes)):
+                    raise
+                delay = policy.delay(attempt)
+                api_retries.inc(endpoint=name)
+                logger.info('Transient error on %s (%s), retry %d in %.1fs',
+                            name, e, attempt, delay)
+                self.sleep(delay)
+            else:
+                breaker.record_success()
+                return response
+
+
+def _retrying_client(wrapped):
+    path = os.getenv('MOZBITBAR_RETRY_POLICY')
+    if path and path != getattr(_retrying_client, 'loaded', None):
+        load_policies(path)
+        _retrying_client.loaded = path
+    return RetryingClient(wrapped)
+
+
+client.add_wrapper(_retrying_client, WRAPPER_ORDER)
@@ -11,36 +11,20 @@ import yaml
 
 from testdroid import RequestResponseError
 
-try:
-    from mozbitbar.bitbar_project import BitbarProject
-except ImportError:
-    from bitbar_project import BitbarProject
-
-try:
-    from mozbitbar.recipe import Recipe
-except ImportError:
-    from recipe import Recipe
-
-try:
-    from mozbitbar import (
-        MozbitbarRecipeException,
-        MozbitbarProjectException,
-        MozbitbarCredentialException,
-        MozbitbarFrameworkException,
-        MozbitbarFileException,
-        MozbitbarTestRunException,
-        MozbitbarDeviceException,
-    )
-except ImportError:
-    from __init__ import (
-        MozbitbarRecipeException,
-        MozbitbarProjectException,
-        MozbitbarCredentialException,
-        MozbitbarFrameworkException,
-        MozbitbarFileException,
-        MozbitbarTestRunException,
-        MozbitbarDeviceException,
-    )
+from mozbitbar import (
+    MozbitbarRecipeException,
+    MozbitbarProjectException,
+    MozbitbarCredentialException,
+    MozbitbarFrameworkException,
+    MozbitbarFileException,
+    MozbitbarTestRunException,
+    MozbitbarDeviceException,
+    MozbitbarCircuitOpenException,
+    MozbitbarCassetteException,
+)
+from mozbitbar import trace
+from mozbitbar.bitbar_project import BitbarProject
+from mozbitbar.recipe import Recipe
 
 
 logger = logging.getLogger('mozbitbar')
@@ -73,6 +57,24 @@ def initialize_recipe(recipe_name):
         sys.exit(1)
 
 
+def load_credentials(path):
+    """Loads Testdroid credentials from a file.
+
+    Args:
+        path (str): Path to a YAML file holding a list of single key/value
+            mappings, keys being named as the environment variables.
+
+    Returns:
+        dict: Credentials found in the file.
+    """
+    with open(path, 'r') as f:
+        loaded_credentials = yaml.load(f.read())
+    credentials = {}
+    for c in loaded_credentials:
+        credentials.update(c)
+    return credentials
+
+
 def initialize_bitbar(recipe, credentials=None):
     """Initializes the Bitbar Project object.
 
@@ -89,10 +91,7 @@ def initialize_bitbar(recipe, credentials=None):
     """
     if credentials:
         logger.info('Credential file specified.')
-        with open(credentials, 'r') as f:
-            loaded_credentials = yaml.load(f.read())
-        for c in loaded_credentials:
-            recipe.project_arguments.update(c)
+        recipe.project_arguments.update(load_credentials(credentials))
 
     logger.info('Bitbar project initialization...')
     try:
@@ -131,20 +130,33 @@ def run_recipe(recipe_name, args):
     # object. As long as the recipe is defined with the action that matches
     # the method name, and the appropriate arguments are provided,
     # this method will execute each action automatically.
-    recipe = initialize_recipe(recipe_name)
+    with trace.span('initialize_recipe', recipe=recipe_name):
+        recipe = initialize_recipe(recipe_name)
 
-    bitbar_project = initialize_bitbar(recipe, args.credentials)
+    with trace.span('initialize_bitbar'):
+        bitbar_project = initialize_bitbar(recipe, args.credentials)
 
     logger.info('Start executing Bitbar tasks defined in recipe...')
-    for task in recipe.task_list:
+    try:
+        _run_tasks(bitbar_project, recipe.task_list)
+    finally:
+        # run queue slots are freed, and pooled projects returned, whether
+        # or not the recipe failed.
+        bitbar_project.release_slots()
+        bitbar_project.return_project()
+
+
+def _run_tasks(bitbar_project, task_list):
+    for task in task_list:
         action = task.pop('action')
         arguments = task.pop('arguments', {})
-        logger.debug(' '.join(['Action to run:', action]))
+        logger.debug('Action to run: %s', action)
 
         func = getattr(bitbar_project, action, None)
         if func:
             try:
-                func(**arguments)
+                with trace.span(action):
+                    func(**arguments)
             except RequestResponseError as rre:
                 logger.info('Testdroid raised an exception:')
                 print('Status code: ', rre.status_code)
@@ -155,19 +167,14 @@ def run_recipe(recipe_name, args):
                     MozbitbarFrameworkException,
                     MozbitbarFileException,
                     MozbitbarDeviceException,
-                    MozbitbarTestRunException) as exc:
+                    MozbitbarTestRunException,
+                    MozbitbarCircuitOpenException,
+                    MozbitbarCassetteException) as exc:
                 # If there's a better way to catch multiple exceptions derived
                 # from the same base class - I'd like to know.
-                msg = ' '.join([
-                    'Failure at task:', '{}'.format(action)
-                ])
                 logger.error(exc.message)
-                logger.exception(msg)
+                logger.exception('Failure at task: %s', action)
                 sys.exit(1)
         else:
-            msg = ' '.join([
-                'Specified action not implemented:',
-                '{}'.format(action)
-            ])
-            logger.critical(msg)
+            logger.critical('Specified action not implemented: %s', action)
             sys.exit(1)
@@ -0,0 +1,367 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Queues the test runs of every mozbitbar process of a host by priority.
+
+Bitbar limits how many test runs of an account execute at once. When the
+MOZBITBAR_RUN_QUEUE environment variable holds the path of a SQLite
+database, start_test_run first takes one of MOZBITBAR_MAX_RUNS slots from
+it, waiting for runs of higher priority, and of the same priority submitted
+earlier, to take theirs:
+
+    with RunQueue(path, max_runs=4) as queue:
+        entry_id = queue.acquire(priority=10, name='release-blocker')
+        ...
+        queue.release(entry_id)
+
+The database is locked for writing while slots are handed out, so that
+processes agree on them without a daemon. A slot is released once its test
+run is seen finished, when the recipe which started it ends, or when the
+process holding it exits.
+"""
+
+from __future__ import absolute_import, print_function
+
+import errno
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from mozbitbar.history import percentile
+from mozbitbar.metrics import REGISTRY
+
+logger = logging.getLogger('mozbitbar')
+
+DEFAULT_MAX_RUNS = 1
+
+# seconds between attempts to take a slot.
+DEFAULT_POLL_INTERVAL = 5
+
+# seconds released entries are kept for wait statistics.
+RETENTION = 7 * 86400
+
+wait_duration = REGISTRY.histogram(
+    'mozbitbar_run_queue_wait_seconds',
+    'Time test runs waited in the run queue for a slot.', ('priority',),
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0,
+             7200.0))
+
+_schema = (
+    'CREATE TABLE IF NOT EXISTS entries ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, priority INTEGER NOT NULL, '
+    'name TEXT, pid INTEGER NOT NULL, enqueued REAL NOT NULL, '
+    'dispatched REAL, released REAL)',
+    'CREATE INDEX IF NOT EXISTS entries_waiting '
+    'ON entries (dispatched, priority, id)',
+    'CREATE INDEX IF NOT EXISTS entries_released ON entries (released)',
+)
+
+
+def queue_path():
+    """Returns the path of the run queue database, set with the
+    MOZBITBAR_RUN_QUEUE environment variable.
+
+    Returns:
+        str: Path of the database, or None if runs are not queued.
+    """
+    return os.getenv('MOZBITBAR_RUN_QUEUE') or None
+
+
+def max_runs():
+    """Returns the number of test runs the account may execute at once,
+    set with the MOZBITBAR_MAX_RUNS environment variable.
+
+    Returns:
+        int: Number of slots of the run queue.
+    """
+    return int(os.getenv('MOZBITBAR_MAX_RUNS') or DEFAULT_MAX_RUNS)
+
+
+def is_alive(pid):
+    """Returns whether a process of this host is running."""
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+class RunQueue(object):
+    """RunQueue hands out a limited number of slots to test runs, highest
+    priority first, across every process using the same database.
+    """
+    def __init__(self, path, max_runs=DEFAULT_MAX_RUNS,
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        """Opens the database, creating it if needed.
+
+        Args:
+            path (str): Path of the SQLite database.
+            max_runs (int, optional): Number of test runs which may hold a
+                slot at once.
+            poll_interval (float, optional): Seconds between attempts to
+                take a slot.
+        """
+        self.path = path
+        self.max_runs = max_runs
+        self.poll_interval = poll_interval
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # transactions are begun explicitly, taking the write lock upfront.
+        self._connection = sqlite3.connect(path, timeout=60,
+                                           isolation_level=None)
+        with self._transaction():
+            for statement in _schema:
+                self._connection.execute(statement)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def _transaction(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self._connection
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    def _reap(self, connection, now):
+        """Frees the entries of processes which exited without releasing
+        them, and forgets old entries.
+        """
+        rows = connection.execute(
+            'SELECT id, pid, dispatched FROM entries WHERE released IS NULL')
+        for entry_id, pid, dispatched in rows.fetchall():
+            if is_alive(pid):
+                continue
+            if dispatched is None:
+                connection.execute('DELETE FROM entries WHERE id = ?',
+                                   (entry_id,))
+            else:
+                logger.warning('Releasing run queue slot %d of exited '
+                               'process %d.', entry_id, pid)
+                connection.execute(
+                    'UPDATE entries SET released = ? WHERE id = ?',
+                    (now, entry_id))
+        connection.execute('DELETE FROM entries WHERE released < ?',
+                           (now - RETENTION,))
+
+    def submit(self, priority=0, name=None):
+        """Adds an entry waiting for a slot.
+
+        Args:
+            priority (int, optional): Priority of the entry; higher
+                priorities are dispatched first.
+            name (str, optional): Name of the test run, for statistics.
+
+        Returns:
+            int: Id of the entry.
+        """
+        with self._transaction() as connection:
+            return connection.execute(
+                'INSERT INTO entries (priority, name, pid, enqueued) '
+                'VALUES (?, ?, ?, ?)',
+                (priority, name, os.getpid(), time.time())).lastrowid
+
+    def dispatch(self, entry_id):
+        """Gives a slot to an entry if one is free, and no entry of higher
+        priority, or of the same priority submitted earlier, waits for it.
+
+        Args:
+            entry_id (int): Id of a submitted entry.
+
+        Returns:
+            bool: True if the entry holds a slot.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            self._reap(connection, now)
+            dispatched = connection.execute(
+                'SELECT dispatched FROM entries WHERE id = ?',
+                (entry_id,)).fetchone()
+            if dispatched is None:
+                raise KeyError(entry_id)
+            if dispatched[0] is not None:
+                return True
+            running = connection.execute(
+                'SELECT COUNT(*) FROM entries WHERE dispatched IS NOT NULL '
+                'AND released IS NULL').fetchone()[0]
+            free = self.max_runs - running
+            if free <= 0:
+                return False
+            first = [row[0] for row in connection.execute(
+                'SELECT id FROM entries WHERE dispatched IS NULL '
+                'ORDER BY priority DESC, id LIMIT ?', (free,))]
+            if entry_id not in first:
+                return False
+            connection.execute(
+                'UPDATE entries SET dispatched = ? WHERE id = ?',
+                (now, entry_id))
+            return True
+
+    def acquire(self, priority=0, name=None):
+        """Waits for a slot.
+
+        Args:
+            priority (int, optional): Priority of the test run; higher
+                priorities are dispatched first.
+            name (str, optional): Name of the test run, for statistics.
+
+        Returns:
+            int: Id of the entry holding the slot, to be released.
+        """
+        entry_id = self.submit(priority, name)
+        start = time.time()
+        try:
+            while not self.dispatch(entry_id):
+                logger.debug('Waiting for a run queue slot for %s...', name)
+                time.sleep(self.poll_interval)
+        except BaseException:
+            # interrupted while waiting; leave the queue.
+            self.cancel(entry_id)
+            raise
+        waited = time.time() - start
+        wait_duration.observe(waited, priority=priority)
+        if waited >= self.poll_interval:
+            logger.info('Waited %ds for a run queue slot.', waited)
+        return entry_id
+
+    def try_acquire(self, priority=0, name=None):
+        """Takes a slot if one can be dispatched right away, without
+        waiting for it.
+
+        Args:
+            priority (int, optional): Priority of the test run; higher
+                priorities are dispatched first.
+            name (str, optional): Name of the test run, for statistics.
+
+        Returns:
+            int: Id of the entry holding the slot, to be released, or None
+                if no slot is free.
+        """
+        entry_id = self.submit(priority, name)
+        try:
+            dispatched = self.dispatch(entry_id)
+        except BaseException:
+            self.cancel(entry_id)
+            raise
+        if not dispatched:
+            self.cancel(entry_id)
+            return None
+        wait_duration.observe(0, priority=priority)
+        return entry_id
+
+    def release(self, entry_id):
+        """Frees the slot of an entry.
+
+        Args:
+            entry_id (int): Id of the entry, as returned by acquire.
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE entries SET released = ? WHERE id = ? AND '
+                'released IS NULL', (time.time(), entry_id))
+
+    def cancel(self, entry_id):
+        """Removes an entry which does not hold a slot, or frees its slot.
+
+        Args:
+            entry_id (int): Id of the entry.
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                'DELETE FROM entries WHERE id = ? AND dispatched IS NULL',
+                (entry_id,))
+        self.release(entry_id)
+
+    def stats(self, since=None):
+        """Returns the state of the queue and the time entries waited for a
+        slot, per priority.
+
+        Args:
+            since (float, optional): Earliest submission time of the
+                entries whose waits are counted, in seconds since epoch.
+
+        Returns:
+            dict: Counts of waiting, running and dispatched entries, and
+                median, 95th percentile and longest wait in seconds, keyed
+                by priority.
+        """
+        with self._transaction() as connection:
+            self._reap(connection, time.time())
+        stats = {}
+
+        def priority_stats(priority):
+            if priority not in stats:
+                stats[priority] = {'waiting': 0, 'running': 0,
+                                   'dispatched': 0, 'waits': []}
+            return stats[priority]
+
+        rows = self._connection.execute(
+            'SELECT priority, dispatched IS NOT NULL, COUNT(*) FROM entries '
+            'WHERE released IS NULL GROUP BY priority, dispatched IS NOT NULL')
+        for priority, running, count in rows:
+            priority_stats(priority)['running' if running else 'waiting'] = (
+                count)
+        rows = self._connection.execute(
+            'SELECT priority, dispatched - enqueued FROM entries '
+            'WHERE dispatched IS NOT NULL AND enqueued >= ? '
+            'ORDER BY dispatched - enqueued', (since or 0,))
+        for priority, wait in rows:
+            priority_stats(priority)['waits'].append(wait)
+
+        for entry in stats.values():
+            waits = entry.pop('waits')
+            entry.update(dispatched=len(waits),
+                         wait_p50=percentile(waits, 0.5),
+                         wait_p95=percentile(waits, 0.95),
+                         wait_max=waits[-1] if waits else None)
+        return stats
+
+
+def acquire(priority=0, name=None, path=None, wait=True):
+    """Waits for a slot of the run queue, if one is configured.
+
+    Args:
+        priority (int, optional): Priority of the test run; higher
+            priorities are dispatched first.
+        name (str, optional): Name of the test run.
+        path (str, optional): Path of the database. Defaults to
+            queue_path().
+        wait (bool, optional): If False, the slot is only taken if it can
+            be dispatched right away.
+
+    Returns:
+        int: Id of the entry holding the slot, or None if runs are not
+            queued, or if wait is False and no slot is free.
+    """
+    path = path or queue_path()
+    if not path:
+        return None
+    with RunQueue(path, max_runs()) as queue:
+        if not wait:
+            return queue.try_acquire(priority, name)
+        return queue.acquire(priority, name)
+
+
+def release(entry_id, path=None):
+    """Frees a slot of the run queue.
+
+    Args:
+        entry_id (int): Id of the entry, as returned by acquire.
+        path (str, optional): Path of the database. Defaults to
+            queue_path().
+    """
+    with RunQueue(path or queue_path(), max_runs()) as queue:
+        queue.release(entry_id)
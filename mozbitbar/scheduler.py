@@ -0,0 +1,305 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Schedules test runs across equivalent device groups.
+
+Rather than being queued on Bitbar behind the runs of a device group chosen
+in advance, runs are held locally and started on whichever group is
+expected to free up first:
+
+    scheduler = Scheduler(project, groups=['Group 0', 'Group 1'],
+                          max_devices=20)
+    scheduler.run([{'name': 'mochitest-1'}, {'name': 'mochitest-2'}])
+
+A test run occupies every device of its group until it finishes, so that a
+group runs one test run at a time, and the device concurrency of the account
+bounds the groups busy at once, as do the slots of the run queue, if one is
+configured; slots are taken without waiting, a run which gets none being
+started once a run finishes. Durations are estimated from the run history,
+and runs are assigned to groups longest first, each to the group on which
+it would finish the earliest, so that the last run finishes as early as it
+can. The plan is made again every time a group frees up.
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+import sqlite3
+import time
+
+from mozbitbar import MozbitbarDeviceException
+from mozbitbar import history
+
+logger = logging.getLogger('mozbitbar')
+
+# seconds a run is expected to take when the history has no estimate.
+DEFAULT_DURATION = 600
+
+
+def plan(durations, free_at):
+    """Assigns runs to device groups, longest first, each to the group on
+    which it would finish the earliest.
+
+    Args:
+        durations (list of dict): Estimated duration of every run in
+            seconds, keyed by group id.
+        free_at (dict): Seconds until every group finishes the runs it
+            already has, keyed by group id.
+
+    Returns:
+        tuple: Indexes of the runs assigned to every group, in the order
+            they are to be started, keyed by group id, and the seconds until
+            the last run finishes.
+    """
+    free_at = dict(free_at)
+    assignment = dict((group_id, []) for group_id in free_at)
+    # the sort is stable: runs of equal length keep their queue order.
+    order = sorted(range(len(durations)),
+                   key=lambda i: -min(durations[i].values()))
+    for i in order:
+        group_id = min(free_at,
+                       key=lambda g: (free_at[g] + durations[i][g], g))
+        assignment[group_id].append(i)
+        free_at[group_id] += durations[i][group_id]
+    return assignment, max(free_at.values()) if free_at else 0
+
+
+class Scheduler(object):
+    """Scheduler starts the test runs of a project on a set of device groups
+    as they free up.
+    """
+    def __init__(self, project, groups=None, max_devices=None, interval=30,
+                 default_duration=DEFAULT_DURATION):
+        """Initializes the Scheduler and reads the device groups.
+
+        Args:
+            project (:obj:`BitbarProject`): Project the runs are started in.
+            groups (list, optional): Ids or names of the device groups to
+                use. All device groups are used if not specified.
+            max_devices (int, optional): Devices the account may use at
+                once. Groups with more devices are not used.
+            interval (int, optional): Seconds between polls of the active
+                runs.
+            default_duration (int, optional): Seconds a run is expected to
+                take when the history has no estimate.
+
+        Raises:
+            MozbitbarDeviceException: If a group does not exist, or no group
+                can be used.
+        """
+        self.project = project
+        self.max_devices = max_devices
+        self.interval = interval
+        self.default_duration = default_duration
+        self.groups = self._device_groups(groups)
+        # runs occupying every group, keyed by group id, and runs started by
+        # the scheduler, in order.
+        self.active = {}
+        self.started = []
+
+    def _device_groups(self, groups):
+        device_groups = self.project.get_device_groups()
+        if groups:
+            selected = []
+            for group in groups:
+                try:
+                    group = int(group)
+                except ValueError:
+                    group = str(group)
+                match = [device_group for device_group in device_groups
+                         if group in (device_group['id'],
+                                      str(device_group['displayName']))]
+                if not match:
+                    msg = 'Device group {} does not exist.'.format(group)
+                    raise MozbitbarDeviceException(message=msg)
+                selected.append(match[0])
+            device_groups = selected
+
+        usable = {}
+        for device_group in device_groups:
+            devices = device_group.get('deviceCount') or 0
+            if not devices:
+                continue
+            if self.max_devices and devices > self.max_devices:
+                logger.warning('Device group %s has more devices than the '
+                               'account may use at once.',
+                               device_group['displayName'])
+                continue
+            usable[device_group['id']] = device_group
+        if not usable:
+            msg = 'No device group can run the test runs.'
+            raise MozbitbarDeviceException(message=msg)
+        return usable
+
+    def _use_group(self, group_id):
+        self.project.device_group_id = group_id
+        self.project.device_group_name = str(
+            self.groups[group_id]['displayName'])
+
+    def _durations(self, run, runs_history=None):
+        """Returns the estimated duration of a run on every group."""
+        if run.get('duration'):
+            return dict((group_id, run['duration'])
+                        for group_id in self.groups)
+        durations = {}
+        for group_id in self.groups:
+            estimate = None
+            if runs_history and run.get('name'):
+                estimate = runs_history.estimate(
+                    run['name'], device_group=group_id,
+                    framework_id=self.project.framework_id)
+            durations[group_id] = (estimate.expected if estimate
+                                   else self.default_duration)
+        return durations
+
+    def _estimate_all(self, runs):
+        path = history.history_path()
+        if not path:
+            return [self._durations(run) for run in runs]
+        try:
+            with history.RunHistory(path) as runs_history:
+                return [self._durations(run, runs_history) for run in runs]
+        except sqlite3.Error as e:
+            logger.warning('Failed to read history: %s', e)
+            return [self._durations(run) for run in runs]
+
+    def _load_active_runs(self):
+        """Counts the unfinished runs of the project towards the load of
+        their groups.
+        """
+        test_runs = [test_run for test_run in self.project.get_all_test_runs()
+                     if test_run.get('state') != 'FINISHED' and
+                     test_run.get('usedDeviceGroupId') in self.groups]
+        durations = self._estimate_all(
+            [{'name': test_run.get('displayName')} for test_run in test_runs])
+        for test_run, duration in zip(test_runs, durations):
+            group_id = test_run['usedDeviceGroupId']
+            created = test_run.get('createTime', time.time() * 1000) / 1000.0
+            self.active.setdefault(group_id, []).append(
+                {'id': test_run['id'], 'name': test_run.get('displayName'),
+                 'finish': created + duration[group_id], 'started': False})
+
+    def _devices_in_use(self):
+        return sum(self.groups[group_id]['deviceCount']
+                   for group_id in self.active)
+
+    def _poll(self):
+        """Drops finished runs from the load of their groups."""
+        for group_id, entries in list(self.active.items()):
+            for entry in list(entries):
+                test_run = self.project.get_test_run(entry['id'])
+                if entry['started']:
+                    entry['result']['state'] = test_run['state']
+                if test_run['state'] != 'FINISHED':
+                    continue
+                entries.remove(entry)
+                if entry['started']:
+                    logger.info('Test run %s finished on %s.',
+                                entry['name'],
+                                self.groups[group_id]['displayName'])
+                    self._use_group(group_id)
+                    self.project.complete_test_run(test_run)
+            if not entries:
+                del self.active[group_id]
+
+    def _start(self, run, group_id, duration):
+        """Starts a run on a group, unless no run queue slot is free.
+
+        Returns:
+            bool: True if the run was started.
+        """
+        self._use_group(group_id)
+        arguments = dict((key, value) for (key, value) in run.items()
+                         if key != 'duration')
+        # slots are freed by _poll, which must not be blocked waiting for
+        # one.
+        arguments['wait_for_slot'] = False
+        if not self.project.start_test_run(**arguments):
+            logger.debug('No run queue slot is free for %s.', run.get('name'))
+            return False
+        result = {'name': self.project.test_run_name,
+                  'test_run_id': self.project.test_run_id,
+                  'device_group_id': group_id,
+                  'device_group_name': self.project.device_group_name,
+                  'state': 'WAITING'}
+        self.started.append(result)
+        self.active[group_id] = [
+            {'id': result['test_run_id'], 'name': result['name'],
+             'finish': time.time() + duration, 'started': True,
+             'result': result}]
+        logger.info('Started test run %s on %s, expected to take %ds.',
+                    result['name'], result['device_group_name'], duration)
+        return True
+
+    def _start_runs(self, pending, durations):
+        """Starts the next run of every idle group, as the device
+        concurrency of the account and the run queue allow.
+
+        Returns:
+            set: Indexes of the runs started.
+        """
+        now = time.time()
+        free_at = dict(
+            (group_id, max([entry['finish'] - now
+                            for entry in self.active.get(group_id, [])] +
+                           [0]))
+            for group_id in self.groups)
+        assignment, makespan = plan(durations, free_at)
+        logger.debug('%d runs pending, expected to finish in %ds.',
+                     len(pending), makespan)
+
+        devices = self._devices_in_use()
+        started = set()
+        # longest runs claim the devices first.
+        idle = sorted((group_id for group_id in self.groups
+                       if assignment[group_id] and
+                       group_id not in self.active),
+                      key=lambda g: -durations[assignment[g][0]][g])
+        for group_id in idle:
+            count = self.groups[group_id]['deviceCount']
+            if self.max_devices and devices + count > self.max_devices:
+                continue
+            index = assignment[group_id][0]
+            if not self._start(pending[index], group_id,
+                               durations[index][group_id]):
+                break
+            devices += count
+            started.add(index)
+        return started
+
+    def run(self, runs):
+        """Starts test runs as device groups free up, and waits for all of
+        them to finish.
+
+        Args:
+            runs (list of dict): Arguments of start_test_run of every run,
+                such as its name and additional parameters. A duration in
+                seconds overrides the estimate of the run.
+
+        Returns:
+            :obj:`list` of :obj:`dict`: Name, test run id, device group id
+                and name, and final state of every run, in the order they
+                were started.
+
+        Raises:
+            MozbitbarTestRunException: If a run fails to start or be
+                polled.
+        """
+        pending = [dict(run) for run in runs]
+        durations = self._estimate_all(pending)
+        self._load_active_runs()
+        while True:
+            self._poll()
+            if pending:
+                started = self._start_runs(pending, durations)
+                pending = [run for (i, run) in enumerate(pending)
+                           if i not in started]
+                durations = [duration for (i, duration)
+                             in enumerate(durations) if i not in started]
+            if not pending and not any(entry['started']
+                                       for entries in self.active.values()
+                                       for entry in entries):
+                break
+            time.sleep(self.interval)
+        return self.started
@@ -0,0 +1,166 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from mozbitbar import client
+from mozbitbar.client import ClientWrapper
+
+# order of the tracing wrapper; outermost, so spans cover retries and waits.
+WRAPPER_ORDER = 100
+
+# currently active Tracer, or None if tracing is disabled.
+_tracer = None
+
+
+class Tracer(object):
+    """Tracer records spans of time spent in recipe tasks, client calls and
+    HTTP requests, and exports them in Chrome trace-event format.
+    """
+    def __init__(self):
+        self.events = []
+        self._epoch = time.time()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """Records the duration of the enclosed block.
+
+        The yielded dictionary can be updated by the block to attach further
+        arguments, such as a status code, to the span.
+
+        Args:
+            name (str): Name of the span.
+            category (str): Category of the span, eg. task, api or http.
+            **args: Arguments attached to the span.
+        """
+        start = time.time()
+        try:
+            yield args
+        finally:
+            end = time.time()
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': int((start - self._epoch) * 1e6),
+                'dur': int((end - start) * 1e6),
+                'pid': self._pid,
+                'tid': threading.current_thread().ident,
+                'args': args,
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def to_chrome_trace(self):
+        """Returns the recorded spans in Chrome trace-event format.
+
+        Returns:
+            dict: Trace loadable by chrome://tracing or Perfetto.
+        """
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event['ts'])
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        """Writes the recorded spans to a file in Chrome trace-event format.
+
+        Args:
+            path (str): Destination path on local disk.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+class TracingClient(ClientWrapper):
+    """TracingClient records a span for every call made to the client."""
+    def call(self, name, func, args, kwargs):
+        tracer = _tracer
+        if tracer is None:
+            return func(*args, **kwargs)
+
+        with tracer.span(name, 'api', endpoint=name) as span_args:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                span_args['error'] = type(e).__name__
+                span_args['status'] = getattr(e, 'status_code', None)
+                raise
+
+
+def _trace_request(send, request, **kwargs):
+    tracer = _tracer
+    if tracer is None:
+        return send(request, **kwargs)
+
+    name = ' '.join([request.method, request.path_url.split('?')[0]])
+    with tracer.span(name, 'http', method=request.method,
+                     url=request.path_url) as span_args:
+        response = send(request, **kwargs)
+        span_args['status'] = response.status_code
+        if kwargs.get('stream'):
+            span_args['bytes'] = int(
+                response.headers.get('Content-Length') or 0)
+        else:
+            span_args['bytes'] = len(response.content or b'')
+        return response
+
+
+def enable():
+    """Enables tracing for clients created from now on.
+
+    Returns:
+        :obj:`Tracer`: The active tracer.
+    """
+    global _tracer
+
+    if _tracer is None:
+        _tracer = Tracer()
+        client.add_wrapper(TracingClient, WRAPPER_ORDER)
+        client.add_transport_hook(_trace_request)
+    return _tracer
+
+
+def disable():
+    """Disables tracing and discards the active tracer."""
+    global _tracer
+
+    _tracer = None
+    client.remove_wrapper(TracingClient)
+    client.remove_transport_hook(_trace_request)
+
+
+def active():
+    """Returns the active tracer.
+
+    Returns:
+        :obj:`Tracer` or None: Active tracer, None if tracing is disabled.
+    """
+    return _tracer
+
+
+@contextmanager
+def span(name, category='task', **args):
+    """Records a span on the active tracer, if any.
+
+    Does nothing but yield when tracing is disabled.
+
+    Args:
+        name (str): Name of the span.
+        category (str, optional): Category of the span.
+        **args: Arguments attached to the span.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield args
+        return
+    with tracer.span(name, category, **args) as span_args:
+        yield span_args
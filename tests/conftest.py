@@ -13,6 +13,9 @@ from requests import Response
 
 from testdroid import RequestResponseError, Testdroid
 
+from mozbitbar import retry
+from mozbitbar.fake_server import FakeBitbar
+
 
 def mock_projects_list():
     return {
@@ -363,6 +366,30 @@ def mock_testdroid_client(monkeypatch):
     monkeypatch.setattr(Testdroid, 'upload', upload_wrapper)
 
 
+@pytest.fixture
+def fake_bitbar_options():
+    """Arguments of the FakeBitbar started by fake_bitbar; overridden by
+    modules needing another data set.
+    """
+    return {}
+
+
+@pytest.fixture
+def fake_bitbar(request, monkeypatch, fake_bitbar_options):
+    """Starts a FakeBitbar, with the options given by indirect
+    parametrization, or by fake_bitbar_options.
+    """
+    # talk to the server rather than to the mocked Testdroid methods.
+    monkeypatch.undo()
+    monkeypatch.setattr(retry.RetryingClient, 'sleep',
+                        staticmethod(lambda delay: None))
+    # polls made without interval would share their responses.
+    monkeypatch.setenv('MOZBITBAR_COALESCE_WINDOW', '0')
+    options = getattr(request, 'param', fake_bitbar_options)
+    with FakeBitbar(**options) as server:
+        yield server
+
+
 @pytest.fixture(scope='function')
 def base_recipe():
     return [{
@@ -0,0 +1,173 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import threading
+
+import pytest
+from testdroid import RequestResponseError
+from testdroid import Testdroid as Bitbar
+
+from mozbitbar.bitbar import Bitbar as MozbitbarBitbar
+from mozbitbar.pool import READY, ProjectPool
+
+NOW = 1500000000
+DAY = 86400 * 1000
+
+
+def days_ago(days):
+    return NOW * 1000 - days * DAY
+
+
+def mock_collections():
+    return {
+        'me/projects': [
+            {'id': 1, 'name': 'throwaway-1', 'createTime': days_ago(40)},
+            {'id': 2, 'name': 'throwaway-2', 'createTime': days_ago(40)},
+            {'id': 3, 'name': 'throwaway-3', 'createTime': days_ago(2)},
+            {'id': 4, 'name': 'production', 'createTime': days_ago(400)},
+        ],
+        'me/projects/2/runs': [
+            {'id': 20, 'displayName': 'recent', 'state': 'FINISHED',
+             'createTime': days_ago(1)},
+        ],
+        'me/projects/4/runs': [
+            {'id': 40, 'displayName': 'old', 'state': 'FINISHED',
+             'createTime': days_ago(100)},
+            {'id': 41, 'displayName': 'running', 'state': 'RUNNING',
+             'createTime': days_ago(100)},
+            {'id': 42, 'displayName': 'new', 'state': 'FINISHED',
+             'createTime': days_ago(3)},
+        ],
+        'me/files': [
+            {'id': 500, 'name': 'old.apk', 'createTime': days_ago(60)},
+            {'id': 501, 'name': 'new.apk', 'createTime': days_ago(1)},
+        ],
+    }
+
+
+@pytest.fixture
+def mock_bitbar(monkeypatch):
+    collections = mock_collections()
+    deleted = []
+    lock = threading.Lock()
+
+    def get_wrapper(object, path=None, payload={}, headers={}):
+        data = collections.get(path, [])
+        offset, limit = payload['offset'], payload['limit']
+        return {'data': data[offset:offset + limit], 'total': len(data)}
+
+    def delete_wrapper(object, path=None, payload=None, headers={}):
+        if path == 'me/files/501':
+            raise RequestResponseError(msg='mock', status_code=500)
+        with lock:
+            deleted.append(path)
+
+    monkeypatch.setattr(Bitbar, 'get', get_wrapper, raising=False)
+    monkeypatch.setattr(Bitbar, 'delete', delete_wrapper, raising=False)
+    return deleted
+
+
+def plan_ids(plan):
+    return sorted((entry['kind'], entry['id']) for entry in plan)
+
+
+@pytest.mark.parametrize('kwargs,expected', [
+    (
+        {'older_than': 30},
+        [('input_file', 500), ('project', 1), ('project', 2),
+         ('project', 4)]
+    ),
+    (
+        {'older_than': 30, 'name': 'throwaway-*', 'kinds': ('project',)},
+        [('project', 1), ('project', 2)]
+    ),
+    (
+        {'older_than': 30, 'unused': True, 'kinds': ('project',)},
+        [('project', 1)]
+    ),
+    (
+        {'unused': True, 'kinds': ('project',)},
+        [('project', 1), ('project', 3)]
+    ),
+    (
+        {'older_than': 30, 'kinds': ('test_run',)},
+        [('test_run', 40)]
+    ),
+    (
+        {'name': '*.apk', 'kinds': ('input_file',)},
+        [('input_file', 500), ('input_file', 501)]
+    ),
+])
+def test_plan_cleanup(mock_bitbar, kwargs, expected):
+    bitbar = MozbitbarBitbar()
+
+    plan = bitbar.plan_cleanup(now=NOW, page_size=1, **kwargs)
+
+    assert plan_ids(plan) == expected
+
+
+def test_plan_cleanup_skips_runs_of_deleted_projects(mock_bitbar):
+    bitbar = MozbitbarBitbar()
+
+    plan = bitbar.plan_cleanup(now=NOW, name='*',
+                               kinds=('project', 'test_run'))
+
+    assert plan_ids(plan) == [('project', 1), ('project', 2),
+                              ('project', 3), ('project', 4)]
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'kinds': ('test_run',)},
+    # unused only filters projects.
+    {'unused': True},
+])
+def test_plan_cleanup_without_filter(mock_bitbar, kwargs):
+    bitbar = MozbitbarBitbar()
+
+    with pytest.raises(ValueError):
+        bitbar.plan_cleanup(now=NOW, **kwargs)
+
+
+def test_plan_cleanup_keeps_pooled_projects(mock_bitbar, monkeypatch,
+                                            tmpdir):
+    path = tmpdir.join('pool.db').strpath
+    monkeypatch.setenv('MOZBITBAR_PROJECT_POOL', path)
+    with ProjectPool(path) as project_pool:
+        project_pool.add('throwaway', {'id': 2, 'name': 'throwaway-2'},
+                         state=READY)
+    bitbar = MozbitbarBitbar()
+
+    plan = bitbar.plan_cleanup(now=NOW, name='throwaway-*',
+                               kinds=('project',))
+
+    assert plan_ids(plan) == [('project', 1), ('project', 3)]
+
+
+def test_cleanup_dry_run(mock_bitbar):
+    bitbar = MozbitbarBitbar()
+
+    plan = bitbar.cleanup(name='throwaway-*', dry_run=True)
+
+    assert plan_ids(plan) == [('project', 1), ('project', 2),
+                              ('project', 3)]
+    assert mock_bitbar == []
+    assert all('deleted' not in entry for entry in plan)
+
+
+def test_cleanup_execute(mock_bitbar):
+    bitbar = MozbitbarBitbar()
+    progress = []
+
+    plan = bitbar.cleanup(name='*.apk', dry_run=False, workers=2,
+                          progress=lambda done, total: progress.append(
+                              (done, total)))
+
+    assert mock_bitbar == ['me/files/500']
+    outcome = {entry['id']: entry['deleted'] for entry in plan}
+    # a failed deletion does not stop the others.
+    assert outcome == {500: True, 501: False}
+    assert progress == [(1, 2), (2, 2)]
@@ -40,18 +40,6 @@ def test_bb_file_on_local_disk(write_tmp_file, file_name, expected,
     assert initialize_project._file_on_local_disk(file_name) == expected
 
 
-@pytest.mark.parametrize('file_name,expected', [
-    ('mock_file.zip', True),
-    ('mocked_application_file.apk', True),
-    (string.lowercase, False),
-    ('1', False),
-    (None, False),
-    (-1, False)
-])
-def test_bb_file_on_bitbar(file_name, expected, initialize_project):
-    assert initialize_project._file_on_bitbar(file_name) == expected
-
-
 @pytest.mark.parametrize('file_name,expected', [
     (
         '/mock_path/',
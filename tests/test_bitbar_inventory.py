@@ -0,0 +1,139 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import json
+import sqlite3
+import threading
+
+import pytest
+from testdroid import Testdroid as Bitbar
+
+from mozbitbar.bitbar import Bitbar as MozbitbarBitbar
+from mozbitbar.bitbar import open_sink, NDJSONSink, SQLiteSink
+
+
+def mock_collections():
+    return {
+        'me/projects': [{'id': i, 'name': 'project_{}'.format(i)}
+                        for i in range(1, 8)],
+        'me/device-groups': [{'id': 7070, 'displayName': 'mock_group'}],
+        'devices': [{'id': i} for i in range(100, 125)],
+        'me/files': [{'id': 500, 'name': 'mock.apk'}],
+        'me/projects/3/runs': [{'id': i} for i in range(10)],
+    }
+
+
+@pytest.fixture
+def mock_get(monkeypatch):
+    collections = mock_collections()
+    requests = []
+    lock = threading.Lock()
+
+    def get_wrapper(object, path=None, payload={}, headers={}):
+        with lock:
+            requests.append((path, dict(payload)))
+        data = collections.get(path, [])
+        offset, limit = payload['offset'], payload['limit']
+        return {'data': data[offset:offset + limit], 'offset': offset,
+                'limit': limit, 'total': len(data)}
+
+    monkeypatch.setattr(Bitbar, 'get', get_wrapper, raising=False)
+    return requests
+
+
+@pytest.mark.parametrize('page_size', [1, 3, 100])
+def test_snapshot_inventory_ndjson(tmpdir, mock_get, page_size):
+    path = tmpdir.join('inventory.ndjson').strpath
+    bitbar = MozbitbarBitbar()
+
+    counts = bitbar.snapshot_inventory(path, workers=4, page_size=page_size)
+
+    assert counts == {'project': 7, 'device_group': 1, 'device': 25,
+                      'input_file': 1, 'test_run': 10}
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 44
+    runs = [line for line in lines if line['kind'] == 'test_run']
+    assert sorted(run['data']['id'] for run in runs) == list(range(10))
+    assert all(run['parent_id'] == 3 for run in runs)
+
+    # every page is requested once.
+    assert len(mock_get) == len(set(
+        (path, payload['offset']) for (path, payload) in mock_get))
+    assert ('me/files', {'filter': 's_direction_eq_INPUT', 'offset': 0,
+                         'limit': page_size}) in mock_get
+
+
+def test_snapshot_inventory_sqlite(tmpdir, mock_get):
+    path = tmpdir.join('inventory.db').strpath
+    bitbar = MozbitbarBitbar()
+
+    bitbar.snapshot_inventory(path, page_size=4)
+    # a second snapshot replaces the records of the first one.
+    bitbar.snapshot_inventory(path, page_size=4)
+
+    connection = sqlite3.connect(path)
+    rows = connection.execute(
+        'SELECT kind, COUNT(*) FROM inventory GROUP BY kind').fetchall()
+    assert dict(rows) == {'project': 7, 'device_group': 1, 'device': 25,
+                          'input_file': 1, 'test_run': 10}
+    row = connection.execute(
+        'SELECT parent_id, data FROM inventory '
+        'WHERE kind = ? AND id = ?', ('test_run', 4)).fetchone()
+    assert row[0] == 3
+    assert json.loads(row[1]) == {'id': 4}
+
+
+@pytest.mark.parametrize('page_size,pages', [
+    (1, 8),
+    (3, 3),
+    (7, 2),
+    (100, 1),
+])
+def test_fetch_all_without_total(monkeypatch, page_size, pages):
+    projects = mock_collections()['me/projects']
+    requests = []
+
+    def get_wrapper(object, path=None, payload={}, headers={}):
+        requests.append(payload['offset'])
+        offset, limit = payload['offset'], payload['limit']
+        return {'data': projects[offset:offset + limit]}
+
+    monkeypatch.setattr(Bitbar, 'get', get_wrapper, raising=False)
+    bitbar = MozbitbarBitbar()
+
+    items = bitbar.fetch_all('me/projects', page_size=page_size)
+
+    assert items == projects
+    # paged on until a page is shorter than requested.
+    assert requests == [page * page_size for page in range(pages)]
+
+
+def test_bitbar_credentials():
+    bitbar = MozbitbarBitbar(TESTDROID_USERNAME='mock_user',
+                             TESTDROID_PASSWORD='mock_password',
+                             TESTDROID_URL='https://mock.url')
+
+    assert bitbar.user_name == 'mock_user'
+    assert bitbar.url == 'https://mock.url'
+
+
+@pytest.mark.parametrize('path,output_format,expected', [
+    ('inventory.ndjson', None, NDJSONSink),
+    ('inventory.db', None, SQLiteSink),
+    ('inventory.sqlite', None, SQLiteSink),
+    ('inventory.out', 'sqlite', SQLiteSink),
+    ('inventory.out', 'csv', ValueError),
+])
+def test_open_sink(tmpdir, path, output_format, expected):
+    path = tmpdir.join(path).strpath
+    if expected is ValueError:
+        with pytest.raises(ValueError):
+            open_sink(path, output_format)
+    else:
+        sink = open_sink(path, output_format)
+        assert isinstance(sink, expected)
+        sink.close()
@@ -0,0 +1,127 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import mock
+import pytest
+
+from mozbitbar import MozbitbarFileException, MozbitbarFrameworkException
+from mozbitbar.bitbar_project import BitbarProject
+
+_write_methods = [
+    'set_project_framework',
+    'set_project_config',
+    'set_project_parameters',
+    'delete_project_parameters',
+    'upload',
+]
+
+
+@pytest.fixture
+def initialize_project():
+    # initialize a dummy project for when the __init__ method is not
+    # under test.
+    kwargs = {
+        'project_name': 'mock_project',
+        'TESTDROID_USERNAME': 'MOCK_ENVIRONMENT_VALUE_TEST',
+        'TESTDROID_PASSWORD': 'MOCK_ENVIRONMENT_VALUE_TEST',
+        'TESTDROID_APIKEY': 'MOCK_ENVIRONMENT_VALUE_TEST',
+        'TESTDROID_URL': 'https://www.mock_test_env_var.com',
+    }
+    return BitbarProject('existing', **kwargs)
+
+
+@pytest.fixture
+def spy_writes(initialize_project):
+    # wrap every write method of the client so calls can be inspected.
+    spies = {}
+    for name in _write_methods:
+        spy = mock.Mock(wraps=getattr(initialize_project.client, name))
+        setattr(initialize_project.client, name, spy)
+        spies[name] = spy
+    return spies
+
+
+def test_reconcile_steady_state_is_read_only(write_tmp_file,
+                                             initialize_project, spy_writes):
+    path = write_tmp_file(' ', file_path='mock_file.zip')
+
+    changes = initialize_project.reconcile_project(
+        framework=99,
+        configs={'scheduler': 'PARALLEL'},
+        parameters=[{'key': 'mock_project_parameter_1',
+                     'value': 'mock_value_1'}],
+        files={'application_filename': path.strpath},
+        group='mock_device_group'
+    )
+
+    for spy in spy_writes.values():
+        assert not spy.called
+    assert changes['framework'] is None
+    assert changes['configs'] == {}
+    assert changes['set_parameters'] == []
+    assert changes['upload_files'] == {}
+    assert initialize_project.device_group_id == 7070
+
+
+def test_reconcile_applies_minimal_changes(write_tmp_file, initialize_project,
+                                           spy_writes):
+    path = write_tmp_file(' ', file_path='new_test_file.zip')
+    parameters = [
+        {'key': 'mock_project_parameter_1', 'value': 'mock_value_1'},
+        {'key': 'mock_project_parameter_2', 'value': 'changed_value'},
+        {'key': 'new_parameter', 'value': 'new_value'},
+    ]
+
+    changes = initialize_project.reconcile_project(
+        framework='mock_framework',
+        configs={'scheduler': 'SINGLE'},
+        parameters=parameters,
+        files={'test_filename': path.strpath}
+    )
+
+    spy_writes['set_project_framework'].assert_called_once_with(
+        initialize_project.project_id, 1)
+    spy_writes['set_project_config'].assert_called_once_with(
+        initialize_project.project_id, scheduler='SINGLE')
+    spy_writes['delete_project_parameters'].assert_called_once_with(
+        initialize_project.project_id, 320)
+    assert spy_writes['set_project_parameters'].call_count == 2
+    assert spy_writes['upload'].call_count == 1
+    assert changes['set_parameters'] == parameters[1:]
+    assert initialize_project.framework_id == 1
+
+
+def test_reconcile_dry_run(initialize_project, spy_writes):
+    changes = initialize_project.reconcile_project(
+        configs={'timeout': 600},
+        parameters=[{'key': 'new_parameter', 'value': 'new_value'}],
+        dry_run=True
+    )
+
+    for spy in spy_writes.values():
+        assert not spy.called
+    assert changes['configs'] == {'timeout': 600}
+    assert changes['set_parameters'] == [
+        {'key': 'new_parameter', 'value': 'new_value'}]
+
+
+@pytest.mark.parametrize('kwargs,expected', [
+    (
+        {'framework': 'nonexistent_framework'},
+        MozbitbarFrameworkException
+    ),
+    (
+        {'files': {'mock_filename': 'invalid_file_type'}},
+        MozbitbarFileException
+    ),
+    (
+        {'files': {'application_filename': 'invalid_path'}},
+        MozbitbarFileException
+    ),
+])
+def test_reconcile_invalid_state(initialize_project, kwargs, expected):
+    with pytest.raises(expected):
+        initialize_project.reconcile_project(**kwargs)
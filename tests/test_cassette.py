@@ -0,0 +1,150 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import gzip
+import time
+
+import pytest
+
+from mozbitbar import MozbitbarCassetteException, cassette
+from mozbitbar.bitbar_project import BitbarProject
+from mozbitbar.configuration import Configuration
+
+
+@pytest.fixture
+def fake_bitbar_options():
+    return {'latency': {'me': 0.05}}
+
+
+@pytest.fixture
+def fake_bitbar(fake_bitbar):
+    yield fake_bitbar
+    cassette.stop()
+
+
+@pytest.fixture
+def credentials(fake_bitbar):
+    return {'TESTDROID_USERNAME': 'fake_user',
+            'TESTDROID_PASSWORD': 'fake_password',
+            'TESTDROID_URL': fake_bitbar.url}
+
+
+@pytest.fixture
+def recorded(credentials, tmpdir):
+    path = tmpdir.join('project.cassette').strpath
+    cassette.record()
+    _project_lifecycle(credentials, tmpdir)
+    cassette.stop().save(path)
+    return path
+
+
+def _project_lifecycle(credentials, tmpdir):
+    upload = tmpdir.join('mock_test.zip')
+    upload.write('mock contents')
+
+    project = BitbarProject('new', project_name='fake_project',
+                            project_type='DEFAULT', **credentials)
+    project.set_project_parameters([{'key': 'fake_key', 'value': 'value'}])
+    project.upload_file(test_filename=upload.strpath)
+    project.set_device_group(2000)
+    project.start_test_run(name='fake_run')
+    project.notify_test_run_complete(interval=0, timeout=10)
+    return project.get_test_run(project.test_run_id)
+
+
+@pytest.mark.parametrize('method,path_url,expected', [
+    ('GET', '/api/v2/me', 'GET /api/v2/me'),
+    ('GET', '/api/v2/me/projects?offset=20&limit=10',
+     'GET /api/v2/me/projects?limit=10&offset=20'),
+    ('GET', '/api/v2/me?access_token=secret',
+     'GET /api/v2/me?access_token=SCRUBBED'),
+])
+def test_request_key(method, path_url, expected):
+    assert cassette.request_key(method, path_url) == expected
+
+
+def test_scrub():
+    value = {'access_token': 'secret', 'data': [{'password': 'secret',
+                                                 'name': 'kept'}]}
+
+    assert cassette.scrub(value) == {
+        'access_token': 'SCRUBBED',
+        'data': [{'password': 'SCRUBBED', 'name': 'kept'}]}
+
+
+def test_cassette_is_scrubbed(recorded):
+    with gzip.open(recorded, 'rb') as f:
+        contents = f.read().decode('utf-8')
+
+    assert 'POST /oauth/token' in contents
+    assert 'fake_password' not in contents
+    assert 'fake_user' not in contents
+    assert 'token-' not in contents
+
+
+def test_replay(fake_bitbar, credentials, recorded, tmpdir):
+    with gzip.open(recorded, 'rb') as f:
+        interactions = len(f.read().splitlines()) - 1
+    server_requests = sum(fake_bitbar.requests.values())
+
+    replayed = cassette.replay(recorded, scale=0)
+    run = _project_lifecycle(credentials, tmpdir)
+
+    assert run['state'] == 'FINISHED'
+    assert run['displayName'] == 'fake_run'
+    assert replayed.played == interactions
+    assert replayed.extra == 0
+    assert replayed.remaining == 0
+    # every response came from the cassette.
+    assert sum(fake_bitbar.requests.values()) == server_requests
+
+
+def test_replay_extra_and_unknown_requests(credentials, tmpdir):
+    path = tmpdir.join('projects.cassette').strpath
+    cassette.record()
+    config = Configuration(**credentials)
+    config.client.get_projects()
+    config.client.get_projects()
+    cassette.stop().save(path)
+
+    replayed = cassette.replay(path, scale=0)
+    config = Configuration(**credentials)
+    config.client.get_projects()
+    assert replayed.remaining == 1
+
+    config.client.get_projects()
+    config.client.get_projects()
+    assert replayed.remaining == 0
+    assert replayed.extra == 1
+
+    with pytest.raises(MozbitbarCassetteException):
+        config.client.get_device_groups(limit=3)
+
+
+def test_replay_timings(credentials, tmpdir):
+    path = tmpdir.join('me.cassette').strpath
+    cassette.record()
+    Configuration(**credentials)
+    cassette.stop().save(path)
+
+    cassette.replay(path, scale=1)
+    start = time.time()
+    Configuration(**credentials)
+    assert time.time() - start >= 0.05
+
+    cassette.replay(path, scale=0)
+    start = time.time()
+    Configuration(**credentials)
+    assert time.time() - start < 0.05
+
+
+def test_unsupported_version(tmpdir):
+    path = tmpdir.join('future.cassette').strpath
+    with gzip.open(path, 'wb') as f:
+        f.write(b'{"version": 99}\n')
+
+    with pytest.raises(MozbitbarCassetteException):
+        cassette.Cassette.load(path)
@@ -4,6 +4,10 @@
 
 from __future__ import absolute_import, print_function
 
+import os
+import subprocess
+import sys
+
 import pytest
 
 import mozbitbar.cli as cli
@@ -37,7 +41,65 @@ from mozbitbar import MozbitbarRecipeException
     ),
     (
         ['-r', 'mock_recipe_file', '-c', 'temp_file.yaml'],
-        {'credentials': 'temp_file.yaml', 'recipe': 'mock_recipe_file'}
+        {'credentials': 'temp_file.yaml', 'recipe': 'mock_recipe_file',
+         'command': 'run'}
+    ),
+    (
+        ['-r', 'mock_recipe_file', '--trace', 'trace.json'],
+        {'recipe': 'mock_recipe_file', 'trace': 'trace.json'}
+    ),
+    (
+        ['-r', 'mock_recipe_file', '--replay', 'recipe.cassette',
+         '--replay-scale', '0'],
+        {'replay': 'recipe.cassette', 'replay_scale': 0, 'record': None}
+    ),
+    (
+        ['serve', '-s', '/tmp/mock.sock'],
+        {'command': 'serve', 'socket': '/tmp/mock.sock', 'metrics': None}
+    ),
+    (
+        ['-r', 'mock_recipe_file', '--metrics', 'mozbitbar.prom'],
+        {'recipe': 'mock_recipe_file', 'metrics': 'mozbitbar.prom'}
+    ),
+    (
+        ['inventory', '-o', 'inventory.db', '-j', '16'],
+        {'command': 'inventory', 'output': 'inventory.db', 'workers': 16,
+         'format': None}
+    ),
+    (
+        ['cleanup', '--older-than', '30', '--kind', 'project', '--kind',
+         'input_file'],
+        {'command': 'cleanup', 'older_than': 30, 'execute': False,
+         'kind': ['project', 'input_file'], 'unused': False}
+    ),
+    (
+        ['sync', '--db', 'history.db', '-p', '11', '-p', '12'],
+        {'command': 'sync', 'db': 'history.db', 'project': [11, 12],
+         'full': False, 'workers': 8}
+    ),
+    (
+        ['pool', '--once', '-c', 'credentials.yaml'],
+        {'command': 'pool', 'db': None, 'once': True, 'interval': 60,
+         'credentials': 'credentials.yaml'}
+    ),
+    (
+        ['queue', '--since', '24', '-f', 'json'],
+        {'command': 'queue', 'db': None, 'since': 24, 'format': 'json'}
+    ),
+    (
+        ['list', 'runs', '-p', '11', '-f', 'ndjson'],
+        {'command': 'list', 'kind': 'runs', 'project': 11,
+         'format': 'ndjson', 'refresh': False, 'max_age': None}
+    ),
+    (
+        ['status', '757', '--project', '11', '--refresh'],
+        {'command': 'status', 'run': 757, 'project': 11, 'format': 'tsv',
+         'refresh': True}
+    ),
+    (
+        ['submit', '-r', 'mock_recipe', '-v'],
+        {'command': 'submit', 'recipe': 'mock_recipe', 'verbose': True,
+         'socket': None}
     )
 ])
 def test_cli(kwargs, expected):
@@ -64,3 +126,21 @@ def test_get_parser(parser_options):
     parser = cli.get_parser()
     for option in parser_options:
         assert option in parser._option_string_actions.keys()
+
+
+def test_cli_imports_standard_library_only():
+    # a fresh interpreter, as the modules are already loaded in this one.
+    code = '; '.join([
+        'import sys',
+        'from mozbitbar.main import cli',
+        "cli(['-r', 'mock_recipe'])",
+        "print(' '.join(sorted(set(name.split('.')[0] for name in "
+        "sys.modules if sys.modules[name]))))",
+    ])
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+
+    modules = output.decode('utf-8').split()
+    assert 'mozbitbar' in modules
+    for heavy in ('yaml', 'testdroid', 'requests'):
+        assert heavy not in modules
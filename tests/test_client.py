@@ -0,0 +1,194 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import threading
+import time
+
+import mock
+import pytest
+from testdroid import RequestResponseError
+
+from mozbitbar import client
+from mozbitbar.bitbar_project import BitbarProject
+from mozbitbar.configuration import Configuration
+
+
+class MockClient(object):
+    """Counts calls per method, returning a fresh response per call."""
+    def __init__(self, delay=0):
+        self.calls = {}
+        self.delay = delay
+
+    def _record(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        time.sleep(self.delay)
+        return {'data': [{'call': self.calls[name]}]}
+
+    def get_project_parameters(self, project_id):
+        return self._record('get_project_parameters')
+
+    def get_input_files(self):
+        return self._record('get_input_files')
+
+    def get_test_run(self, project_id, test_run_id):
+        if test_run_id < 0:
+            self._record('get_test_run')
+            raise RequestResponseError(msg='mock', status_code=404)
+        return self._record('get_test_run')
+
+    def delete_project_parameters(self, project_id, parameter_id):
+        self._record('delete_project_parameters')
+
+    def custom_write(self):
+        self._record('custom_write')
+
+
+@pytest.fixture
+def initialize_project():
+    # initialize a dummy project for when the __init__ method is not
+    # under test.
+    kwargs = {
+        'project_name': 'mock_project',
+        'TESTDROID_USERNAME': 'MOCK_ENVIRONMENT_VALUE_TEST',
+        'TESTDROID_PASSWORD': 'MOCK_ENVIRONMENT_VALUE_TEST',
+        'TESTDROID_APIKEY': 'MOCK_ENVIRONMENT_VALUE_TEST',
+        'TESTDROID_URL': 'https://www.mock_test_env_var.com',
+    }
+    return BitbarProject('existing', **kwargs)
+
+
+def test_wrapper_order():
+    calls = []
+
+    def factory(label):
+        class Wrapper(client.ClientWrapper):
+            def call(self, name, func, args, kwargs):
+                calls.append(label)
+                return func(*args, **kwargs)
+        return Wrapper
+
+    inner, outer = factory('inner'), factory('outer')
+    client.add_wrapper(outer, 1000)
+    client.add_wrapper(inner, 0)
+    try:
+        client.wrap(MockClient()).get_input_files()
+    finally:
+        client.remove_wrapper(inner)
+        client.remove_wrapper(outer)
+    assert calls == ['outer', 'inner']
+
+
+def test_call_through():
+    calls = []
+
+    class Wrapper(client.ClientWrapper):
+        def call(self, name, func, args, kwargs):
+            calls.append(name)
+            return func(*args, **kwargs)
+
+    wrapped = client.ResponseCache(Wrapper(Wrapper(MockClient())), window=60)
+    for _ in range(2):
+        assert client.call_through(wrapped, 'get_device_session_log',
+                                   lambda x: x * 2, 21) == 42
+
+    # raw requests are not cached.
+    assert calls == ['get_device_session_log'] * 4
+
+
+def test_response_cache_window():
+    mock_client = MockClient()
+    cache = client.ResponseCache(mock_client, window=60)
+
+    first = cache.get_project_parameters(11)
+    first['data'].append('mutated')
+    second = cache.get_project_parameters(11)
+    cache.get_project_parameters(99)
+
+    assert mock_client.calls['get_project_parameters'] == 2
+    assert second == {'data': [{'call': 1}]}
+
+
+def test_response_cache_expiry():
+    mock_client = MockClient()
+    cache = client.ResponseCache(mock_client, window=0.01)
+
+    cache.get_input_files()
+    time.sleep(0.02)
+    cache.get_input_files()
+    assert mock_client.calls['get_input_files'] == 2
+
+
+@pytest.mark.parametrize('write,args,input_files_calls', [
+    # deleting a parameter leaves input files untouched.
+    ('delete_project_parameters', (11, 319), 1),
+    # unknown writes invalidate every resource.
+    ('custom_write', (), 2),
+])
+def test_response_cache_invalidation(write, args, input_files_calls):
+    mock_client = MockClient()
+    cache = client.ResponseCache(mock_client, window=60)
+
+    cache.get_project_parameters(11)
+    cache.get_input_files()
+    getattr(cache, write)(*args)
+    cache.get_project_parameters(11)
+    cache.get_input_files()
+
+    assert mock_client.calls['get_project_parameters'] == 2
+    assert mock_client.calls['get_input_files'] == input_files_calls
+
+
+def test_response_cache_errors_not_cached():
+    mock_client = MockClient()
+    cache = client.ResponseCache(mock_client, window=60)
+
+    for _ in range(2):
+        with pytest.raises(RequestResponseError):
+            cache.get_test_run(11, -1)
+    assert mock_client.calls['get_test_run'] == 2
+
+
+def test_response_cache_in_flight():
+    mock_client = MockClient(delay=0.1)
+    cache = client.ResponseCache(mock_client, window=0)
+    results = []
+
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cache.get_test_run(11, 757)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert mock_client.calls['get_test_run'] == 1
+    assert results == [{'data': [{'call': 1}]}] * 5
+
+
+@pytest.mark.parametrize('window,expected', [
+    ('0', False),
+    ('5', True),
+])
+def test_coalescing_window(monkeypatch, window, expected):
+    monkeypatch.setenv('MOZBITBAR_COALESCE_WINDOW', window)
+    config = Configuration()
+    assert isinstance(config.client, client.ResponseCache) is expected
+
+
+def test_upload_file_lists_once(tmpdir, initialize_project):
+    files = {}
+    for file_type in ['application', 'test', 'data']:
+        path = tmpdir.join('{}_file.zip'.format(file_type))
+        path.write(' ')
+        files['{}_filename'.format(file_type)] = path.strpath
+
+    with mock.patch.object(initialize_project.client.client,
+                           'get_input_files',
+                           return_value={'data': []}) as get_input_files:
+        initialize_project.upload_file(**files)
+    assert get_input_files.call_count == 1
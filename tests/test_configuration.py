@@ -4,10 +4,12 @@
 
 from __future__ import print_function, absolute_import
 
+import mock
 import pytest
+from testdroid import Testdroid as Bitbar
 
 from mozbitbar import MozbitbarCredentialException
-from mozbitbar.configuration import Configuration
+from mozbitbar.configuration import Configuration, keep_clients_warm
 
 
 @pytest.mark.parametrize('kwargs,expected', [
@@ -135,3 +137,20 @@ def test_configuration_from_env_var(kwargs, expected, monkeypatch):
         for attribute, value in expected.iteritems():
             assert hasattr(config, attribute)
             assert getattr(config, attribute) == value
+
+
+def test_configuration_warm_clients():
+    """Ensures Configuration instances share one verified client when clients
+    are kept warm.
+    """
+    keep_clients_warm()
+    try:
+        with mock.patch.object(Bitbar, 'get_me') as get_me:
+            first = Configuration()
+            second = Configuration()
+        assert first.client is second.client
+        assert get_me.call_count == 1
+    finally:
+        keep_clients_warm(False)
+
+    assert Configuration().client is not first.client
@@ -0,0 +1,81 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import shutil
+import tempfile
+import threading
+
+import pytest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from mozbitbar import MozbitbarBaseException, daemon, log
+from mozbitbar.configuration import keep_clients_warm
+
+
+@pytest.fixture
+def recipe_server():
+    log.setup_logger()
+    # unix socket paths are length limited, so avoid the pytest tmpdir.
+    directory = tempfile.mkdtemp()
+    server = daemon.RecipeServer('/'.join([directory, 'mozbitbar.sock']))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    keep_clients_warm(False)
+    shutil.rmtree(directory)
+
+
+@pytest.mark.parametrize('test_recipe,expected', [
+    (
+        [
+            {
+                'action': 'set_device_group',
+                'arguments': {
+                    'group': 'second_mock_group'
+                }
+            }
+        ],
+        0
+    ),
+    (
+        [
+            {
+                'action': 'nonexistent_action'
+            }
+        ],
+        1
+    ),
+])
+def test_submit(recipe_server, write_tmp_file, base_recipe, test_recipe,
+                expected):
+    base_recipe.extend(test_recipe)
+    path = write_tmp_file(base_recipe)
+    stream = StringIO()
+
+    status = daemon.submit(path.strpath, socket_path=recipe_server.socket_path,
+                           stream=stream)
+
+    assert status == expected
+    assert 'Start executing Bitbar tasks' in stream.getvalue()
+
+
+def test_submit_without_server(tmpdir):
+    with pytest.raises(MozbitbarBaseException):
+        daemon.submit('mock_recipe.yaml',
+                      socket_path=tmpdir.join('missing.sock').strpath)
+
+
+def test_server_already_running(recipe_server):
+    with pytest.raises(MozbitbarBaseException) as exc:
+        daemon.RecipeServer(recipe_server.socket_path)
+    assert 'already running' in exc.value.message
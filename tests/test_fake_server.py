@@ -0,0 +1,132 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import time
+
+import pytest
+import requests
+from testdroid import RequestResponseError
+
+from mozbitbar.bitbar import Bitbar
+from mozbitbar.bitbar_project import BitbarProject
+
+SIZES = {'projects': 6, 'runs_per_project': 3, 'devices': 23, 'files': 4}
+
+
+@pytest.fixture
+def fake_bitbar_options():
+    return {'sizes': SIZES, 'page_size': 5}
+
+
+@pytest.fixture
+def credentials(fake_bitbar):
+    return {'TESTDROID_USERNAME': 'fake_user',
+            'TESTDROID_PASSWORD': 'fake_password',
+            'TESTDROID_URL': fake_bitbar.url}
+
+
+def test_pagination(fake_bitbar):
+    url = fake_bitbar.url + '/api/v2/devices'
+    headers = {'Authorization': 'Basic a2V5Og=='}
+
+    default = requests.get(url, headers=headers).json()
+    page = requests.get(url, params={'offset': 20, 'limit': 10},
+                        headers=headers).json()
+    everything = requests.get(url, params={'limit': 0},
+                              headers=headers).json()
+
+    assert len(default['data']) == 5
+    assert [device['id'] for device in page['data']] == [1020, 1021, 1022]
+    assert page['total'] == len(everything['data']) == 23
+
+
+def test_unauthorized(fake_bitbar):
+    response = requests.get(fake_bitbar.url + '/api/v2/me')
+    assert response.status_code == 401
+
+
+def test_inventory(fake_bitbar, credentials, tmpdir):
+    bitbar = Bitbar(**credentials)
+
+    counts = bitbar.snapshot_inventory(tmpdir.join('inventory.db').strpath,
+                                       page_size=2)
+
+    assert counts == {'project': 6, 'test_run': 18, 'device_group': 5,
+                      'device': 23, 'input_file': 4}
+    assert fake_bitbar.requests['token'] == 1
+
+
+def test_project_lifecycle(fake_bitbar, credentials, tmpdir):
+    upload = tmpdir.join('mock_test.zip')
+    upload.write('mock contents')
+
+    project = BitbarProject('new', project_name='fake_project',
+                            project_type='DEFAULT', **credentials)
+    project.set_project_framework(101)
+    project.set_project_parameters([{'key': 'fake_key', 'value': 'value'}])
+    # existing parameters are skipped.
+    project.set_project_parameters([{'key': 'fake_key', 'value': 'value'}])
+    project.upload_file(test_filename=upload.strpath)
+    project.set_device_group(2000)
+    project.start_test_run(name='fake_run')
+    project.notify_test_run_complete(interval=0, timeout=10)
+
+    assert project.get_test_run(project.test_run_id)['state'] == 'FINISHED'
+    assert fake_bitbar.requests['set_parameter'] == 2
+    assert fake_bitbar.uploaded_bytes > len('mock contents')
+    assert 'mock_test.zip' in [f['name'] for f in fake_bitbar.files]
+
+
+def test_add_project(fake_bitbar, credentials):
+    added = fake_bitbar.add_project('large_project', runs=30, parameters=25)
+
+    project = BitbarProject('existing', project_name='large_project',
+                            **credentials)
+
+    assert project.project_id == added['id']
+    assert len(project.get_all_test_runs()) == 30
+    parameters = project.client.get_project_parameters(project.project_id)
+    assert parameters['total'] == 25
+    assert parameters['data'][0]['key'] == 'key_0'
+
+
+def test_injected_errors_are_retried(fake_bitbar, credentials):
+    bitbar = Bitbar(**credentials)
+    fake_bitbar.inject_error('projects', 503, count=2)
+
+    projects = bitbar.client.get_projects()
+
+    assert len(projects['data']) == 6
+    assert fake_bitbar.requests['projects'] == 3
+
+    fake_bitbar.inject_error('project', 404)
+    with pytest.raises(RequestResponseError) as excinfo:
+        bitbar.client.get_project(projects['data'][0]['id'])
+    assert excinfo.value.status_code == 404
+
+
+@pytest.mark.parametrize('fake_bitbar', [{'latency': {'me': 0.1}}],
+                         indirect=True)
+def test_latency(fake_bitbar):
+    headers = {'Authorization': 'Basic a2V5Og=='}
+    start = time.time()
+    requests.get(fake_bitbar.url + '/api/v2/me', headers=headers)
+    assert time.time() - start >= 0.1
+
+    start = time.time()
+    requests.get(fake_bitbar.url + '/api/v2/devices', headers=headers)
+    assert time.time() - start < 0.1
+
+
+@pytest.mark.parametrize('fake_bitbar', [
+    {'error_rates': {'*': (0.5, 500)}, 'seed': 1}], indirect=True)
+def test_error_rates(fake_bitbar):
+    headers = {'Authorization': 'Basic a2V5Og=='}
+    statuses = [requests.get(fake_bitbar.url + '/api/v2/devices',
+                             headers=headers).status_code
+                for _ in range(40)]
+
+    assert set(statuses) == set([200, 500])
@@ -0,0 +1,377 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import time
+
+import pytest
+
+from mozbitbar import bitbar_project, history
+from mozbitbar.bitbar import Bitbar
+from mozbitbar.bitbar_project import BitbarProject
+from mozbitbar.history import DurationEstimate, RunHistory
+
+MINUTE = 60 * 1000
+
+
+def mock_run(run_id, name='mochitest', group=2000, minutes=10,
+             state='FINISHED', create_time=0):
+    run = {'id': run_id, 'displayName': name, 'projectId': 11,
+           'state': state, 'createTime': create_time,
+           'usedDeviceGroupId': group, 'startTime': create_time + MINUTE}
+    if state == 'FINISHED':
+        run['endTime'] = run['startTime'] + minutes * MINUTE
+    return run
+
+
+def mock_device_run(session_id, device, state='SUCCEEDED', minutes=5):
+    return {'id': session_id, 'state': state, 'startTime': 0,
+            'endTime': minutes * MINUTE,
+            'device': {'id': 1000 + session_id, 'displayName': device}}
+
+
+@pytest.fixture
+def run_history(tmpdir):
+    with RunHistory(tmpdir.join('history.db').strpath) as run_history:
+        yield run_history
+
+
+@pytest.fixture
+def fake_bitbar_options():
+    return {'sizes': {'projects': 3, 'runs_per_project': 4}}
+
+
+@pytest.fixture
+def credentials(fake_bitbar):
+    return {'TESTDROID_USERNAME': 'fake_user',
+            'TESTDROID_PASSWORD': 'fake_password',
+            'TESTDROID_URL': fake_bitbar.url}
+
+
+@pytest.mark.parametrize('fraction,expected', [
+    (0.5, 3),
+    (0.9, 5),
+    (0.2, 1),
+    (0, 1),
+    (1, 5),
+])
+def test_percentile(fraction, expected):
+    assert history.percentile([1, 2, 3, 4, 5], fraction) == expected
+
+
+def test_duration_percentiles(run_history):
+    for minutes in range(1, 11):
+        run_history.record_run(mock_run(minutes, minutes=minutes))
+    run_history.record_run(mock_run(20, name='reftest', minutes=60))
+    run_history.record_run(mock_run(21, group=2001, minutes=60))
+    run_history.record_run(mock_run(22, state='RUNNING'))
+
+    percentiles = run_history.duration_percentiles(
+        (0.5, 0.9), name='mochitest*', device_group=2000)
+
+    assert percentiles == {0.5: 300.0, 0.9: 540.0}
+    assert run_history.duration_percentiles(name='crashtest') == {}
+
+
+def test_device_filters(run_history):
+    run_history.record_run(
+        mock_run(1, create_time=0), [mock_device_run(10, 'Pixel', minutes=3)],
+        device_group_name='Group 0')
+    run_history.record_run(
+        mock_run(2, create_time=10 * MINUTE),
+        [mock_device_run(11, 'Pixel', minutes=7)],
+        device_group_name='Group 0')
+
+    assert run_history.durations(device='Pixel') == [180.0, 420.0]
+    assert run_history.durations(device='Pixel', since=600) == [420.0]
+    assert run_history.durations(device_group='Group 0') == [600.0, 600.0]
+
+
+def test_record_run_keeps_known_details(run_history):
+    run_history.record_run(mock_run(1, state='RUNNING'),
+                           project_name='mock_project',
+                           device_group_name='Group 0')
+    run = mock_run(1)
+    del run['usedDeviceGroupId']
+    run_history.record_run(run)
+
+    assert run_history.durations(device_group='Group 0',
+                                 project_id=11) == [600.0]
+    assert run_history.durations(device_group=2000) == [600.0]
+    assert run_history.pending_runs(11) == []
+
+
+def test_failure_rates(run_history):
+    run_history.record_run(mock_run(1), [
+        mock_device_run(10, 'Pixel'),
+        mock_device_run(11, 'Galaxy', 'FAILED'),
+        mock_device_run(12, 'iPhone', 'EXCLUDED'),
+    ])
+    run_history.record_run(mock_run(2), [
+        mock_device_run(20, 'Pixel', 'TIMEOUT'),
+        mock_device_run(21, 'Galaxy', 'FAILED'),
+        mock_device_run(22, 'iPhone', 'RUNNING'),
+    ])
+    run_history.record_run(mock_run(3, group=2001), [
+        mock_device_run(30, 'Pixel'),
+    ])
+
+    rates = run_history.failure_rates(device_group=2000)
+
+    assert rates == {
+        'Pixel': {'sessions': 2, 'failed': 1, 'rate': 0.5},
+        'Galaxy': {'sessions': 2, 'failed': 2, 'rate': 1.0},
+    }
+
+
+@pytest.mark.parametrize('name,expected', [
+    ('mochitest', 'mochitest'),
+    ('mochitest-2017-10-02-1', 'mochitest-*-*-*-*'),
+    ('reftest 7c3b8e0a-3c5e-4bf5-9a3f-8d2f0e5b1c2d', 'reftest *'),
+    ('suite[1]*?', 'suite[[]*][*][?]'),
+])
+def test_name_pattern(name, expected):
+    assert history.name_pattern(name) == expected
+
+
+def test_estimate(run_history):
+    # queued for a minute, then running for 10 to 19 minutes.
+    for i in range(10):
+        run_history.record_run(mock_run(i, name='suite-{}'.format(i),
+                                        minutes=10 + i),
+                               framework_id=7)
+    run_history.record_run(mock_run(20, name='suite-20', group=2001))
+
+    estimate = run_history.estimate('suite-42', device_group=2000,
+                                    framework_id=7)
+    assert estimate.samples == 10
+    assert (estimate.earliest, estimate.expected, estimate.latest) == (
+        660, 900, 1200)
+    assert estimate.timeout() == 1800
+
+    # too few runs on the group: runs of every group are considered.
+    assert run_history.estimate('suite-42', device_group=2001).samples == 11
+    assert run_history.estimate('suite-42', framework_id=8).samples == 11
+    assert run_history.estimate('crashtest-1') is None
+    assert run_history.estimate(
+        '7c3b8e0a-3c5e-4bf5-9a3f-8d2f0e5b1c2d') is None
+
+
+@pytest.mark.parametrize('elapsed,expected', [
+    # sparse polls until the earliest finish.
+    (0, 120),
+    (500, 50),
+    (590, 5),
+    # concentrated until the latest finish.
+    (700, 20),
+    (1000, 20),
+    # backing off once late.
+    (1100, 50),
+    (2000, 120),
+])
+def test_estimate_interval(elapsed, expected):
+    estimate = DurationEstimate([500, 600, 700, 800, 900])
+    estimate.earliest, estimate.latest = 600, 1000
+
+    assert estimate.interval(elapsed) == expected
+
+
+def test_estimate_minimum_timeout():
+    assert DurationEstimate([1, 2, 3]).timeout() == history.MIN_TIMEOUT
+
+
+def test_watermarks(run_history):
+    assert run_history.watermark(11) is None
+
+    run_history.set_watermark(11, 100)
+    run_history.set_watermark(11, 120)
+    run_history.record_run(mock_run(1, state='RUNNING'))
+    run_history.record_run(mock_run(2))
+
+    assert run_history.watermark(11) == 120
+    assert run_history.watermark(12) is None
+    assert run_history.pending_runs(11) == [1]
+
+
+def test_record_without_history(monkeypatch, tmpdir):
+    monkeypatch.delenv('MOZBITBAR_HISTORY', raising=False)
+    assert not history.record(mock_run(1))
+
+    path = tmpdir.join('history.db').strpath
+    monkeypatch.setenv('MOZBITBAR_HISTORY', path)
+    assert history.record(mock_run(1))
+    with RunHistory(path) as run_history:
+        assert run_history.durations() == [600.0]
+
+
+def test_notify_test_run_complete_records(fake_bitbar, credentials,
+                                          monkeypatch, tmpdir):
+    path = tmpdir.join('history.db').strpath
+    monkeypatch.setenv('MOZBITBAR_HISTORY', path)
+    project = BitbarProject('existing', project_name='Project 0',
+                            **credentials)
+    project.set_device_group('Group 1')
+    project.start_test_run(name='fake_run')
+
+    project.notify_test_run_complete(interval=0, timeout=10)
+
+    with RunHistory(path) as run_history:
+        assert len(run_history.durations(name='fake_run',
+                                         device_group='Group 1')) == 1
+        assert sorted(run_history.failure_rates(name='fake_run')) == [
+            'Device 0', 'Device 1']
+
+
+class _RecordedSleeps(object):
+    def __init__(self):
+        self.sleeps = []
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.mark.parametrize('kwargs,expected_sleeps', [
+    # estimated from the history: half of the 8 minutes past runs took,
+    # within MAX_INTERVAL.
+    ({}, [120, 120]),
+    # explicit values win.
+    ({'interval': 1, 'timeout': 60}, [1, 1]),
+    ({'interval': 1}, [1, 1]),
+    ({'timeout': 60}, [120]),
+])
+def test_notify_test_run_complete_estimates(fake_bitbar, credentials,
+                                            monkeypatch, tmpdir, kwargs,
+                                            expected_sleeps):
+    path = tmpdir.join('history.db').strpath
+    monkeypatch.setenv('MOZBITBAR_HISTORY', path)
+    with RunHistory(path) as run_history:
+        for i in range(5):
+            run_history.record_run(mock_run(i, name='nightly-{}'.format(i),
+                                            minutes=7),
+                                   device_group_id=2001)
+    fake_time = _RecordedSleeps()
+    monkeypatch.setattr(bitbar_project, 'time', fake_time)
+    project = BitbarProject('existing', project_name='Project 0',
+                            **credentials)
+    project.set_device_group('Group 1')
+    project.start_test_run(name='nightly-99')
+
+    project.notify_test_run_complete(**kwargs)
+
+    # the run finishes on the third poll, unless timed out.
+    assert fake_time.sleeps == expected_sleeps
+
+
+def test_notify_test_run_complete_late(fake_bitbar, credentials,
+                                       monkeypatch, tmpdir):
+    path = tmpdir.join('history.db').strpath
+    monkeypatch.setenv('MOZBITBAR_HISTORY', path)
+    with RunHistory(path) as run_history:
+        for i in range(5):
+            run_history.record_run(mock_run(i, name='nightly-{}'.format(i),
+                                            minutes=7),
+                                   device_group_id=2001)
+    fake_time = _RecordedSleeps()
+    monkeypatch.setattr(bitbar_project, 'time', fake_time)
+    project = BitbarProject('existing', project_name='Project 0',
+                            **credentials)
+    project.set_device_group('Group 1')
+    project.start_test_run(name='nightly-99')
+    # the run was created 475s before waiting for it, close to the 8
+    # minutes past runs took.
+    run = fake_bitbar._find_run(project.project_id, project.test_run_id)
+    run['createTime'] -= 475 * 1000
+
+    project.notify_test_run_complete()
+
+    assert fake_time.sleeps == [5, 5]
+
+
+def test_sync_history(fake_bitbar, credentials, run_history):
+    bitbar = Bitbar(**credentials)
+
+    counts = bitbar.sync_history(run_history, page_size=2)
+
+    assert counts == {'projects': 3, 'recorded': 12}
+    assert len(run_history.durations()) == 12
+    assert run_history.watermark(1000000) == max(
+        run['id'] for run in fake_bitbar.projects[1000000]['runs'])
+
+    # only the newest page of runs of every project is listed.
+    fake_bitbar.requests.clear()
+    counts = bitbar.sync_history(run_history, page_size=2)
+    assert counts == {'projects': 3, 'recorded': 0}
+    assert fake_bitbar.requests == {'projects': 2, 'runs': 3}
+
+    counts = bitbar.sync_history(run_history, full=True, page_size=2)
+    assert counts == {'projects': 3, 'recorded': 12}
+
+
+def test_sync_history_without_total(fake_bitbar, credentials, run_history,
+                                    monkeypatch):
+    page = fake_bitbar._page
+
+    def page_without_total(items, query):
+        status, response = page(items, query)
+        del response['total']
+        return status, response
+
+    monkeypatch.setattr(fake_bitbar, '_page', page_without_total)
+    bitbar = Bitbar(**credentials)
+
+    counts = bitbar.sync_history(run_history, project_ids=[1000000],
+                                 page_size=3)
+
+    assert counts == {'projects': 1, 'recorded': 4}
+    assert fake_bitbar.requests['runs'] == 2
+
+
+def test_sync_history_refreshes_pending_runs(fake_bitbar, credentials,
+                                             run_history):
+    bitbar = Bitbar(**credentials)
+    bitbar.sync_history(run_history, project_ids=[1000000])
+    project = BitbarProject('existing', project_name='Project 0',
+                            **credentials)
+    project.set_device_group('Group 1')
+    project.start_test_run(name='fake_run')
+
+    counts = bitbar.sync_history(run_history, project_ids=[1000000])
+    assert counts['recorded'] == 1
+    assert run_history.pending_runs(1000000) == [project.test_run_id]
+
+    # every refresh polls the run, which finishes after a few polls.
+    fake_bitbar.requests.clear()
+    while run_history.pending_runs(1000000):
+        assert bitbar.sync_history(run_history, project_ids=[1000000]) == {
+            'projects': 1, 'recorded': 1}
+    assert fake_bitbar.requests['runs'] == fake_bitbar.requests['run']
+    assert fake_bitbar.requests['device_runs'] == 1
+    assert sorted(run_history.failure_rates(name='fake_run')) == [
+        'Device 0', 'Device 1']
+
+
+def test_sync_history_unsorted_runs(fake_bitbar, credentials, run_history,
+                                    monkeypatch):
+    page = fake_bitbar._page
+
+    def unsorted_page(items, query):
+        return page(items, dict(query, sort=''))
+
+    monkeypatch.setattr(fake_bitbar, '_page', unsorted_page)
+    bitbar = Bitbar(**credentials)
+    bitbar.sync_history(run_history, project_ids=[1000000])
+    fake_bitbar.requests.clear()
+
+    counts = bitbar.sync_history(run_history, project_ids=[1000000],
+                                 page_size=2)
+
+    # older runs come first; every page is listed to find newer ones.
+    assert counts == {'projects': 1, 'recorded': 0}
+    assert fake_bitbar.requests == {'runs': 2}
@@ -4,10 +4,17 @@
 
 from __future__ import print_function, absolute_import
 
+import json
 import logging
+import threading
 
 import pytest
 
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
 from mozbitbar import log
 
 
@@ -49,3 +56,102 @@ def test_setup_logger(kwargs, expected):
     assert logger.level is expected['level']
     assert logger.name == expected['name']
     assert logger.handlers[0].formatter._fmt == expected['fmt']
+
+
+@pytest.fixture
+def stream_records(monkeypatch):
+    """Captures the records written by stream handlers."""
+    records = []
+
+    def emit(handler, record):
+        records.append((threading.current_thread().ident,
+                        handler.format(record)))
+
+    monkeypatch.setattr(logging.StreamHandler, 'emit', emit)
+    yield records
+    log.stop_listeners()
+
+
+def test_setup_logger_async(stream_records):
+    logger = log.setup_logger(name='mock_async', log_async=True)
+    assert isinstance(logger.handlers[0], log.BoundedQueueHandler)
+
+    arguments = ['mock']
+    logger.info('message %s', arguments)
+    # the message is merged when logged.
+    arguments.append('mutated')
+    log.stop_listeners('mock_async')
+
+    assert len(stream_records) == 1
+    thread, message = stream_records[0]
+    assert thread != threading.current_thread().ident
+    assert message.endswith("message ['mock']")
+
+
+def test_setup_logger_json(stream_records):
+    logger = log.setup_logger(name='mock_json', log_json=True)
+
+    logger.warning('mock %d', 1)
+
+    entry = json.loads(stream_records[0][1])
+    assert entry['level'] == 'WARNING'
+    assert entry['logger'] == 'mock_json'
+    assert entry['message'] == 'mock 1'
+    assert entry['function'] == 'test_setup_logger_json'
+
+
+@pytest.mark.parametrize('policy,expected_dropped', [
+    ('drop', 2),
+    ('block', 0),
+])
+def test_bounded_queue_handler(policy, expected_dropped):
+    queue = Queue(1)
+    handler = log.BoundedQueueHandler(queue, policy)
+    record = logging.makeLogRecord({'msg': 'mock %s', 'args': ('record',)})
+
+    handler.handle(record)
+    if policy == 'drop':
+        handler.handle(record)
+        handler.handle(record)
+    else:
+        # the second record waits until the first one is consumed.
+        consumer = threading.Timer(0.05, queue.get)
+        consumer.start()
+        handler.handle(record)
+        consumer.join()
+
+    assert handler.dropped == expected_dropped
+    assert queue.get_nowait().msg == 'mock record'
+
+
+def test_dropped_records_reported(monkeypatch):
+    records = []
+    handling = threading.Event()
+    release = threading.Event()
+
+    def emit(handler, record):
+        handling.set()
+        # hold the listener until the queue is full.
+        release.wait(10)
+        records.append(handler.format(record))
+
+    monkeypatch.setattr(logging.StreamHandler, 'emit', emit)
+    logger = log.setup_logger(name='mock_drop', log_async=True,
+                              log_queue_size=1, log_queue_policy='drop')
+    logger.info('handled')
+    handling.wait(10)
+    logger.info('queued')
+    logger.info('dropped')
+    logger.info('dropped')
+    release.set()
+
+    log.stop_listeners('mock_drop')
+
+    assert len(records) == 3
+    assert records[-1].endswith(
+        '2 log records were dropped: the log queue was full.')
+
+
+def test_bounded_queue_handler_invalid_policy():
+    with pytest.raises(ValueError):
+        log.BoundedQueueHandler(Queue(), 'mock_policy')
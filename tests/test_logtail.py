@@ -0,0 +1,140 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import io
+
+import mock
+import pytest
+
+from mozbitbar import bitbar_project
+from mozbitbar.bitbar_project import BitbarProject
+from mozbitbar.fake_server import RawResponse
+from mozbitbar.logtail import DeviceLogTail
+
+
+@pytest.fixture
+def fake_bitbar_options():
+    return {'run_polls': 3}
+
+
+@pytest.fixture
+def project(fake_bitbar):
+    project = BitbarProject('existing', project_name='Project 0',
+                            TESTDROID_USERNAME='fake_user',
+                            TESTDROID_PASSWORD='fake_password',
+                            TESTDROID_URL=fake_bitbar.url)
+    project.set_device_group(2000)
+    project.start_test_run(name='fake_run')
+    return project
+
+
+def _tail(project, **kwargs):
+    return DeviceLogTail(project.client, project.project_id,
+                         project.test_run_id, **kwargs)
+
+
+def test_tail_to_stream(project, capsys):
+    capsys.readouterr()
+
+    project.notify_test_run_complete(interval=0, timeout=10, tail_logs=True)
+
+    lines = capsys.readouterr().out.splitlines()
+    for device in ('Device 0', 'Device 1'):
+        prefix = '[{}] '.format(device)
+        assert [line[len(prefix):] for line in lines
+                if line.startswith(prefix)] == [
+            'Installing application', 'Test 1 passed', 'Test 2 passed',
+            'Test 3 passed', 'Tests finished']
+
+
+def test_tail_to_files(fake_bitbar, project, tmpdir):
+    log_dir = tmpdir.join('logs')
+
+    project.notify_test_run_complete(interval=0, timeout=10,
+                                     log_dir=log_dir.strpath)
+
+    sessions = fake_bitbar._sessions[project.test_run_id]
+    for session in sessions:
+        path = log_dir.join('{}-{}.log'.format(
+            session['id'], session['device']['displayName'].replace(' ', '_')))
+        assert path.read_binary() == fake_bitbar.logs[session['id']]
+        assert path.read_binary().endswith(b'Tests finished\n')
+
+
+def test_polls_fetch_new_output_only(fake_bitbar, project):
+    tail = _tail(project, stream=io.BytesIO())
+    fetched = tail.poll()
+    assert fetched == len(b'Installing application\n') * 2
+
+    # nothing new until the run progresses.
+    assert tail.poll() == 0
+    project.get_test_run(project.test_run_id)
+    assert tail.poll() == len(b'Test 1 passed\n') * 2
+
+
+def test_byte_ranges_not_supported(fake_bitbar, project, monkeypatch):
+    def whole_log(params, byte_range):
+        return 200, RawResponse(fake_bitbar.logs[int(params['session'])])
+
+    monkeypatch.setattr(fake_bitbar, '_device_log', whole_log)
+    stream = io.BytesIO()
+    tail = _tail(project, stream=stream)
+
+    tail.poll()
+    project.get_test_run(project.test_run_id)
+    tail.poll()
+    tail.close()
+
+    assert stream.getvalue().count(b'Installing application') == 2
+    assert stream.getvalue().count(b'Test 1 passed') == 2
+
+
+def test_partial_lines_are_held_back(fake_bitbar, project):
+    session = fake_bitbar._sessions[project.test_run_id][0]
+    fake_bitbar.logs[session['id']] += b'partial'
+    stream = io.BytesIO()
+    tail = _tail(project, stream=stream)
+
+    tail.poll()
+    assert b'partial' not in stream.getvalue()
+
+    tail.close()
+    assert stream.getvalue().endswith(b'[Device 0] partial\n')
+
+
+def test_hung_device(fake_bitbar, project):
+    session = fake_bitbar._sessions[project.test_run_id][1]
+    fake_bitbar.hung_sessions.add(session['id'])
+    tail = _tail(project, stream=io.BytesIO(), stall_timeout=0)
+
+    tail.poll()
+    project.get_test_run(project.test_run_id)
+    tail.poll()
+
+    assert tail._sessions[session['id']].stalled
+    assert not tail._sessions[
+        fake_bitbar._sessions[project.test_run_id][0]['id']].stalled
+
+
+def test_transient_errors_are_retried(fake_bitbar, project):
+    fake_bitbar.inject_error('device_log', 503)
+    tail = _tail(project, stream=io.BytesIO())
+
+    assert tail.poll() == len(b'Installing application\n') * 2
+    assert fake_bitbar.requests['device_log'] == 3
+
+
+def test_tail_failure_does_not_stop_wait(fake_bitbar, project):
+    fake_bitbar.inject_error('device_runs', 404, count=100)
+
+    with mock.patch.object(bitbar_project.logger, 'warning') as warning:
+        project.notify_test_run_complete(interval=0, timeout=10,
+                                         tail_logs=True)
+
+    assert str(project.get_test_run(project.test_run_id)['state']) == (
+        'FINISHED')
+    assert warning.call_args_list[0][0][0] == (
+        'Failed to tail device logs: %s')
@@ -0,0 +1,94 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import pytest
+from testdroid import RequestResponseError
+
+from mozbitbar import metrics
+from mozbitbar.client import ClientWrapper
+from mozbitbar.configuration import Configuration
+
+
+def _wrapper_types(client):
+    types = []
+    while isinstance(client, ClientWrapper):
+        types.append(type(client))
+        client = client.client
+    return types
+
+
+@pytest.fixture
+def enable_metrics():
+    metrics.enable()
+    yield
+    metrics.disable()
+
+
+def test_counter():
+    registry = metrics.Registry()
+    counter = registry.counter('mock_total', 'Mock counter.', ('endpoint',))
+    counter.inc(endpoint='get_me')
+    counter.inc(2, endpoint='get_me')
+
+    assert counter.value(endpoint='get_me') == 3
+    assert counter.value(endpoint='get_projects') == 0
+    assert registry.counter('mock_total', 'Mock counter.') is counter
+
+
+def test_registry_type_conflict():
+    registry = metrics.Registry()
+    registry.counter('mock_metric', 'Mock counter.')
+    with pytest.raises(ValueError):
+        registry.histogram('mock_metric', 'Mock histogram.')
+
+
+def test_render():
+    registry = metrics.Registry()
+    counter = registry.counter('mock_total', 'Mock counter.', ('endpoint',))
+    counter.inc(endpoint='get_"me"')
+    histogram = registry.histogram('mock_seconds', 'Mock histogram.',
+                                   ('endpoint',), buckets=(0.1, 1.0))
+    histogram.observe(0.5, endpoint='get_me')
+    histogram.observe(5.0, endpoint='get_me')
+
+    lines = registry.render().splitlines()
+    assert '# TYPE mock_total counter' in lines
+    assert 'mock_total{endpoint="get_\\"me\\""} 1' in lines
+    assert '# TYPE mock_seconds histogram' in lines
+    assert 'mock_seconds_bucket{endpoint="get_me",le="0.1"} 0' in lines
+    assert 'mock_seconds_bucket{endpoint="get_me",le="1.0"} 1' in lines
+    assert 'mock_seconds_bucket{endpoint="get_me",le="+Inf"} 2' in lines
+    assert 'mock_seconds_sum{endpoint="get_me"} 5.5' in lines
+    assert 'mock_seconds_count{endpoint="get_me"} 2' in lines
+
+
+def test_write(tmpdir):
+    registry = metrics.Registry()
+    registry.counter('mock_total', 'Mock counter.').inc()
+    path = tmpdir.join('mozbitbar.prom')
+
+    registry.write(path.strpath)
+    assert path.read() == registry.render()
+    assert tmpdir.listdir() == [path]
+
+
+def test_metrics_client(enable_metrics):
+    config = Configuration()
+    assert metrics.MetricsClient in _wrapper_types(config.client)
+    requests = metrics.api_requests.value(endpoint='get_test_run')
+    errors = metrics.api_errors.value(endpoint='get_test_run', status=404)
+    observations = metrics.api_duration.count(endpoint='get_test_run')
+
+    config.client.get_test_run(11, 757)
+    with pytest.raises(RequestResponseError):
+        config.client.get_test_run(11, -1)
+
+    assert metrics.api_requests.value(
+        endpoint='get_test_run') == requests + 2
+    assert metrics.api_errors.value(
+        endpoint='get_test_run', status=404) == errors + 1
+    assert metrics.api_duration.count(
+        endpoint='get_test_run') == observations + 2
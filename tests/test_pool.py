@@ -0,0 +1,212 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import subprocess
+import sys
+import time
+from argparse import Namespace
+
+import pytest
+
+from mozbitbar import MozbitbarFrameworkException, pool
+from mozbitbar.bitbar_project import BitbarProject
+from mozbitbar.pool import DIRTY, LEASED, READY, ProjectPool
+from mozbitbar.run import run_recipe
+
+TEMPLATE = {
+    'template': 'mochitest',
+    'project_type': 'DEFAULT',
+    'framework': 'Framework 1',
+    'parameters': [{'key': 'suite', 'value': 'mochitest'}],
+    'group': 'Group 1',
+    'pool_size': 2,
+}
+
+
+@pytest.fixture
+def path(tmpdir):
+    return tmpdir.join('pool.db').strpath
+
+
+@pytest.fixture
+def fake_bitbar_options():
+    return {'sizes': {'projects': 3}}
+
+
+@pytest.fixture
+def fake_bitbar(fake_bitbar, monkeypatch, path):
+    monkeypatch.setenv('MOZBITBAR_PROJECT_POOL', path)
+    return fake_bitbar
+
+
+@pytest.fixture
+def credentials(fake_bitbar):
+    return {'TESTDROID_USERNAME': 'fake_user',
+            'TESTDROID_PASSWORD': 'fake_password',
+            'TESTDROID_URL': fake_bitbar.url}
+
+
+@pytest.fixture
+def project_pool(path):
+    with ProjectPool(path) as project_pool:
+        yield project_pool
+
+
+def _lease(credentials):
+    return BitbarProject('pool', **dict(TEMPLATE, **credentials))
+
+
+def _replenished(project_pool, credentials):
+    definition = dict(TEMPLATE)
+    del definition['template'], definition['pool_size']
+    project_pool.register('mochitest', definition, 2)
+    return pool.replenish(project_pool, credentials)
+
+
+def _assert_template_state(fake_bitbar, project_id):
+    state = fake_bitbar.projects[project_id]
+    assert state['project']['frameworkId'] == 101
+    assert state['config']['usedDeviceGroupId'] is None
+    assert [(parameter['key'], parameter['value'])
+            for parameter in state['parameters']] == [('suite', 'mochitest')]
+
+
+def test_replenish(fake_bitbar, credentials, project_pool):
+    counts = _replenished(project_pool, credentials)
+
+    assert counts == {'mochitest': {READY: 2, LEASED: 0, DIRTY: 0}}
+    assert len(fake_bitbar.projects) == 5
+    for project_id in list(fake_bitbar.projects)[3:]:
+        _assert_template_state(fake_bitbar, project_id)
+
+    # the pool is full.
+    _replenished(project_pool, credentials)
+    assert len(fake_bitbar.projects) == 5
+
+
+def test_replenish_failing_template(fake_bitbar, credentials,
+                                    project_pool):
+    definition = dict(TEMPLATE, framework='No Such Framework')
+    del definition['template'], definition['pool_size']
+    project_pool.register('mochitest', definition, 2)
+
+    for _ in range(3):
+        counts = pool.replenish(project_pool, credentials)
+
+    # the project created by the first pass was deleted, and the template
+    # skipped since.
+    assert counts == {'mochitest': {READY: 0, LEASED: 0, DIRTY: 0}}
+    assert len(fake_bitbar.projects) == 3
+    assert fake_bitbar.requests['create_project'] == 1
+    assert not project_pool.due('mochitest')
+
+    # a corrected definition is tried right away.
+    _replenished(project_pool, credentials)
+    assert project_pool.counts('mochitest')[READY] == 2
+
+
+def test_lease_from_pool(fake_bitbar, credentials, project_pool):
+    _replenished(project_pool, credentials)
+    fake_bitbar.requests.clear()
+
+    project = _lease(credentials)
+
+    # nothing but the authentication of the client.
+    assert set(fake_bitbar.requests) <= set(['token', 'me'])
+    assert project.project_id in fake_bitbar.projects
+    assert project.framework_id == 101
+    assert (project.device_group_id, project.device_group_name) == (
+        2001, 'Group 1')
+    assert project_pool.counts('mochitest') == {READY: 1, LEASED: 1,
+                                                DIRTY: 0}
+
+
+def test_lease_from_empty_pool(fake_bitbar, credentials, project_pool):
+    project = _lease(credentials)
+
+    # projects are not listed for duplicates.
+    assert 'projects' not in fake_bitbar.requests
+    _assert_template_state(fake_bitbar, project.project_id)
+    assert project_pool.counts('mochitest')[LEASED] == 1
+    assert project_pool.templates()[0][2] == 2
+
+
+def test_lease_failing_template(fake_bitbar, credentials, project_pool):
+    with pytest.raises(MozbitbarFrameworkException):
+        BitbarProject('pool', **dict(TEMPLATE, framework='No Such Framework',
+                                     **credentials))
+
+    assert len(fake_bitbar.projects) == 3
+    assert project_pool.counts('mochitest') == {READY: 0, LEASED: 0,
+                                                DIRTY: 0}
+
+
+def test_return_resets_project(fake_bitbar, credentials, project_pool):
+    project = _lease(credentials)
+    project.set_project_parameters([{'key': 'extra', 'value': '1'}])
+    project.set_project_framework('Framework 2')
+
+    project.return_project()
+    project.return_project()
+
+    _assert_template_state(fake_bitbar, project.project_id)
+    assert project_pool.counts('mochitest') == {READY: 1, LEASED: 0,
+                                                DIRTY: 0}
+
+
+def test_lease_of_exited_process(fake_bitbar, credentials, project_pool):
+    project = _lease(credentials)
+    project.set_project_parameters([{'key': 'extra', 'value': '1'}])
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    project_pool._connection.execute('UPDATE projects SET pid = ?',
+                                     (process.pid,))
+
+    assert project_pool.counts('mochitest')[DIRTY] == 1
+    counts = pool.replenish(project_pool, credentials)
+
+    assert counts['mochitest'] == {READY: 2, LEASED: 0, DIRTY: 0}
+    _assert_template_state(fake_bitbar, project.project_id)
+
+
+def test_recipe_returns_project(fake_bitbar, credentials, project_pool,
+                                tmpdir):
+    recipe = tmpdir.join('recipe.yaml')
+    recipe.write('- project: pool\n'
+                 '  arguments:\n'
+                 '    template: mochitest\n'
+                 '    project_type: DEFAULT\n'
+                 '- action: set_project_parameters\n'
+                 '  arguments:\n'
+                 '    parameters:\n'
+                 '      - key: extra\n'
+                 '        value: 1\n')
+    credentials_file = tmpdir.join('credentials.yaml')
+    credentials_file.write('\n'.join('- {}: {}'.format(key, value)
+                                     for (key, value)
+                                     in credentials.items()))
+
+    run_recipe(recipe.strpath,
+               Namespace(credentials=credentials_file.strpath))
+
+    assert project_pool.counts('mochitest') == {READY: 1, LEASED: 0,
+                                                DIRTY: 0}
+    project_id = list(fake_bitbar.projects)[-1]
+    assert fake_bitbar.projects[project_id]['parameters'] == []
+
+
+def test_replenisher(fake_bitbar, credentials, project_pool, path):
+    _replenished(project_pool, credentials)
+    _lease(credentials)
+    replenisher = pool.Replenisher(path, credentials, interval=0.01)
+
+    replenisher.start()
+    while project_pool.counts('mochitest')[READY] < 2:
+        time.sleep(0.01)
+    replenisher.stop()
+
+    assert not replenisher.is_alive()
+    assert len(fake_bitbar.projects) == 6
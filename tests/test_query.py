@@ -0,0 +1,114 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import json
+import os
+
+import pytest
+from testdroid import Testdroid as Bitbar
+
+from mozbitbar import MozbitbarBaseException, query
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+@pytest.fixture
+def mock_get(monkeypatch, tmpdir):
+    monkeypatch.setenv('MOZBITBAR_CACHE_DIR', tmpdir.strpath)
+    collections = {
+        'me/device-groups': [{'id': i, 'osType': 'ANDROID',
+                              'displayName': u'group \xe9 {}'.format(i)}
+                             for i in range(5)],
+        'me/projects/11/runs': [{'id': 757, 'state': 'RUNNING'}],
+    }
+    requests = []
+
+    def get_wrapper(object, path=None, payload={}, headers={}):
+        requests.append(path)
+        data = collections[path]
+        offset, limit = payload['offset'], payload['limit']
+        return {'data': data[offset:offset + limit], 'total': len(data)}
+
+    monkeypatch.setattr(Bitbar, 'get', get_wrapper, raising=False)
+    return requests
+
+
+def test_list_resources_cached(mock_get):
+    first = query.list_resources('device-groups')
+    second = query.list_resources('device-groups')
+
+    assert [group['id'] for group in first] == list(range(5))
+    assert second == first
+    assert mock_get == ['me/device-groups']
+
+    query.list_resources('device-groups', refresh=True)
+    query.list_resources('device-groups', max_age=0)
+    assert len(mock_get) == 3
+
+
+def test_list_resources_per_account(mock_get):
+    query.list_resources('device-groups')
+    query.list_resources('device-groups', credentials={
+        'TESTDROID_APIKEY': 'mock_key', 'TESTDROID_URL': 'https://mock.url'})
+
+    assert len(mock_get) == 2
+
+
+def test_list_runs(mock_get):
+    with pytest.raises(MozbitbarBaseException):
+        query.list_resources('runs')
+
+    runs = query.list_resources('runs', project_id=11)
+    assert runs == [{'id': 757, 'state': 'RUNNING'}]
+
+
+@pytest.mark.parametrize('state,final', [
+    ('RUNNING', False),
+    ('FINISHED', True),
+])
+def test_run_status(mock_get, monkeypatch, state, final):
+    calls = []
+
+    def get_test_run_wrapper(object, project_id, test_run_id):
+        calls.append((project_id, test_run_id))
+        return {'id': test_run_id, 'state': state}
+
+    monkeypatch.setattr(Bitbar, 'get_test_run', get_test_run_wrapper)
+
+    assert query.run_status(757, 11)['state'] == state
+    # finished runs are served from the cache regardless of age.
+    query.run_status(757, 11, max_age=0)
+    assert len(calls) == (1 if final else 2)
+
+
+def test_cache_ignores_corrupt_file(tmpdir):
+    cache = query.QueryCache(tmpdir.strpath, 'mock_account')
+    cache.store('mock', [1, 2])
+    assert cache.load('mock', 60) == [1, 2]
+
+    with open(os.path.join(cache.directory, 'mock.json'), 'w') as f:
+        f.write('{')
+    assert cache.load('mock', 60) is None
+
+
+@pytest.mark.parametrize('output_format', ['tsv', 'json', 'ndjson'])
+def test_write_results(output_format):
+    results = [{'id': 1, 'name': 'first\tproject', 'type': 'DEFAULT'},
+               {'id': 2, 'name': None}]
+    stream = StringIO()
+
+    query.write_results(results, output_format, ('id', 'name'), stream)
+
+    lines = stream.getvalue().splitlines()
+    if output_format == 'tsv':
+        assert lines == ['id\tname', '1\tfirst project', '2\t']
+    elif output_format == 'json':
+        assert json.loads(lines[0]) == results
+    else:
+        assert [json.loads(line) for line in lines] == results
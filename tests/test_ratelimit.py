@@ -0,0 +1,152 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+from requests import Response
+from testdroid import RequestResponseError
+
+from mozbitbar import client, ratelimit
+from mozbitbar.configuration import Configuration
+
+
+class MockClient(object):
+    """Rejects the first calls with HTTP 429."""
+    def __init__(self, rejections):
+        self.rejections = rejections
+        self.calls = 0
+
+    def get_projects(self):
+        self.calls += 1
+        if self.calls <= self.rejections:
+            raise RequestResponseError(msg='mock', status_code=429)
+        return {'data': []}
+
+
+@pytest.fixture(autouse=True)
+def reset_buckets(monkeypatch):
+    monkeypatch.setattr(ratelimit, 'DEFAULT_RETRY_AFTER', 0.01)
+    ratelimit._buckets.clear()
+    yield
+    ratelimit._buckets.clear()
+
+
+@pytest.mark.parametrize('state_path', [False, True])
+def test_token_bucket_burst(tmpdir, state_path):
+    path = tmpdir.join('bucket.json').strpath if state_path else None
+    bucket = ratelimit.TokenBucket(rate=50, burst=2, state_path=path)
+
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() > 0
+
+
+def test_token_bucket_shared(tmpdir):
+    path = tmpdir.join('bucket.json').strpath
+    first = ratelimit.TokenBucket(rate=50, burst=1, state_path=path)
+    second = ratelimit.TokenBucket(rate=50, burst=1, state_path=path)
+
+    assert first.acquire() == 0
+    # the token was taken through the shared state file.
+    assert second.acquire() > 0
+
+
+def test_token_bucket_pause():
+    bucket = ratelimit.TokenBucket(rate=1000, burst=10)
+    bucket.pause(0.05)
+    start = time.time()
+    bucket.acquire()
+    assert time.time() - start >= 0.04
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('120', 120.0),
+    ('-1', 0.0),
+    (None, None),
+    ('not_a_date', None),
+    (formatdate(0, usegmt=True), 0.0),
+])
+def test_parse_retry_after(value, expected):
+    assert ratelimit.parse_retry_after(value) == expected
+
+
+@pytest.mark.parametrize('rejections,bucket,expected', [
+    (0, None, 1),
+    (2, None, 3),
+    (2, ratelimit.TokenBucket(rate=1000), 3),
+    (ratelimit.MAX_RATE_LIMITED_RETRIES + 1, None, RequestResponseError),
+])
+def test_rate_limited_client(rejections, bucket, expected):
+    mock_client = MockClient(rejections)
+    limited = ratelimit.RateLimitedClient(mock_client, bucket)
+    count = ratelimit.rate_limited.value(endpoint='get_projects')
+
+    if expected is RequestResponseError:
+        with pytest.raises(expected):
+            limited.get_projects()
+    else:
+        assert limited.get_projects() == {'data': []}
+        assert mock_client.calls == expected
+    assert ratelimit.rate_limited.value(
+        endpoint='get_projects') == count + min(
+            rejections, ratelimit.MAX_RATE_LIMITED_RETRIES)
+
+
+def test_record_retry_after():
+    def fake_send(send, request, **kwargs):
+        response = Response()
+        response.status_code = 429
+        response.headers['Retry-After'] = '7'
+        return response
+
+    client.add_transport_hook(ratelimit._record_retry_after)
+    client.add_transport_hook(fake_send)
+    try:
+        requests.get('https://mock.invalid/api/v2/me')
+    finally:
+        client.remove_transport_hook(fake_send)
+    assert ratelimit._retry_after.seconds == 7.0
+
+
+@pytest.mark.parametrize('env,expected', [
+    ({}, None),
+    ({'MOZBITBAR_RATE_LIMIT': '5'}, (5.0, 5.0)),
+    ({'MOZBITBAR_RATE_LIMIT': '5', 'MOZBITBAR_RATE_BURST': '20'},
+     (5.0, 20.0)),
+])
+def test_bucket_for(monkeypatch, env, expected):
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+
+    bucket = ratelimit.bucket_for('https://cloud.bitbar.com')
+    if expected is None:
+        assert bucket is None
+    else:
+        assert (bucket.rate, bucket.burst) == expected
+        assert ratelimit.bucket_for('https://cloud.bitbar.com/') is bucket
+
+
+def test_bucket_for_shared(monkeypatch, tmpdir):
+    monkeypatch.setenv('MOZBITBAR_RATE_LIMIT', '5')
+    monkeypatch.setenv('MOZBITBAR_RATE_LIMIT_DIR', tmpdir.strpath)
+
+    bucket = ratelimit.bucket_for('https://cloud.bitbar.com:443')
+    bucket.acquire()
+    assert tmpdir.join(
+        'mozbitbar-ratelimit-cloud.bitbar.com_443.json').check()
+
+
+def test_configuration_rate_limited(monkeypatch):
+    monkeypatch.setenv('MOZBITBAR_RATE_LIMIT', '5')
+    config = Configuration()
+
+    wrapped = config.client
+    while not isinstance(wrapped, ratelimit.RateLimitedClient):
+        wrapped = wrapped.client
+    assert wrapped.bucket is ratelimit.bucket_for(config.url)
@@ -0,0 +1,141 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import io
+import json
+
+import pytest
+
+from mozbitbar import MozbitbarTestRunException
+from mozbitbar.bitbar_project import BitbarProject
+from mozbitbar.results import RunSummary, _ChunkReader, parse_junit
+
+JUNIT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<testsuites>
+  <testsuite name="LoginSuite" tests="3">
+    <testcase classname="LoginTest" name="test_login" time="1.5"/>
+    <testcase classname="LoginTest" name="test_logout" time="0.25">
+      <failure message="expected true&#10;got false">trace</failure>
+    </testcase>
+    <testcase name="test_signup" time="0">
+      <skipped/>
+    </testcase>
+    <system-out>output</system-out>
+  </testsuite>
+  <testsuite name="ErrorSuite">
+    <testcase classname="ErrorTest" name="test_crash" time="bad">
+      <error>Process crashed</error>
+    </testcase>
+  </testsuite>
+</testsuites>
+"""
+
+
+@pytest.fixture
+def fake_bitbar_options():
+    return {'run_polls': 3}
+
+
+@pytest.fixture
+def project(fake_bitbar):
+    project = BitbarProject('existing', project_name='Project 0',
+                            TESTDROID_USERNAME='fake_user',
+                            TESTDROID_PASSWORD='fake_password',
+                            TESTDROID_URL=fake_bitbar.url)
+    project.set_device_group(2000)
+    project.start_test_run(name='fake_run')
+    return project
+
+
+def test_parse_junit():
+    cases = list(parse_junit(io.BytesIO(JUNIT)))
+
+    assert cases == [
+        {'name': 'test_login', 'classname': 'LoginTest', 'status': 'passed',
+         'duration': 1.5},
+        {'name': 'test_logout', 'classname': 'LoginTest', 'status': 'failed',
+         'duration': 0.25, 'message': 'expected true'},
+        {'name': 'test_signup', 'classname': 'LoginSuite',
+         'status': 'skipped', 'duration': 0.0},
+        {'name': 'test_crash', 'classname': 'ErrorTest', 'status': 'failed',
+         'duration': 0.0, 'message': 'Process crashed'},
+    ]
+
+
+def test_parse_junit_from_chunks():
+    chunks = [JUNIT[i:i + 7] for i in range(0, len(JUNIT), 7)]
+
+    assert len(list(parse_junit(_ChunkReader(chunks)))) == 4
+
+
+def test_run_summary():
+    summary = RunSummary()
+    summary.add_device(1, 'Device 0', 'FAILED')
+    summary.add_device(2, 'Device 1', 'SUCCEEDED')
+    summary.add_file(1, io.BytesIO(JUNIT))
+    summary.add(2, {'name': 'test_logout', 'classname': 'LoginTest',
+                    'status': 'passed', 'duration': 0.5})
+
+    result = summary.to_dict()
+    assert result['totals'] == {'tests': 5, 'passed': 2, 'failed': 2,
+                                'skipped': 1, 'duration': 2.25}
+    assert [(device['name'], device['tests'], device['failed'])
+            for device in result['devices']] == [('Device 0', 4, 2),
+                                                 ('Device 1', 1, 0)]
+    logout = result['tests']['LoginTest.test_logout']
+    assert (logout['passed'], logout['failed']) == (1, 1)
+    assert logout['failures'] == [{'device': 'Device 0',
+                                   'message': 'expected true'}]
+
+
+def test_summarize_test_run(fake_bitbar, project, tmpdir):
+    project.notify_test_run_complete(interval=0, timeout=10)
+    session = fake_bitbar._sessions[project.test_run_id][0]
+    fake_bitbar.add_output_file(session['id'], 'TEST-extra.xml', JUNIT)
+    fake_bitbar.add_output_file(session['id'], 'logcat.txt', b'<log/>')
+    output = tmpdir.join('summary.json')
+
+    result = project.summarize_test_run(output=output.strpath)
+
+    assert json.loads(output.read()) == result
+    assert result['test_run']['state'] == 'FINISHED'
+    # three tests on either device, and the extra file of the first one.
+    assert result['totals']['tests'] == 3 * 2 + 4
+    assert result['tests']['FakeSuite.test_1']['passed'] == 2
+    assert [device['tests'] for device in result['devices']] == [7, 3]
+
+
+def test_summarize_test_run_invalid_results(fake_bitbar, project):
+    project.notify_test_run_complete(interval=0, timeout=10)
+    session = fake_bitbar._sessions[project.test_run_id][0]
+    fake_bitbar.add_output_file(session['id'], 'TEST-broken.xml',
+                                b'<testsuite><testcase name="a"/><testcase')
+
+    result = project.summarize_test_run()
+
+    # cases read before the parse error are not counted.
+    assert result['totals']['tests'] == 3 * 2
+    assert [device['tests'] for device in result['devices']] == [3, 3]
+    assert 'a' not in result['tests']
+
+
+def test_summarize_test_run_retries_downloads(fake_bitbar, project):
+    project.notify_test_run_complete(interval=0, timeout=10)
+    fake_bitbar.inject_error('download', 502)
+
+    result = project.summarize_test_run()
+
+    assert [device['tests'] for device in result['devices']] == [3, 3]
+
+
+def test_summarize_test_run_without_test_run(fake_bitbar):
+    project = BitbarProject('existing', project_name='Project 0',
+                            TESTDROID_USERNAME='fake_user',
+                            TESTDROID_PASSWORD='fake_password',
+                            TESTDROID_URL=fake_bitbar.url)
+
+    with pytest.raises(MozbitbarTestRunException):
+        project.summarize_test_run()
@@ -0,0 +1,199 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import json
+
+import pytest
+import requests
+from testdroid import RequestResponseError
+
+from mozbitbar import MozbitbarCircuitOpenException, client, retry
+from mozbitbar.configuration import Configuration
+from mozbitbar.metrics import api_retries
+
+
+class MockClient(object):
+    """Fails the first calls with the given error."""
+    def __init__(self, failures, error):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return {'data': []}
+
+    def get_projects(self):
+        return self._call()
+
+    def create_project(self, name):
+        return self._call()
+
+
+@pytest.fixture(autouse=True)
+def reset_policies(monkeypatch):
+    monkeypatch.setattr(retry, '_default_policy', retry.RetryPolicy())
+    monkeypatch.setattr(retry, '_policies', {})
+    monkeypatch.setattr(retry.RetryingClient, 'sleep',
+                        staticmethod(lambda delay: None))
+    retry._breakers.clear()
+    yield
+    retry._breakers.clear()
+
+
+@pytest.mark.parametrize('error,expected', [
+    (RequestResponseError(msg='mock', status_code=503), True),
+    (RequestResponseError(msg='mock', status_code=408), True),
+    (RequestResponseError(msg='mock', status_code=404), False),
+    (RequestResponseError(msg='mock', status_code=429), False),
+    (requests.exceptions.ConnectionError(), True),
+    (requests.exceptions.ReadTimeout(), True),
+    (ValueError(), False),
+])
+def test_is_transient(error, expected):
+    assert retry.is_transient(error) == expected
+
+
+def test_delay_bounds():
+    policy = retry.RetryPolicy(base_delay=1, max_delay=5)
+    for attempt in range(1, 10):
+        delay = policy.delay(attempt)
+        assert 0 <= delay <= min(5, 2 ** (attempt - 1))
+
+
+def test_retries_transient_read():
+    mock_client = MockClient(
+        2, RequestResponseError(msg='mock', status_code=502))
+    before = api_retries.value(endpoint='get_projects')
+
+    assert retry.RetryingClient(mock_client).get_projects() == {'data': []}
+    assert mock_client.calls == 3
+    assert api_retries.value(endpoint='get_projects') == before + 2
+
+
+def test_gives_up_after_max_attempts():
+    retry.configure(default=retry.RetryPolicy(max_attempts=3))
+    mock_client = MockClient(
+        5, RequestResponseError(msg='mock', status_code=503))
+
+    with pytest.raises(RequestResponseError):
+        retry.RetryingClient(mock_client).get_projects()
+    assert mock_client.calls == 3
+
+
+@pytest.mark.parametrize('error', [
+    RequestResponseError(msg='mock', status_code=404),
+    ValueError('mock'),
+])
+def test_permanent_error_not_retried(error):
+    mock_client = MockClient(1, error)
+
+    with pytest.raises(type(error)):
+        retry.RetryingClient(mock_client).get_projects()
+    assert mock_client.calls == 1
+
+
+@pytest.mark.parametrize('retry_writes,expected_calls', [
+    (False, 1),
+    (True, 2),
+])
+def test_writes_not_retried_by_default(retry_writes, expected_calls):
+    retry.configure(create_project=retry.RetryPolicy(
+        retry_writes=retry_writes))
+    mock_client = MockClient(
+        1, RequestResponseError(msg='mock', status_code=503))
+    wrapped = retry.RetryingClient(mock_client)
+
+    if retry_writes:
+        wrapped.create_project('mock')
+    else:
+        with pytest.raises(RequestResponseError):
+            wrapped.create_project('mock')
+    assert mock_client.calls == expected_calls
+
+
+def test_circuit_breaker_opens(monkeypatch):
+    retry.configure(default=retry.RetryPolicy(
+        max_attempts=2, failure_threshold=4, reset_timeout=60))
+    mock_client = MockClient(
+        100, RequestResponseError(msg='mock', status_code=500))
+    wrapped = retry.RetryingClient(mock_client)
+
+    for _ in range(2):
+        with pytest.raises(RequestResponseError):
+            wrapped.get_projects()
+    assert mock_client.calls == 4
+
+    # the endpoint is no longer called while the breaker is open.
+    with pytest.raises(MozbitbarCircuitOpenException):
+        wrapped.get_projects()
+    assert mock_client.calls == 4
+
+    # after the reset timeout, a trial call closes the breaker.
+    breaker = retry.breaker_for('get_projects')
+    breaker.opened_at -= 60
+    mock_client.failures = 0
+    assert wrapped.get_projects() == {'data': []}
+    assert breaker.opened_at is None
+
+
+def test_circuit_breaker_failed_trial():
+    breaker = retry.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+
+    assert breaker.record_failure()
+    assert breaker.allow()
+    # only a single trial call is let through.
+    assert not breaker.allow()
+    assert breaker.record_failure()
+
+
+def test_circuit_breaker_trial_permanent_error():
+    retry.configure(default=retry.RetryPolicy(
+        max_attempts=1, failure_threshold=1, reset_timeout=60))
+    mock_client = MockClient(
+        1, RequestResponseError(msg='mock', status_code=500))
+    wrapped = retry.RetryingClient(mock_client)
+
+    with pytest.raises(RequestResponseError):
+        wrapped.get_projects()
+    breaker = retry.breaker_for('get_projects')
+    breaker.opened_at -= 60
+
+    # the trial call fails with an error which is not transient.
+    mock_client.calls = 0
+    mock_client.error = RequestResponseError(msg='mock', status_code=404)
+    with pytest.raises(RequestResponseError):
+        wrapped.get_projects()
+
+    assert breaker.opened_at is None
+    assert wrapped.get_projects() == {'data': []}
+
+
+def test_load_policies(tmpdir):
+    path = tmpdir.join('retry.json')
+    path.write(json.dumps({
+        'default': {'max_attempts': 2},
+        'get_test_run': {'max_attempts': 9, 'max_delay': 120},
+    }))
+
+    retry.load_policies(path.strpath)
+
+    assert retry.policy_for('get_projects').max_attempts == 2
+    assert retry.policy_for('get_test_run').max_attempts == 9
+    assert retry.policy_for('get_test_run').max_delay == 120
+
+
+def test_configuration_wraps_client():
+    config = Configuration()
+
+    wrapper = config.client
+    while isinstance(wrapper, client.ClientWrapper):
+        if isinstance(wrapper, retry.RetryingClient):
+            break
+        wrapper = wrapper.client
+    assert isinstance(wrapper, retry.RetryingClient)
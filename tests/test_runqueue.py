@@ -0,0 +1,179 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from argparse import Namespace
+
+import pytest
+
+from mozbitbar.bitbar_project import BitbarProject
+from mozbitbar.run import run_recipe
+from mozbitbar.runqueue import RunQueue, wait_duration
+
+
+@pytest.fixture
+def path(tmpdir):
+    return tmpdir.join('queue.db').strpath
+
+
+@pytest.fixture
+def run_queue(path):
+    with RunQueue(path, max_runs=1, poll_interval=0.01) as run_queue:
+        yield run_queue
+
+
+def _exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_priority_order(run_queue):
+    holder = run_queue.acquire()
+    low = run_queue.submit(priority=0)
+    high = run_queue.submit(priority=10)
+    later_low = run_queue.submit(priority=0)
+
+    assert not run_queue.dispatch(high)
+    run_queue.release(holder)
+    assert not run_queue.dispatch(low)
+    assert run_queue.dispatch(high)
+
+    run_queue.release(high)
+    assert not run_queue.dispatch(later_low)
+    assert run_queue.dispatch(low)
+
+
+def test_max_runs(path):
+    with RunQueue(path, max_runs=2) as run_queue:
+        run_queue.acquire()
+        run_queue.acquire()
+
+        assert not run_queue.dispatch(run_queue.submit())
+
+
+def test_try_acquire(run_queue):
+    holder = run_queue.try_acquire()
+    assert holder
+
+    assert run_queue.try_acquire(priority=10) is None
+    assert 10 not in run_queue.stats()
+    run_queue.release(holder)
+    assert run_queue.try_acquire()
+
+
+def test_entries_of_exited_processes(run_queue):
+    holder = run_queue.acquire()
+    waiting = run_queue.submit()
+    pid = _exited_pid()
+    run_queue._connection.execute('UPDATE entries SET pid = ?', (pid,))
+
+    entry = run_queue.submit()
+
+    assert run_queue.dispatch(entry)
+    assert run_queue._connection.execute(
+        'SELECT id, released IS NOT NULL FROM entries ORDER BY id'
+    ).fetchall() == [(holder, 1), (entry, 0)]
+    with pytest.raises(KeyError):
+        run_queue.dispatch(waiting)
+
+
+def test_stats(run_queue):
+    count = wait_duration.count(priority=7)
+    run_queue.release(run_queue.acquire(priority=7))
+    run_queue.acquire(priority=7)
+    run_queue.submit(priority=3)
+
+    stats = run_queue.stats()
+
+    assert sorted(stats) == [3, 7]
+    assert stats[7]['running'] == 1
+    assert stats[7]['dispatched'] == 2
+    assert stats[7]['wait_max'] >= stats[7]['wait_p50'] >= 0
+    assert stats[3] == {'waiting': 1, 'running': 0, 'dispatched': 0,
+                        'wait_p50': None, 'wait_p95': None,
+                        'wait_max': None}
+    assert wait_duration.count(priority=7) == count + 2
+    assert run_queue.stats(since=time.time() + 1)[7]['dispatched'] == 0
+
+
+def _wait_for_slot(path, priority, output):
+    with RunQueue(path, max_runs=1, poll_interval=0.01) as run_queue:
+        entry_id = run_queue.acquire(priority=priority)
+        with open(output, 'a') as f:
+            f.write('{}\n'.format(priority))
+        run_queue.release(entry_id)
+
+
+def test_processes_share_slots(run_queue, path, tmpdir):
+    output = tmpdir.join('order').strpath
+    holder = run_queue.acquire()
+    processes = []
+    for priority in (0, 10, 5):
+        process = multiprocessing.Process(target=_wait_for_slot,
+                                          args=(path, priority, output))
+        process.start()
+        processes.append(process)
+    while sum(priority['waiting']
+              for priority in run_queue.stats().values()) != 3:
+        time.sleep(0.01)
+
+    assert not os.path.exists(output)
+    run_queue.release(holder)
+    for process in processes:
+        process.join(10)
+
+    with open(output) as f:
+        assert f.read().split() == ['10', '5', '0']
+
+
+@pytest.fixture
+def fake_bitbar(fake_bitbar, monkeypatch, path):
+    monkeypatch.setenv('MOZBITBAR_RUN_QUEUE', path)
+    monkeypatch.setenv('MOZBITBAR_MAX_RUNS', '2')
+    return fake_bitbar
+
+
+def test_start_test_run_takes_slot(fake_bitbar, run_queue):
+    project = BitbarProject('existing', project_name='Project 0',
+                            TESTDROID_USERNAME='fake_user',
+                            TESTDROID_PASSWORD='fake_password',
+                            TESTDROID_URL=fake_bitbar.url)
+    project.set_device_group(2000)
+
+    project.start_test_run(name='fake_run', priority=3)
+    assert run_queue.stats()[3]['running'] == 1
+
+    project.notify_test_run_complete(interval=0, timeout=10)
+    assert run_queue.stats()[3]['running'] == 0
+
+
+def test_recipe_releases_slot(fake_bitbar, run_queue, tmpdir):
+    recipe = tmpdir.join('recipe.yaml')
+    recipe.write('- project: existing\n'
+                 '  arguments:\n'
+                 '    project_name: Project 0\n'
+                 '- action: set_device_group\n'
+                 '  arguments:\n'
+                 '    group: 2000\n'
+                 '- action: start_test_run\n'
+                 '  arguments:\n'
+                 '    name: fake_run\n'
+                 '    priority: 3\n')
+    credentials = tmpdir.join('credentials.yaml')
+    credentials.write('- TESTDROID_USERNAME: fake_user\n'
+                      '- TESTDROID_PASSWORD: fake_password\n'
+                      '- TESTDROID_URL: {}\n'.format(fake_bitbar.url))
+
+    # the recipe ends without waiting for the run to finish.
+    run_recipe(recipe.strpath, Namespace(credentials=credentials.strpath))
+
+    assert run_queue.stats()[3] == dict(run_queue.stats()[3], running=0,
+                                        dispatched=1)
@@ -0,0 +1,138 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import pytest
+
+from mozbitbar import MozbitbarDeviceException
+from mozbitbar.bitbar_project import BitbarProject
+from mozbitbar.history import RunHistory
+from mozbitbar.runqueue import RunQueue
+from mozbitbar.scheduler import Scheduler, plan
+
+MINUTE = 60 * 1000
+
+
+@pytest.fixture
+def project(fake_bitbar):
+    return BitbarProject('existing', project_name='Project 0',
+                         TESTDROID_USERNAME='fake_user',
+                         TESTDROID_PASSWORD='fake_password',
+                         TESTDROID_URL=fake_bitbar.url)
+
+
+def _same(duration, groups=(1, 2)):
+    return dict((group, duration) for group in groups)
+
+
+def test_plan_longest_first():
+    durations = [_same(duration) for duration in (2, 3, 2, 3, 2)]
+
+    assignment, makespan = plan(durations, {1: 0, 2: 0})
+
+    assert assignment == {1: [1, 0, 4], 2: [3, 2]}
+    assert makespan == 7
+
+
+def test_plan_load_and_group_durations():
+    durations = [_same(5), {1: 2, 2: 10}, _same(5)]
+
+    assignment, makespan = plan(durations, {1: 10, 2: 0})
+
+    # the busy group is still the fastest for the second run.
+    assert assignment == {1: [1], 2: [0, 2]}
+    assert makespan == 12
+
+
+def test_schedule_test_runs(fake_bitbar, project):
+    runs = [{'name': 'run-{}'.format(duration), 'duration': duration}
+            for duration in (10, 40, 20, 30)]
+
+    results = project.schedule_test_runs(runs, groups=['Group 0', 2001],
+                                         interval=0)
+
+    assert [(result['name'], result['device_group_id'])
+            for result in results] == [('run-40', 2000), ('run-30', 2001),
+                                       ('run-20', 2000), ('run-10', 2001)]
+    assert set(result['state'] for result in results) == set(['FINISHED'])
+    for result in results:
+        run = [run for run in fake_bitbar.projects[project.project_id]['runs']
+               if run['id'] == result['test_run_id']][0]
+        assert run['usedDeviceGroupId'] == result['device_group_id']
+
+
+def test_device_concurrency(fake_bitbar, project, monkeypatch):
+    busy_groups = []
+    start = Scheduler._start
+
+    def record_start(self, *args):
+        busy_groups.append(len(self.active))
+        return start(self, *args)
+
+    monkeypatch.setattr(Scheduler, '_start', record_start)
+    runs = [{'name': 'run-{}'.format(i), 'duration': 10} for i in range(3)]
+
+    # every group has 10 devices.
+    results = project.schedule_test_runs(runs, groups=[2000, 2001],
+                                         max_devices=15, interval=0)
+
+    assert len(results) == 3
+    assert busy_groups == [0, 0, 0]
+
+
+def test_run_queue_slots(fake_bitbar, project, monkeypatch, tmpdir):
+    path = tmpdir.join('queue.db').strpath
+    monkeypatch.setenv('MOZBITBAR_RUN_QUEUE', path)
+    runs = [{'name': 'run-10', 'duration': 10},
+            {'name': 'run-40', 'duration': 40}]
+
+    # a single slot: the second run starts once the first finishes.
+    results = project.schedule_test_runs(runs, groups=['Group 0', 2001],
+                                         interval=0)
+
+    assert [result['name'] for result in results] == ['run-40', 'run-10']
+    assert set(result['state'] for result in results) == set(['FINISHED'])
+    with RunQueue(path) as run_queue:
+        assert run_queue.stats()[0] == dict(run_queue.stats()[0], waiting=0,
+                                            running=0, dispatched=2)
+
+
+def test_active_runs_count_as_load(fake_bitbar, project):
+    project.set_device_group(2000)
+    project.start_test_run(name='running elsewhere')
+
+    results = project.schedule_test_runs(
+        [{'name': 'short', 'duration': 10}], groups=[2000, 2001], interval=0)
+
+    assert results[0]['device_group_id'] == 2001
+
+
+def test_durations_from_history(fake_bitbar, project, monkeypatch, tmpdir):
+    path = tmpdir.join('history.db').strpath
+    monkeypatch.setenv('MOZBITBAR_HISTORY', path)
+    with RunHistory(path) as run_history:
+        for i in range(5):
+            # slow on the first group, fast on the second.
+            for group, minutes in ((2000, 60), (2001, 5)):
+                run_history.record_run(
+                    {'id': group * 10 + i, 'displayName': 'suite-{}'.format(i),
+                     'state': 'FINISHED', 'createTime': 0, 'startTime': 0,
+                     'endTime': minutes * MINUTE, 'usedDeviceGroupId': group})
+
+    scheduler = Scheduler(project, groups=[2000, 2001], interval=0)
+    results = scheduler.run([{'name': 'suite-9'}, {'name': 'other'}])
+
+    assert [(result['name'], result['device_group_id'])
+            for result in results] == [('other', 2000), ('suite-9', 2001)]
+
+
+@pytest.mark.parametrize('groups,max_devices', [
+    (['Group 99'], None),
+    # no group fits the device concurrency.
+    (None, 5),
+])
+def test_no_usable_group(fake_bitbar, project, groups, max_devices):
+    with pytest.raises(MozbitbarDeviceException):
+        Scheduler(project, groups=groups, max_devices=max_devices)
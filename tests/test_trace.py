@@ -0,0 +1,96 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import, print_function
+
+import json
+from argparse import Namespace
+
+import pytest
+import requests
+from requests import Response
+
+from mozbitbar import client, trace
+from mozbitbar.configuration import Configuration
+from mozbitbar.run import run_recipe
+
+
+@pytest.fixture
+def tracer():
+    yield trace.enable()
+    trace.disable()
+
+
+def test_tracer_span():
+    tracer = trace.Tracer()
+    with tracer.span('mock_span', 'task', mock_arg=1) as args:
+        args['status'] = 200
+
+    output = tracer.to_chrome_trace()
+    assert len(output['traceEvents']) == 1
+    event = output['traceEvents'][0]
+    assert event['name'] == 'mock_span'
+    assert event['ph'] == 'X'
+    assert event['dur'] >= 0
+    assert event['args'] == {'mock_arg': 1, 'status': 200}
+
+
+def test_span_disabled():
+    assert trace.active() is None
+    with trace.span('mock_span') as args:
+        assert args == {}
+
+
+def test_tracing_client(tracer):
+    config = Configuration()
+    assert isinstance(config.client, trace.TracingClient)
+
+    config.client.get_projects()
+    names = [event['name'] for event in tracer.events]
+    assert names == ['get_me', 'get_projects']
+    assert all(event['cat'] == 'api' for event in tracer.events)
+
+
+def test_tracing_disabled_client():
+    config = Configuration()
+    assert not isinstance(config.client, trace.TracingClient)
+
+
+def test_trace_http_request(tracer):
+    def fake_send(send, request, **kwargs):
+        response = Response()
+        response.status_code = 404
+        response._content = b'not found'
+        return response
+
+    client.add_transport_hook(fake_send)
+    try:
+        response = requests.get('https://mock.invalid/api/v2/me?limit=0')
+    finally:
+        client.remove_transport_hook(fake_send)
+
+    assert response.status_code == 404
+    event = tracer.events[-1]
+    assert event['name'] == 'GET /api/v2/me'
+    assert event['cat'] == 'http'
+    assert event['args']['status'] == 404
+    assert event['args']['bytes'] == 9
+
+
+def test_trace_recipe(tracer, tmpdir, write_tmp_file, base_recipe):
+    base_recipe.append({
+        'action': 'set_device_group',
+        'arguments': {'group': 'mock_device_group'}
+    })
+    path = write_tmp_file(base_recipe)
+
+    run_recipe(path.strpath, Namespace(credentials=None))
+
+    output = tmpdir.join('trace.json')
+    tracer.write(output.strpath)
+    events = json.loads(output.read())['traceEvents']
+    names = [event['name'] for event in events]
+    for name in ['initialize_recipe', 'initialize_bitbar', 'set_device_group',
+                 'get_device_groups']:
+        assert name in names